@@ -0,0 +1,10 @@
+"""TrackML library benchmarks
+
+Synthetic event generation and a benchmark runner for the dataset loaders,
+the weight computation, the scoring, and the randomized submissions.
+
+Run from the repository root, e.g.
+
+    python -m benchmarks.generate path/to/output --events 3 --hits 100000
+    python -m benchmarks.run --hits 100000 --output results.json
+"""
@@ -0,0 +1,268 @@
+"""Synthetic TrackML events for benchmarking
+
+The generated events follow the structure and the rough distributions of the
+TrackML datasets, i.e. particles from a smeared vertex that leave hits on a
+sequence of cylindrical detector layers in a solenoid field plus uniformly
+distributed noise hits. They are not physically accurate, but have realistic
+sizes, types, and id ranges.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import os.path as op
+import zipfile
+
+import numpy
+import pandas
+
+from trackml.dataset import DTYPES
+from trackml.weights import weight_hits_phase1
+
+# (volume_id, layer_id, radius in mm, half-length in mm) for each layer
+LAYERS = [
+    (8, 2, 32., 455.),
+    (8, 4, 72., 455.),
+    (8, 6, 116., 455.),
+    (8, 8, 172., 455.),
+    (13, 2, 260., 1030.),
+    (13, 4, 360., 1030.),
+    (13, 6, 500., 1030.),
+    (13, 8, 660., 1030.),
+    (17, 2, 820., 1030.),
+    (17, 4, 1020., 1030.),
+]
+# endcap volumes for hits beyond the barrel half-length at negative/positive z
+ENDCAP_VOLUMES = {8: (7, 9), 13: (12, 14), 17: (16, 18)}
+# solenoid field in Tesla
+BFIELD = 2.
+NMODULES = 2000
+
+def _encode_particle_id(vertex_id, primary_id, generation, secondary_id, process):
+    """Encode particle id components in the same way as the TrackML data.
+    """
+    return ((vertex_id.astype('u8') << numpy.uint64(52)) |
+            (primary_id.astype('u8') << numpy.uint64(36)) |
+            (generation.astype('u8') << numpy.uint64(24)) |
+            (secondary_id.astype('u8') << numpy.uint64(12)) |
+            process.astype('u8')).astype('i8')
+
+def _frame(name, columns):
+    """Build a DataFrame with the column order and types of the given part.
+    """
+    return pandas.DataFrame(
+        dict((_, numpy.asarray(columns[_], dtype=d)) for _, d in DTYPES[name].items()),
+        columns=list(DTYPES[name]))
+
+def generate_event(nhits=100000, nparticles=None, noise=0.1, seed=None):
+    """Generate a single synthetic event.
+
+    Parameters
+    ----------
+    nhits : int, optional
+        Approximate number of hits in the event.
+    nparticles : int, optional
+        Number of particles. By default, chosen so that each particle has
+        about eight hits.
+    noise : float, optional
+        Fraction of noise hits that do not belong to any particle.
+    seed : int, optional
+        Seed for the random number generator.
+
+    Returns
+    -------
+    tuple
+        hits, cells, particles, and truth as `pandas.DataFrame` with the same
+        columns and types as returned by `trackml.dataset.load_event`.
+    """
+    rng = numpy.random.RandomState(seed)
+    nsignal = int(round(nhits * (1. - noise)))
+    nnoise = nhits - nsignal
+    if nparticles is None:
+        nparticles = max(1, nsignal // 8)
+
+    # particles; a few secondaries with non-zero generation
+    nvertices = max(1, nparticles // 100)
+    vertex_id = rng.randint(1, nvertices + 1, size=nparticles)
+    generation = (rng.uniform(size=nparticles) < 0.1).astype('i8')
+    primary_id = numpy.arange(1, nparticles + 1)
+    secondary_id = generation * rng.randint(1, 100, size=nparticles)
+    process = generation * rng.randint(1, 200, size=nparticles)
+    particle_id = _encode_particle_id(vertex_id, primary_id, generation,
+                                      secondary_id, process)
+    q = rng.choice([-1, 1], size=nparticles)
+    pt = 0.1 + rng.exponential(0.8, size=nparticles)
+    eta = rng.uniform(-3., 3., size=nparticles)
+    phi = rng.uniform(-numpy.pi, numpy.pi, size=nparticles)
+    vx = rng.normal(0., 0.01, size=nparticles)
+    vy = rng.normal(0., 0.01, size=nparticles)
+    vz = rng.normal(0., 55., size=nparticles)
+    # hits are placed on the innermost layers; the number of hits per
+    # particle is distributed around the requested average
+    if len(LAYERS) * nparticles < nsignal:
+        raise Exception('Too many hits for {} particles'.format(nparticles))
+    mean_nhits = float(nsignal) / nparticles
+    particle_nhits = numpy.clip(rng.poisson(mean_nhits, size=nparticles), 1, len(LAYERS))
+    # adjust randomly selected particles so that the total number of signal
+    # hits matches the requested one
+    diff = nsignal - particle_nhits.sum()
+    while diff != 0:
+        step = 1 if 0 < diff else -1
+        room = numpy.flatnonzero((1 <= particle_nhits + step) &
+                                 (particle_nhits + step <= len(LAYERS)))
+        selected = rng.choice(room, size=min(abs(diff), len(room)), replace=False)
+        particle_nhits[selected] += step
+        diff -= step * len(selected)
+
+    # signal hits at the intersection of each helix with the layers
+    ip = numpy.repeat(numpy.arange(nparticles), particle_nhits)
+    ilayer = numpy.arange(len(ip)) - numpy.repeat(
+        numpy.cumsum(particle_nhits) - particle_nhits, particle_nhits)
+    layers = numpy.array([_[:2] for _ in LAYERS])
+    radius = numpy.array([_[2] for _ in LAYERS])[ilayer]
+    half_length = numpy.array([_[3] for _ in LAYERS])[ilayer]
+    # transverse bending for a particle with pt in GeV and radius in mm
+    curvature = 0.3 * BFIELD * 1e-3 / pt[ip]
+    dphi = -q[ip] * numpy.arcsin(numpy.clip(0.5 * radius * curvature, -1., 1.))
+    hphi = phi[ip] + dphi
+    tx = vx[ip] + radius * numpy.cos(hphi)
+    ty = vy[ip] + radius * numpy.sin(hphi)
+    tz = vz[ip] + radius * numpy.sinh(eta[ip])
+    tpx = pt[ip] * numpy.cos(phi[ip] + 2 * dphi)
+    tpy = pt[ip] * numpy.sin(phi[ip] + 2 * dphi)
+    tpz = pt[ip] * numpy.sinh(eta[ip])
+    volume_id = layers[ilayer, 0].copy()
+    layer_id = layers[ilayer, 1].copy()
+    # hits beyond the barrel are assigned to the endcap volumes
+    for barrel, (negative, positive) in ENDCAP_VOLUMES.items():
+        outside = (volume_id == barrel) & (half_length < numpy.absolute(tz))
+        volume_id[outside & (tz < 0)] = negative
+        volume_id[outside & (0 < tz)] = positive
+
+    # noise hits uniformly distributed on the layers
+    jlayer = rng.randint(len(LAYERS), size=nnoise)
+    nradius = numpy.array([_[2] for _ in LAYERS])[jlayer]
+    nphi = rng.uniform(-numpy.pi, numpy.pi, size=nnoise)
+    nz = rng.uniform(-1., 1., size=nnoise) * numpy.array([_[3] for _ in LAYERS])[jlayer]
+
+    hit_particle_id = numpy.concatenate([particle_id[ip], numpy.zeros(nnoise, dtype='i8')])
+    tx = numpy.concatenate([tx, nradius * numpy.cos(nphi)])
+    ty = numpy.concatenate([ty, nradius * numpy.sin(nphi)])
+    tz = numpy.concatenate([tz, nz])
+    tpx = numpy.concatenate([tpx, numpy.zeros(nnoise)])
+    tpy = numpy.concatenate([tpy, numpy.zeros(nnoise)])
+    tpz = numpy.concatenate([tpz, numpy.zeros(nnoise)])
+    volume_id = numpy.concatenate([volume_id, layers[jlayer, 0]])
+    layer_id = numpy.concatenate([layer_id, layers[jlayer, 1]])
+    module_id = 1 + ((numpy.arctan2(ty, tx) + numpy.pi) / (2 * numpy.pi) * NMODULES).astype('i4') % NMODULES
+    # hit ids are ordered by detector module as in the original data
+    order = numpy.lexsort((module_id, layer_id, volume_id))
+    hit_id = numpy.empty(len(order), dtype='i4')
+    hit_id[order] = numpy.arange(1, len(order) + 1)
+    # measured positions are smeared true positions
+    x = tx + rng.normal(0., 0.05, size=len(tx))
+    y = ty + rng.normal(0., 0.05, size=len(ty))
+    z = tz + rng.normal(0., 0.05, size=len(tz))
+
+    hits = _frame('hits', {
+        'hit_id': hit_id[order], 'x': x[order], 'y': y[order], 'z': z[order],
+        'volume_id': volume_id[order], 'layer_id': layer_id[order],
+        'module_id': module_id[order],
+    })
+    truth = _frame('truth', {
+        'hit_id': hit_id[order], 'particle_id': hit_particle_id[order],
+        'tx': tx[order], 'ty': ty[order], 'tz': tz[order],
+        'tpx': tpx[order], 'tpy': tpy[order], 'tpz': tpz[order],
+        'weight': numpy.zeros(len(order)),
+    })
+    particles = _frame('particles', {
+        'particle_id': particle_id,
+        'particle_type': q * rng.choice([11, 13, 211, 321, 2212], size=nparticles),
+        'vx': vx, 'vy': vy, 'vz': vz,
+        'px': pt * numpy.cos(phi), 'py': pt * numpy.sin(phi), 'pz': pt * numpy.sinh(eta),
+        'q': q, 'nhits': particle_nhits,
+    })
+    truth['weight'] = weight_hits_phase1(truth, particles)['weight'].values.astype('f4')
+
+    # one to four active cells around a random position for each hit
+    ncells = rng.randint(1, 5, size=len(hits))
+    cell_hit_id = numpy.repeat(hits['hit_id'].values, ncells)
+    ch0 = numpy.repeat(rng.randint(0, 1000, size=len(hits)), ncells)
+    ch1 = numpy.repeat(rng.randint(0, 1000, size=len(hits)), ncells)
+    ch0 += rng.randint(0, 2, size=len(ch0))
+    ch1 += rng.randint(0, 2, size=len(ch1))
+    cells = _frame('cells', {
+        'hit_id': cell_hit_id, 'ch0': ch0, 'ch1': ch1,
+        'value': rng.uniform(0., 0.5, size=len(ch0)),
+    })
+    return hits, cells, particles, truth
+
+def write_event(prefix, hits, cells, particles, truth, compress=False):
+    """Write the event data to csv files with the given prefix.
+    """
+    ext = '.csv.gz' if compress else '.csv'
+    for name, data in zip(['hits', 'cells', 'particles', 'truth'],
+                          [hits, cells, particles, truth]):
+        data.to_csv('{}-{}{}'.format(prefix, name, ext), index=False)
+
+def generate_dataset(path, nevents=3, nhits=100000, nparticles=None, noise=0.1,
+                     seed=0, first_event_id=1000, compress=False, archive=False):
+    """Generate a dataset directory with synthetic events.
+
+    Parameters
+    ----------
+    path : str
+        Output directory.
+    nevents : int, optional
+        Number of events.
+    nhits, nparticles, noise
+        Event size as in `generate_event`.
+    seed : int, optional
+        Seed for the first event; subsequent events use consecutive seeds.
+    first_event_id : int, optional
+        Event identifier of the first event.
+    compress : bool, optional
+        Write gzip-compressed csv files.
+    archive : bool, optional
+        Additionally store the dataset in a zip file next to the directory.
+
+    Returns
+    -------
+    List[int]
+        The identifiers of the generated events.
+    """
+    if not op.isdir(path):
+        os.makedirs(path)
+    event_ids = []
+    for i in range(nevents):
+        event_id = first_event_id + i
+        data = generate_event(nhits, nparticles, noise, seed + i)
+        write_event(op.join(path, 'event{:09d}'.format(event_id)), *data,
+                    compress=compress)
+        event_ids.append(event_id)
+    if archive:
+        name = op.basename(op.normpath(path))
+        with zipfile.ZipFile(op.normpath(path) + '.zip', 'w', zipfile.ZIP_DEFLATED) as z:
+            for f in sorted(os.listdir(path)):
+                z.write(op.join(path, f), '{}/{}'.format(name, f))
+    return event_ids
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic TrackML events')
+    parser.add_argument('path', help='output directory')
+    parser.add_argument('--events', type=int, default=3, help='number of events')
+    parser.add_argument('--hits', type=int, default=100000, help='hits per event')
+    parser.add_argument('--particles', type=int, default=None, help='particles per event')
+    parser.add_argument('--noise', type=float, default=0.1, help='noise hit fraction')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--compress', action='store_true', help='write .csv.gz files')
+    parser.add_argument('--zip', action='store_true', help='also write a zip archive')
+    args = parser.parse_args(argv)
+    event_ids = generate_dataset(args.path, args.events, args.hits, args.particles,
+                                 args.noise, args.seed, compress=args.compress,
+                                 archive=args.zip)
+    print('generated {} events in {}'.format(len(event_ids), args.path))
+
+if __name__ == '__main__':
+    main()
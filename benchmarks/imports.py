@@ -0,0 +1,129 @@
+"""Import time benchmark for the TrackML library
+
+Each module is imported in a fresh interpreter so that nothing is cached
+between measurements. The runner reports the best import time over several
+repetitions and whether pandas was imported as a side effect. Modules that
+must not import pandas are checked, and results can be stored as JSON and
+compared to a previous result.
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import json
+import platform
+import subprocess
+import sys
+
+MODULES = [
+    'trackml',
+    'trackml.utils',
+    'trackml.spatial',
+    'trackml.profiling',
+    'trackml.weights',
+    'trackml.dataset',
+    'trackml.randomize',
+    'trackml.score',
+    'trackml.cells',
+    'trackml.store',
+    'trackml.results',
+    'trackml.evaluate',
+]
+
+_MEASURE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, 'pandas' in sys.modules]))
+'''
+
+def measure(module, repeat=5):
+    """Measure the import time of a module in fresh interpreters.
+
+    Returns
+    -------
+    time : float
+        Best import time in seconds over all repetitions.
+    pandas : bool
+        Whether pandas was imported.
+    """
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, '-c', _MEASURE.format(module=module)])
+        elapsed, pandas = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        times.append(elapsed)
+    return min(times), pandas
+
+def run(modules=MODULES, repeat=5):
+    """Measure the import time of all modules.
+
+    Returns
+    -------
+    collections.OrderedDict
+        Benchmark configuration, environment, and per-module results.
+    """
+    results = OrderedDict()
+    for module in modules:
+        elapsed, pandas = measure(module, repeat)
+        results[module] = OrderedDict([('time', elapsed), ('pandas', pandas)])
+    return OrderedDict([
+        ('config', OrderedDict([('repeat', repeat)])),
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+        ])),
+        ('modules', results),
+    ])
+
+def print_results(results, baseline=None):
+    """Print a results table, optionally with the speedup w/ respect to a baseline.
+    """
+    header = '{:<24} {:>10} {:>8}'.format('module', 'time/ms', 'pandas')
+    if baseline is not None:
+        header += ' {:>8}'.format('speedup')
+    print(header)
+    print('-' * len(header))
+    for name, r in results['modules'].items():
+        line = '{:<24} {:>10.1f} {:>8}'.format(name, 1000 * r['time'],
+                                               'yes' if r['pandas'] else 'no')
+        if baseline is not None:
+            b = baseline['modules'].get(name)
+            line += ' {:>8}'.format('{:.2f}'.format(b['time'] / r['time']) if b else '-')
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the TrackML import time benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions per module')
+    parser.add_argument('--module', action='append', dest='modules',
+                        help='measure only the given module; can be repeated')
+    parser.add_argument('--no-pandas', action='append', default=[], dest='no_pandas',
+                        metavar='MODULE',
+                        help='fail if the given module imports pandas; can be repeated')
+    parser.add_argument('--output', help='store the results in this JSON file')
+    parser.add_argument('--compare', help='compare to the results in this JSON file')
+    args = parser.parse_args(argv)
+
+    results = run(args.modules or MODULES, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    failed = []
+    for module in args.no_pandas:
+        r = results['modules'].get(module)
+        if r['pandas'] if r is not None else measure(module, 1)[1]:
+            failed.append(module)
+    if failed:
+        print('pandas is imported by {}'.format(', '.join(failed)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""Benchmark runner for the TrackML library
+
+Each benchmark stage processes all events of a synthetic dataset. The runner
+reports the throughput, i.e. events and hits per second, based on the best of
+several repetitions, and the peak memory allocated during a separate traced
+run. Results can be stored as JSON and compared to a previous result.
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import gc
+import json
+import os.path as op
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+import pandas
+
+from trackml.dataset import cache_dataset, load_dataset
+from trackml.randomize import drop_hits, random_solution, shuffle_hits
+from trackml.score import PreparedTruth, score_event
+from trackml.weights import weight_hits_phase1, weight_hits_phase2
+
+from .generate import generate_dataset
+
+def _stages(path):
+    """Define the benchmark stages for the dataset at the given path.
+
+    Returns
+    -------
+    collections.OrderedDict
+        Maps the stage name to a tuple of a setup function and a stage
+        function. The setup function is called once and its result is passed
+        to the stage function.
+    """
+    zip_path = op.normpath(path) + '.zip'
+    cache = op.join(op.dirname(op.normpath(path)), 'cache')
+
+    def load(parts=['hits', 'cells', 'particles', 'truth']):
+        return list(load_dataset(path, parts=parts))
+
+    def load_cached():
+        cache_dataset(path, cache=cache)
+    def truth_particles():
+        return load(['particles', 'truth'])
+    def truth_submissions():
+        events = load(['truth'])
+        return [(truth, shuffle_hits(truth, 0.1)) for _, truth in events]
+    def prepared_submissions():
+        return [(PreparedTruth(truth), submission)
+                for truth, submission in truth_submissions()]
+
+    stages = OrderedDict()
+    stages['load_dataset'] = (
+        None, lambda _: load())
+    stages['load_dataset_zip'] = (
+        None, lambda _: list(load_dataset(zip_path)))
+    stages['load_dataset_cache'] = (
+        load_cached, lambda _: list(load_dataset(path, cache=cache)))
+    stages['weight_hits_phase1'] = (
+        truth_particles,
+        lambda events: [weight_hits_phase1(t, p) for _, p, t in events])
+    stages['weight_hits_phase2'] = (
+        truth_particles,
+        lambda events: [weight_hits_phase2(t, p) for _, p, t in events])
+    stages['score_event'] = (
+        truth_submissions,
+        lambda events: [score_event(t, s) for t, s in events])
+    stages['score_event_prepared'] = (
+        prepared_submissions,
+        lambda events: [score_event(t, s) for t, s in events])
+    stages['drop_hits'] = (
+        lambda: load(['truth']),
+        lambda events: [drop_hits(t, 0.1) for _, t in events])
+    stages['shuffle_hits'] = (
+        lambda: load(['truth']),
+        lambda events: [shuffle_hits(t, 0.1) for _, t in events])
+    stages['random_solution'] = (
+        lambda: load(['hits']),
+        lambda events: [random_solution(h, 1000) for _, h in events])
+    return stages
+
+def run_stage(setup, stage, repeat=3):
+    """Run a single stage and measure its time and peak memory.
+
+    Returns
+    -------
+    time : float
+        Best wall-clock time in seconds over all repetitions.
+    peak_memory : int
+        Peak traced memory in bytes during an additional run.
+    """
+    data = setup() if setup is not None else None
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        stage(data)
+        times.append(time.perf_counter() - start)
+    # memory tracing slows down the execution and is done separately
+    gc.collect()
+    tracemalloc.start()
+    try:
+        stage(data)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak_memory
+
+def run(nevents=3, nhits=100000, nparticles=None, noise=0.1, seed=0,
+        repeat=3, stages=None, path=None):
+    """Generate a synthetic dataset and run the benchmark stages.
+
+    Parameters
+    ----------
+    nevents, nhits, nparticles, noise, seed
+        Size and seed of the synthetic dataset; see `generate_dataset`.
+    repeat : int, optional
+        Number of timed repetitions for each stage.
+    stages : List[str], optional
+        Only run the selected stages.
+    path : str, optional
+        Work directory for the generated data. A temporary directory is used
+        and removed afterwards by default.
+
+    Returns
+    -------
+    collections.OrderedDict
+        Benchmark configuration, environment, and per-stage results.
+    """
+    workdir = path if path is not None else tempfile.mkdtemp(prefix='trackml-benchmark-')
+    try:
+        dataset = op.join(workdir, 'dataset')
+        generate_dataset(dataset, nevents, nhits, nparticles, noise, seed,
+                         archive=True)
+        # total number of hits from the generated data
+        total_hits = sum(len(_[1]) for _ in load_dataset(dataset, parts=['hits']))
+        results = OrderedDict()
+        for name, (setup, stage) in _stages(dataset).items():
+            if stages is not None and name not in stages:
+                continue
+            elapsed, peak_memory = run_stage(setup, stage, repeat)
+            results[name] = OrderedDict([
+                ('time', elapsed),
+                ('events_per_second', nevents / elapsed),
+                ('hits_per_second', total_hits / elapsed),
+                ('peak_memory', peak_memory),
+            ])
+    finally:
+        if path is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return OrderedDict([
+        ('config', OrderedDict([
+            ('nevents', nevents),
+            ('nhits', nhits),
+            ('nparticles', nparticles),
+            ('noise', noise),
+            ('seed', seed),
+            ('repeat', repeat),
+        ])),
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('numpy', numpy.__version__),
+            ('pandas', pandas.__version__),
+            ('platform', platform.platform()),
+        ])),
+        ('stages', results),
+    ])
+
+def print_results(results, baseline=None):
+    """Print a results table, optionally with the speedup w/ respect to a baseline.
+    """
+    header = '{:<24} {:>10} {:>10} {:>12} {:>12}'.format(
+        'stage', 'time/s', 'events/s', 'hits/s', 'peak/MiB')
+    if baseline is not None:
+        header += ' {:>8}'.format('speedup')
+    print(header)
+    print('-' * len(header))
+    for name, r in results['stages'].items():
+        line = '{:<24} {:>10.4f} {:>10.2f} {:>12.0f} {:>12.1f}'.format(
+            name, r['time'], r['events_per_second'], r['hits_per_second'],
+            r['peak_memory'] / 2.**20)
+        if baseline is not None:
+            b = baseline['stages'].get(name)
+            line += ' {:>8}'.format('{:.2f}'.format(b['time'] / r['time']) if b else '-')
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the TrackML library benchmarks')
+    parser.add_argument('--events', type=int, default=3, help='number of events')
+    parser.add_argument('--hits', type=int, default=100000, help='hits per event')
+    parser.add_argument('--particles', type=int, default=None, help='particles per event')
+    parser.add_argument('--noise', type=float, default=0.1, help='noise hit fraction')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--repeat', type=int, default=3, help='timed repetitions')
+    parser.add_argument('--stage', action='append', dest='stages',
+                        help='run only the given stage; can be repeated')
+    parser.add_argument('--output', help='store the results in this JSON file')
+    parser.add_argument('--compare', help='compare to the results in this JSON file')
+    args = parser.parse_args(argv)
+
+    results = run(args.events, args.hits, args.particles, args.noise, args.seed,
+                  args.repeat, args.stages)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
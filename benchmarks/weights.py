@@ -0,0 +1,96 @@
+"""Hit weight benchmark for the TrackML library
+
+Compares the vectorized hit order weights in `weight_hits_phase1` with the
+previous implementation that evaluated `weight_order` row by row with
+`DataFrame.apply` and computed the hit index with a per-group lambda. Both
+are run on synthetic events of realistic size, their outputs are checked to
+be identical, and the speedup is reported.
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import time
+
+import numpy
+import pandas
+import pandas.testing
+
+from trackml.weights import weight_hits_phase1, weight_order, weight_pt
+
+from .generate import generate_event
+
+def weight_hits_rowwise(truth, particles):
+    """Phase 1 hit weights with the previous row-wise implementation.
+    """
+    # fill selected per-particle information for each hit
+    selected = pandas.DataFrame({
+        'particle_id': particles['particle_id'],
+        'particle_vz': particles['vz'],
+        'particle_nhits': particles['nhits'],
+        'weight_pt': weight_pt(numpy.hypot(particles['px'], particles['py'])),
+    })
+    combined = pandas.merge(truth, selected,
+                            how='left', on=['particle_id'],
+                            validate='many_to_one')
+
+    # fix pt weight for hits w/o associated particle
+    combined['weight_pt'] = combined['weight_pt'].fillna(0.0)
+    # fix nhits for hits w/o associated particle
+    combined['particle_nhits'] = combined['particle_nhits'].fillna(0.0).astype('i4')
+    # compute hit count and order using absolute distance from particle vertex
+    combined['abs_dvz'] = numpy.absolute(combined['tz'] - combined['particle_vz'])
+    combined['ihit'] = combined.groupby('particle_id')['abs_dvz'].rank().transform(lambda x: x - 1).fillna(0.0).astype('i4')
+    # compute order-dependent weight
+    combined['weight_order'] = combined[['ihit', 'particle_nhits']].apply(weight_order, axis=1)
+
+    # compute combined weight normalized to 1
+    w = combined['weight_pt'] * combined['weight_order']
+    w /= w.sum()
+    combined['weight'] = w
+
+    # return w/o intermediate columns
+    return combined.drop(columns=['particle_vz', 'abs_dvz'])
+
+def best_time(function, events, repeat):
+    """Return the best wall-clock time in seconds over all repetitions."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for truth, particles in events:
+            function(truth, particles)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare the vectorized and row-wise TrackML hit weights')
+    parser.add_argument('--events', type=int, default=1, help='number of events')
+    parser.add_argument('--hits', type=int, default=120000, help='hits per event')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--repeat', type=int, default=3, help='timed repetitions')
+    args = parser.parse_args(argv)
+
+    events = []
+    for i in range(args.events):
+        _, _, particles, truth = generate_event(args.hits, seed=args.seed + i)
+        events.append((truth, particles))
+    for truth, particles in events:
+        pandas.testing.assert_frame_equal(weight_hits_phase1(truth, particles),
+                                          weight_hits_rowwise(truth, particles),
+                                          check_exact=True)
+    nhits = sum(len(truth) for truth, _ in events)
+    rowwise = best_time(weight_hits_rowwise, events, args.repeat)
+    vectorized = best_time(weight_hits_phase1, events, args.repeat)
+
+    header = '{:<12} {:>10} {:>12} {:>8}'.format('path', 'time/s', 'hits/s', 'speedup')
+    print(header)
+    print('-' * len(header))
+    for name, elapsed in [('rowwise', rowwise), ('vectorized', vectorized)]:
+        print('{:<12} {:>10.4f} {:>12.0f} {:>8.2f}'.format(
+            name, elapsed, nhits / elapsed, rowwise / elapsed))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Small synthetic events shared by the tests"""
+
+import os
+import os.path as op
+import zipfile
+
+import numpy
+import pandas
+import pytest
+
+from trackml.dataset import DEFAULT_PARTS, DTYPES
+from trackml.weights import weight_hits_phase1
+
+def _frame(name, columns):
+    """Build a DataFrame with the column order and types of the given part.
+    """
+    return pandas.DataFrame(
+        dict((_, numpy.asarray(columns[_], dtype=d)) for _, d in DTYPES[name].items()),
+        columns=list(DTYPES[name]))
+
+def generate_event(nhits=2000, noise=0.1, seed=0):
+    """Generate a small random event.
+
+    The content has the types and the particle id structure of the TrackML
+    data, but is otherwise random. About a fifth of the particles are
+    secondaries with non-zero generation.
+
+    Returns
+    -------
+    tuple
+        hits, cells, particles, and truth as returned by `load_event`.
+    """
+    rng = numpy.random.RandomState(seed)
+    nparticles = max(1, nhits // 10)
+    vertex_id = rng.randint(1, 4, size=nparticles).astype('u8')
+    primary_id = numpy.arange(1, nparticles + 1, dtype='u8')
+    generation = (rng.uniform(size=nparticles) < 0.2).astype('u8')
+    particle_id = ((vertex_id << numpy.uint64(52)) | (primary_id << numpy.uint64(36)) |
+                   (generation << numpy.uint64(24))).astype('i8')
+
+    hit_id = numpy.arange(1, nhits + 1)
+    hit_particle = rng.randint(0, nparticles, size=nhits)
+    hit_particle_id = particle_id[hit_particle]
+    hit_particle_id[rng.uniform(size=nhits) < noise] = 0
+    nhits_particle = numpy.bincount(
+        hit_particle[hit_particle_id != 0], minlength=nparticles)
+
+    hits = _frame('hits', {
+        'hit_id': hit_id,
+        'x': rng.normal(0., 500., size=nhits),
+        'y': rng.normal(0., 500., size=nhits),
+        'z': rng.normal(0., 1000., size=nhits),
+        'volume_id': rng.choice([7, 8, 9, 12, 13, 14], size=nhits),
+        'layer_id': 2 * rng.randint(1, 8, size=nhits),
+        'module_id': rng.randint(1, 2000, size=nhits),
+    })
+    particles = _frame('particles', {
+        'particle_id': particle_id,
+        'particle_type': rng.choice([-211, 11, 13, 211, 2212], size=nparticles),
+        'vx': rng.normal(0., 0.01, size=nparticles),
+        'vy': rng.normal(0., 0.01, size=nparticles),
+        'vz': rng.normal(0., 55., size=nparticles),
+        'px': rng.normal(0., 1., size=nparticles),
+        'py': rng.normal(0., 1., size=nparticles),
+        'pz': rng.normal(0., 2., size=nparticles),
+        'q': rng.choice([-1, 1], size=nparticles),
+        'nhits': nhits_particle,
+    })
+    truth = _frame('truth', {
+        'hit_id': hit_id,
+        'particle_id': hit_particle_id,
+        'tx': hits['x'], 'ty': hits['y'], 'tz': hits['z'],
+        'tpx': rng.normal(0., 1., size=nhits),
+        'tpy': rng.normal(0., 1., size=nhits),
+        'tpz': rng.normal(0., 2., size=nhits),
+        'weight': numpy.zeros(nhits),
+    })
+    truth['weight'] = weight_hits_phase1(truth, particles)['weight'].values.astype('f4')
+
+    ncells = rng.randint(1, 4, size=nhits)
+    cells = _frame('cells', {
+        'hit_id': numpy.repeat(hit_id, ncells),
+        'ch0': rng.randint(0, 1000, size=ncells.sum()),
+        'ch1': rng.randint(0, 1000, size=ncells.sum()),
+        'value': rng.uniform(0., 0.5, size=ncells.sum()),
+    })
+    return hits, cells, particles, truth
+
+@pytest.fixture
+def make_event():
+    """Generator for small random events; see `generate_event`."""
+    return generate_event
+
+DATASET_EVENT_IDS = [1000, 1001, 1002]
+
+def _write_dataset(path, nhits=1500):
+    """Write small random events into a dataset directory.
+
+    The last event is stored in gzip-compressed csv files.
+    """
+    os.makedirs(path)
+    for i, event_id in enumerate(DATASET_EVENT_IDS):
+        ext = '.csv.gz' if (i + 1 == len(DATASET_EVENT_IDS)) else '.csv'
+        prefix = op.join(path, 'event{:09d}'.format(event_id))
+        for name, data in zip(DEFAULT_PARTS, generate_event(nhits, seed=i)):
+            data.to_csv('{}-{}{}'.format(prefix, name, ext), index=False)
+
+@pytest.fixture(scope='session')
+def dataset(tmp_path_factory):
+    """Paths to a small dataset directory and a zip file with the same events.
+
+    Both are shared by all tests and must not be modified, e.g. tests that
+    store cache files next to the csv files have to use a copy.
+    """
+    path = op.join(str(tmp_path_factory.mktemp('data')), 'dataset')
+    _write_dataset(path)
+    archive = path + '.zip'
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name in sorted(os.listdir(path)):
+            z.write(op.join(path, name), 'dataset/' + name)
+    return path, archive
@@ -0,0 +1,150 @@
+"""Tests for the dataset loaders"""
+
+import os
+import os.path as op
+import shutil
+
+import numpy
+import pandas
+import pandas.testing
+import pytest
+
+from trackml import dataset as trackml_dataset
+from trackml.dataset import DEFAULT_PARTS, load_dataset, load_event
+
+# (columns, filters) selections for each part
+SELECTIONS = {
+    'all': ({}, {}),
+    'columns': ({'hits': ['hit_id', 'z', 'volume_id'],
+                 'truth': ['particle_id', 'hit_id', 'weight']}, {}),
+    'filters': ({}, {'hits': [('volume_id', 'in', [7, 8, 9]), ('z', '<', 500.)],
+                     'cells': [('value', '>=', 0.25)],
+                     'particles': [('nhits', '>', 9)],
+                     'truth': [('particle_id', '!=', 0)]}),
+    'columns_filters': ({'hits': ['hit_id', 'x'], 'truth': ['hit_id', 'particle_id']},
+                        {'hits': [('layer_id', '==', 4)],
+                         'truth': [('weight', '>', 0.)]}),
+    'empty': ({'cells': ['hit_id']},
+              {'hits': [('hit_id', '<', 0)], 'cells': [('value', '>', 1.)],
+               'particles': [('particle_id', 'in', [])],
+               'truth': [('tz', '>', 1e9)]}),
+}
+# the pyarrow parser is optional
+HAS_PYARROW = (trackml_dataset._pyarrow_csv() is not None)
+ENGINES = ['pandas', 'pyarrow'] if HAS_PYARROW else ['pandas']
+
+def _assert_events_equal(events, expected):
+    events = list(events)
+    expected = list(expected)
+    assert len(events) == len(expected)
+    for event, reference in zip(events, expected):
+        assert event[0] == reference[0]
+        assert len(event) == len(reference)
+        for data, ref in zip(event[1:], reference[1:]):
+            pandas.testing.assert_frame_equal(data, ref, check_exact=True)
+
+def _selected(event, columns, filters):
+    """Apply the selection to fully loaded event data by hand."""
+    selected = [event[0]]
+    for name, data in zip(DEFAULT_PARTS, event[1:]):
+        if name in filters:
+            mask = numpy.ones(len(data), dtype=bool)
+            for column, operator_name, value in filters[name]:
+                mask &= trackml_dataset.FILTER_OPERATORS[operator_name](
+                    data[column].values, value)
+            data = data[mask].reset_index(drop=True)
+        if name in columns:
+            data = data[columns[name]]
+        selected.append(data)
+    return tuple(selected)
+
+@pytest.fixture(params=['directory', 'zip'])
+def path(request, dataset):
+    return dataset[request.param == 'zip']
+
+@pytest.mark.skipif(not HAS_PYARROW, reason='requires pyarrow')
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('selection', sorted(SELECTIONS))
+def test_engines_identical(path, selection, compact):
+    columns, filters = SELECTIONS[selection]
+    events = [load_dataset(path, columns=columns, filters=filters, compact=compact,
+                           engine=engine) for engine in ENGINES]
+    _assert_events_equal(*events)
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('selection', sorted(SELECTIONS))
+def test_selection(path, selection, engine, monkeypatch):
+    columns, filters = SELECTIONS[selection]
+    # several chunks per file for the filtered pandas parser
+    monkeypatch.setattr(trackml_dataset, 'FILTER_CHUNK_SIZE', 1000)
+    full = list(load_dataset(path, engine=engine))
+    if selection == 'empty':
+        assert all(len(_) == 0 for event in full for _ in _selected(event, columns, filters)[1:])
+    expected = [_selected(_, columns, filters) for _ in full]
+    events = load_dataset(path, columns=columns, filters=filters, engine=engine)
+    _assert_events_equal(events, expected)
+
+@pytest.mark.parametrize('selection', sorted(SELECTIONS))
+def test_cache_selection(path, selection, tmp_path, monkeypatch):
+    columns, filters = SELECTIONS[selection]
+    expected = list(load_dataset(path, columns=columns, filters=filters))
+    cache = str(tmp_path)
+    # missing cache files are created from the full csv files
+    events = load_dataset(path, cache=cache, columns=columns, filters=filters)
+    _assert_events_equal(events, expected)
+    assert len(os.listdir(cache)) == len(DEFAULT_PARTS) * len(expected)
+    # existing cache files are used w/o parsing the csv files
+    def fail(*args, **kwargs):
+        raise AssertionError('csv file parsed despite cache')
+    monkeypatch.setattr(trackml_dataset, '_read_event_data', fail)
+    events = load_dataset(path, cache=cache, columns=columns, filters=filters)
+    _assert_events_equal(events, expected)
+
+@pytest.mark.parametrize('location', ['directory', 'next_to_csv'])
+def test_cache_invalidation(dataset, location, tmp_path):
+    path = op.join(str(tmp_path), 'dataset')
+    shutil.copytree(dataset[0], path)
+    cache = op.join(str(tmp_path), 'cache') if location == 'directory' else True
+    expected = list(load_dataset(path, parts=['truth']))
+    for _ in range(2):
+        _assert_events_equal(load_dataset(path, parts=['truth'], cache=cache), expected)
+
+    # changed content and size
+    prefix = op.join(path, 'event000001000')
+    truth = load_event(prefix, parts=['truth'])[0]
+    truth = truth.iloc[:-10]
+    truth.to_csv(prefix + '-truth.csv', index=False)
+    loaded = load_event(prefix, parts=['truth'], cache=cache)[0]
+    pandas.testing.assert_frame_equal(loaded, truth, check_exact=True)
+    # changed content with the same size and only a new modification time
+    size = os.stat(prefix + '-truth.csv').st_size
+    truth['weight'] = truth['weight'].values[::-1]
+    truth.to_csv(prefix + '-truth.csv', index=False)
+    stat = os.stat(prefix + '-truth.csv')
+    assert stat.st_size == size
+    os.utime(prefix + '-truth.csv', (stat.st_atime, stat.st_mtime + 10))
+    loaded = load_event(prefix, parts=['truth'], cache=cache)[0]
+    pandas.testing.assert_frame_equal(loaded, truth, check_exact=True)
+
+@pytest.mark.parametrize('event_id', [1000, 1002])
+def test_load_event_zip(dataset, event_id):
+    path, archive = dataset
+    name = 'event{:09d}'.format(event_id)
+    expected = load_event(op.join(path, name))
+    for prefix in [op.join(archive, name), op.join(archive, 'dataset', name)]:
+        data = load_event(prefix)
+        assert len(data) == len(expected)
+        for a, b in zip(data, expected):
+            pandas.testing.assert_frame_equal(a, b, check_exact=True)
+
+@pytest.mark.parametrize('prefetch, workers', [(1, 1), (2, 4), (8, 2)])
+def test_prefetch(path, prefetch, workers):
+    expected = list(load_dataset(path))
+    events = load_dataset(path, prefetch=prefetch, workers=workers)
+    _assert_events_equal(events, expected)
+
+def test_prefetch_early_exit(path):
+    events = load_dataset(path, prefetch=2, workers=2)
+    event_id = next(events)[0]
+    events.close()
+    assert event_id == 1000
@@ -0,0 +1,76 @@
+"""Tests for the validation of submissions in the command line evaluation"""
+
+import os.path as op
+
+import numpy
+import pandas
+
+from trackml.evaluate import evaluate_dataset
+
+EVENT_IDS = [1000, 1001]
+
+def _truth(event_id):
+    hit_id = numpy.arange(1, 101)
+    return pandas.DataFrame({
+        'hit_id': hit_id,
+        'particle_id': (hit_id - 1) // 10 + 1 + event_id,
+        'tx': 0.0, 'ty': 0.0, 'tz': 0.0,
+        'tpx': 0.0, 'tpy': 0.0, 'tpz': 0.0,
+        'weight': numpy.full(len(hit_id), 0.01),
+    })
+
+def _dataset(tmp_path):
+    submissions = []
+    for event_id in EVENT_IDS:
+        truth = _truth(event_id)
+        truth.to_csv(op.join(str(tmp_path), 'event{:09d}-truth.csv'.format(event_id)),
+                     index=False)
+        submissions.append(pandas.DataFrame({
+            'event_id': event_id,
+            'hit_id': truth['hit_id'],
+            'track_id': truth['particle_id'] - event_id,
+        }))
+    return str(tmp_path), pandas.concat(submissions, ignore_index=True)
+
+def _results(path, submission):
+    results = evaluate_dataset(path, submission, workers=1)
+    return dict((_['event_id'], _) for _ in results)
+
+def test_valid(tmp_path):
+    path, submission = _dataset(tmp_path)
+    results = _results(path, submission)
+    assert sorted(results) == EVENT_IDS
+    for result in results.values():
+        assert 'error' not in result
+        assert numpy.isclose(result['score'], 1.0)
+
+def test_single_file(tmp_path):
+    path, submission = _dataset(tmp_path)
+    submission = submission.drop(index=[3, 150])
+    filename = op.join(str(tmp_path), 'submission.csv')
+    submission.to_csv(filename, index=False)
+    results = _results(path, filename)
+    assert results[1000]['error'].startswith('Missing 1 hits in event 1000')
+    assert results[1001]['error'].startswith('Missing 1 hits in event 1001')
+
+def test_invalid_hits(tmp_path):
+    path, submission = _dataset(tmp_path)
+    submission.loc[5, 'hit_id'] = 1000
+    submission.loc[110, 'hit_id'] = 1
+    results = _results(path, submission)
+    assert results[1000]['error'] == 'Unknown hit_id 1000 in event 1000 on row 5'
+    assert results[1001]['error'] == 'Duplicated hit_id 1 in event 1001 on row 110'
+
+def test_negative_track_id(tmp_path):
+    path, submission = _dataset(tmp_path)
+    submission.loc[7, 'track_id'] = -1
+    results = _results(path, submission)
+    assert results[1000]['error'] == 'Negative track_id -1 in event 1000 on row 7'
+    assert 'error' not in results[1001]
+
+def test_missing_event(tmp_path):
+    path, submission = _dataset(tmp_path)
+    submission = submission[submission['event_id'] != 1001]
+    results = _results(path, submission)
+    assert 'error' not in results[1000]
+    assert results[1001]['error'] == 'Missing submission'
@@ -0,0 +1,326 @@
+"""Equivalence tests for the vectorized track analysis"""
+
+import numpy
+import pandas
+import pandas.testing
+import pytest
+
+from trackml.dataset import _map_processes, load_dataset
+from trackml.randomize import _randomize_truth
+from trackml.score import (IncrementalScorer, PreparedTruth, _analyze_tracks,
+                           score_dataset, score_event, score_event_detailed,
+                           score_many, score_sweep)
+
+def _analyze_tracks_loop(truth, submission):
+    """Reference implementation with the original per-hit loop.
+    """
+    # true number of hits for each particle_id
+    particles_nhits = truth['particle_id'].value_counts(sort=False)
+    total_weight = truth['weight'].sum()
+    # combined event with minimal reconstructed and truth information
+    event = pandas.merge(truth[['hit_id', 'particle_id', 'weight']],
+                         submission[['hit_id', 'track_id']],
+                         on=['hit_id'], how='left', validate='one_to_one')
+    event.drop('hit_id', axis=1, inplace=True)
+    event.sort_values(by=['track_id', 'particle_id'], inplace=True)
+
+    tracks = []
+    # running sum for the reconstructed track we are currently in
+    rec_track_id = -1
+    rec_nhits = 0
+    # running sum for the particle we are currently in (in this track_id)
+    cur_particle_id = -1
+    cur_nhits = 0
+    cur_weight = 0
+    # majority particle with most hits up to now (in this track_id)
+    maj_particle_id = -1
+    maj_nhits = 0
+    maj_weight = 0
+
+    for hit in event.itertuples(index=False):
+        # we reached the next track so we need to finish the current one
+        if (rec_track_id != -1) and (rec_track_id != hit.track_id):
+            # could be that the current particle is the majority one
+            if maj_nhits < cur_nhits:
+                maj_particle_id = cur_particle_id
+                maj_nhits = cur_nhits
+                maj_weight = cur_weight
+            # store values for this track
+            tracks.append((rec_track_id, rec_nhits, maj_particle_id,
+                particles_nhits[maj_particle_id], maj_nhits,
+                maj_weight / total_weight))
+
+        # setup running values for next track (or first)
+        if rec_track_id != hit.track_id:
+            rec_track_id = hit.track_id
+            rec_nhits = 1
+            cur_particle_id = hit.particle_id
+            cur_nhits = 1
+            cur_weight = hit.weight
+            maj_particle_id = -1
+            maj_nhits = 0
+            maj_weight = 0
+            continue
+
+        # hit is part of the current reconstructed track
+        rec_nhits += 1
+
+        # reached new particle within the same reconstructed track
+        if cur_particle_id != hit.particle_id:
+            # check if last particle has more hits than the majority one
+            # if yes, set the last particle as the new majority particle
+            if maj_nhits < cur_nhits:
+                maj_particle_id = cur_particle_id
+                maj_nhits = cur_nhits
+                maj_weight = cur_weight
+            # reset runnig values for current particle
+            cur_particle_id = hit.particle_id
+            cur_nhits = 1
+            cur_weight = hit.weight
+        # hit belongs to the same particle within the same reconstructed track
+        else:
+            cur_nhits += 1
+            cur_weight += hit.weight
+
+    # last track is not handled inside the loop
+    if maj_nhits < cur_nhits:
+        maj_particle_id = cur_particle_id
+        maj_nhits = cur_nhits
+        maj_weight = cur_weight
+    # store values for the last track
+    tracks.append((rec_track_id, rec_nhits, maj_particle_id,
+        particles_nhits[maj_particle_id], maj_nhits, maj_weight / total_weight))
+
+    cols = ['track_id', 'nhits',
+            'major_particle_id', 'major_particle_nhits',
+            'major_nhits', 'major_weight']
+    return pandas.DataFrame.from_records(tracks, columns=cols)
+
+def _make_event(seed, nhits=2000, nparticles=150, noise=0.1, unassigned=0.05,
+                nan_tracks=0., weight_dtype='f4'):
+    """Generate a random event with truth and a partially wrong submission.
+
+    Small tracks with hits from a few particles produce many majority ties.
+    """
+    rng = numpy.random.RandomState(seed)
+    hit_id = rng.permutation(numpy.arange(1, 4 * nhits))[:nhits].astype('i4')
+    # large, sparse particle ids; noise hits have particle_id 0
+    ids = rng.randint(1, 2**62, size=nparticles, dtype='i8')
+    particle_id = ids[rng.randint(0, nparticles, size=nhits)]
+    particle_id[rng.uniform(size=nhits) < noise] = 0
+    weight = rng.uniform(size=nhits).astype(weight_dtype)
+    weight[particle_id == 0] = 0
+    truth = pandas.DataFrame({
+        'hit_id': hit_id,
+        'particle_id': particle_id,
+        'weight': weight,
+    })
+    track_id = rng.randint(0, nhits // 4, size=nhits).astype('i8')
+    submission = pandas.DataFrame({'hit_id': hit_id, 'track_id': track_id})
+    if nan_tracks:
+        submission['track_id'] = submission['track_id'].astype('f8')
+        submission.loc[rng.uniform(size=nhits) < nan_tracks, 'track_id'] = numpy.nan
+    # unassigned hits are missing from the submission
+    keep = (unassigned <= rng.uniform(size=nhits))
+    submission = submission[keep].sample(frac=1, random_state=rng).reset_index(drop=True)
+    return truth, submission
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('unassigned', [0., 0.05, 1.])
+@pytest.mark.parametrize('weight_dtype', ['f4', 'f8'])
+def test_analyze_tracks_equivalence(seed, unassigned, weight_dtype):
+    truth, submission = _make_event(seed, unassigned=unassigned,
+                                    weight_dtype=weight_dtype)
+    expected = _analyze_tracks_loop(truth, submission)
+    tracks = _analyze_tracks(truth, submission)
+    pandas.testing.assert_frame_equal(tracks, expected, check_exact=True)
+
+@pytest.mark.parametrize('seed', range(3))
+def test_analyze_tracks_nan_track_ids(seed):
+    truth, submission = _make_event(seed, nan_tracks=0.1)
+    expected = _analyze_tracks_loop(truth, submission)
+    tracks = _analyze_tracks(truth, submission)
+    pandas.testing.assert_frame_equal(tracks, expected, check_exact=True)
+
+def test_analyze_tracks_ties():
+    # two particles with two hits each on one track; the smaller id wins
+    truth = pandas.DataFrame({
+        'hit_id': numpy.arange(1, 7, dtype='i4'),
+        'particle_id': numpy.array([9, 9, 5, 5, 0, 0], dtype='i8'),
+        'weight': numpy.array([.1, .2, .3, .4, 0., 0.], dtype='f4'),
+    })
+    submission = pandas.DataFrame({
+        'hit_id': numpy.arange(1, 7, dtype='i4'),
+        'track_id': numpy.array([1, 1, 1, 1, 2, 2], dtype='i8'),
+    })
+    expected = _analyze_tracks_loop(truth, submission)
+    tracks = _analyze_tracks(truth, submission)
+    pandas.testing.assert_frame_equal(tracks, expected, check_exact=True)
+    assert tracks['major_particle_id'].tolist() == [5, 0]
+
+@pytest.mark.parametrize('seed', range(3))
+def test_score_event_equivalence(seed):
+    truth, submission = _make_event(seed)
+    expected = _analyze_tracks_loop(truth, submission)
+    purity_rec = numpy.true_divide(expected['major_nhits'], expected['nhits'])
+    purity_maj = numpy.true_divide(expected['major_nhits'], expected['major_particle_nhits'])
+    good_track = (0.5 < purity_rec) & (0.5 < purity_maj)
+    assert score_event(truth, submission) == expected['major_weight'][good_track].sum()
+
+def _prepared_tracks(truth, submission):
+    prepared = PreparedTruth(truth)
+    track_id, assigned = prepared.assign(submission['hit_id'].values,
+                                         submission['track_id'].values)
+    return prepared.tracks(track_id, assigned)
+
+def _incremental_tracks(truth, submission, nchunks=3):
+    scorer = IncrementalScorer(truth)
+    for chunk in numpy.array_split(numpy.arange(len(submission)), nchunks):
+        scorer.update(submission['hit_id'].values[chunk],
+                      submission['track_id'].values[chunk])
+    return scorer.tracks()
+
+@pytest.mark.parametrize('analyze', [_prepared_tracks, _incremental_tracks])
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('unassigned', [0., 0.05])
+@pytest.mark.parametrize('nan_tracks', [0., 0.1])
+def test_prepared_tracks_equivalence(analyze, seed, unassigned, nan_tracks):
+    truth, submission = _make_event(seed, unassigned=unassigned, nan_tracks=nan_tracks)
+    expected = _analyze_tracks_loop(truth, submission)
+    pandas.testing.assert_frame_equal(analyze(truth, submission), expected,
+                                      check_exact=True)
+
+@pytest.mark.parametrize('track_id', [
+    [1.2, 1.2, 1.7, 1.7],
+    [numpy.nan] * 4,
+    [1., 1., numpy.nan, 1.],
+    [1, 1, 1, 1],
+])
+def test_float_track_ids(track_id):
+    truth = pandas.DataFrame({
+        'hit_id': numpy.arange(1, 5, dtype='i4'),
+        'particle_id': numpy.full(4, 7, dtype='i8'),
+        'weight': numpy.full(4, 0.25, dtype='f4'),
+    })
+    submission = pandas.DataFrame({'hit_id': truth['hit_id'], 'track_id': track_id})
+    expected = _analyze_tracks_loop(truth, submission)
+    for analyze in [_analyze_tracks, _prepared_tracks, _incremental_tracks]:
+        pandas.testing.assert_frame_equal(analyze(truth, submission), expected,
+                                          check_exact=True)
+    score = score_event(truth, submission)
+    assert score_event(PreparedTruth(truth), submission) == score
+    assert score_many(truth, [submission]) == [score]
+    assert score_event_detailed(truth, submission).score == score
+
+@pytest.mark.parametrize('method', ['drop', 'shuffle'])
+def test_score_sweep_matches_randomized_submissions(method):
+    truth, _ = _make_event(0)
+    probabilities = [0.01, 0.05, 0.1, 0.3]
+    table = score_sweep(truth, probabilities, seeds=[1, 2, 3], methods=[method],
+                        event_id=1000)
+    expected = []
+    for seed in [1, 2, 3]:
+        submissions = _randomize_truth(1000, truth, probabilities, method, seed)
+        expected.extend(score_event(truth, _) for _ in submissions)
+    assert table['score'].dtype == numpy.float32
+    numpy.testing.assert_array_equal(table['score'].values, expected)
+
+def test_score_event_detailed_definitions():
+    # particles 1 and 2 with four hits, particle 3 with two, and ten noise hits
+    particle_id = [1] * 4 + [2] * 4 + [3] * 2 + [0] * 10
+    truth = pandas.DataFrame({
+        'hit_id': numpy.arange(1, 21),
+        'particle_id': numpy.array(particle_id, dtype='i8'),
+        'weight': numpy.where(numpy.array(particle_id) == 0, 0., 0.1),
+    })
+    submission = pandas.DataFrame({
+        'hit_id': [1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 12] + list(range(13, 21)),
+        # good, good, duplicate, noise majority, and two noise-only tracks
+        'track_id': [1] * 4 + [2] * 3 + [3] + [4] * 3 + [5] * 4 + [6] * 4,
+    })
+    report = score_event_detailed(truth, submission)
+    tracks = report.tracks.set_index('track_id')
+    assert list(tracks['good']) == [True, True, False, False, False, False]
+    assert list(tracks['fake']) == [False, False, False, True, True, True]
+    assert list(tracks['duplicate']) == [False, False, True, False, False, False]
+    particles = report.particles.set_index('particle_id')
+    assert list(particles['ntracks']) == [1, 2, 0]
+    assert list(particles['reconstructed']) == [True, True, False]
+    metrics = report.metrics
+    assert (metrics['ntracks'], metrics['nfake'], metrics['nduplicate']) == (6, 3, 1)
+    assert (metrics['nparticles'], metrics['nreconstructed']) == (3, 2)
+    assert metrics['score'] == score_event(truth, submission)
+
+def test_score_event_detailed_noise_tracks():
+    truth, _ = _make_event(0, unassigned=0.)
+    # perfect tracks for all particles and noise split into five-hit tracks
+    noise = (truth['particle_id'].values == 0)
+    track_id = pandas.factorize(truth['particle_id'])[0].astype('i8') + 1
+    track_id[noise] = track_id.max() + 1 + numpy.arange(numpy.count_nonzero(noise)) // 5
+    submission = pandas.DataFrame({'hit_id': truth['hit_id'], 'track_id': track_id})
+    metrics = score_event_detailed(truth, submission).metrics
+    nnoise = (numpy.count_nonzero(noise) + 4) // 5
+    assert metrics['nfake'] == nnoise
+    assert metrics['nduplicate'] == 0
+    assert metrics['efficiency'] == 1.0
+    assert metrics['ntracks'] == metrics['nparticles'] + nnoise
+
+def test_repeated_unknown_hits():
+    truth, submission = _make_event(0, unassigned=0.)
+    extra = pandas.DataFrame({'hit_id': [-5, -5], 'track_id': [1, 2]})
+    repeated = pandas.concat([submission, extra], ignore_index=True)
+    with pytest.raises(pandas.errors.MergeError):
+        score_event(truth, repeated)
+    with pytest.raises(Exception, match='hit_id -5'):
+        score_event(PreparedTruth(truth), repeated)
+    with pytest.raises(Exception, match='hit_id -5'):
+        score_event_detailed(truth, repeated)
+    # repeated across chunks of the incremental scorer
+    scorer = IncrementalScorer(truth)
+    scorer.update(repeated['hit_id'].values[:-1], repeated['track_id'].values[:-1])
+    with pytest.raises(Exception, match='hit_id -5'):
+        scorer.update(repeated['hit_id'].values[-1:], repeated['track_id'].values[-1:])
+    # unique unknown hits are ignored
+    unique = repeated.iloc[:-1]
+    assert score_event(PreparedTruth(truth), unique) == score_event(truth, unique)
+    scorer.reset()
+    scorer.update(unique['hit_id'].values, unique['track_id'].values)
+    assert scorer.score() == score_event(truth, unique)
+
+@pytest.mark.parametrize('archive', [False, True])
+def test_score_dataset_workers(dataset, archive):
+    path = dataset[archive]
+    submissions = []
+    for event_id, truth in load_dataset(path, parts=['truth']):
+        submission = _randomize_truth(event_id, truth, [0.2], 'shuffle', 0)[0]
+        submission.insert(0, 'event_id', event_id)
+        submissions.append(submission)
+    # one event is missing and scores zero
+    submission = pandas.concat(submissions[:-1], ignore_index=True)
+    serial = score_dataset(path, submission, workers=1)
+    pooled = score_dataset(path, submission, workers=2, max_pending=1)
+    columns = ['event_id', 'score']
+    pandas.testing.assert_frame_equal(pooled.events[columns], serial.events[columns],
+                                      check_exact=True)
+    assert list(serial.events['event_id']) == [1000, 1001, 1002]
+    assert serial.events['score'].values[-1] == 0
+    assert 0 < serial.events['score'].values[0] < 1
+    assert pooled.score == serial.score
+
+@pytest.mark.parametrize('ordered', [False, True])
+@pytest.mark.parametrize('max_pending', [1, 3])
+def test_bounded_pending(ordered, max_pending):
+    consumed = []
+    def arguments():
+        for i in range(10):
+            consumed.append(i)
+            yield (-i,)
+    results = []
+    for result in _map_processes(abs, arguments(), workers=2,
+                                 max_pending=max_pending, ordered=ordered):
+        # submitted but not yet provided results
+        assert len(consumed) - len(results) <= max_pending
+        results.append(result)
+    assert sorted(results) == list(range(10))
+    if ordered:
+        assert results == list(range(10))
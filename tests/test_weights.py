@@ -0,0 +1,43 @@
+"""Tests for the hit weights with compact particle codes"""
+
+import pandas.testing
+import pytest
+
+from trackml.dataset import compact_event
+from trackml.weights import DEFAULT_MODEL, weight_hits_phase1, weight_hits_phase2
+
+def _event(make_event, seed=0):
+    _, _, particles, truth = make_event(5000, seed=seed)
+    # drop some particles so that separate compaction gives different codes
+    particles = particles.iloc[::2].reset_index(drop=True)
+    return truth, particles
+
+def _check(truth, particles, compact_truth, compact_particles):
+    for weight_hits in [weight_hits_phase1, weight_hits_phase2]:
+        expected = weight_hits(truth, particles)
+        weighted = weight_hits(compact_truth, compact_particles)
+        pandas.testing.assert_series_equal(weighted['weight'], expected['weight'],
+                                           check_exact=True)
+        pandas.testing.assert_series_equal(weighted['ihit'], expected['ihit'],
+                                           check_exact=True)
+
+def test_shared_codes(make_event):
+    truth, particles = _event(make_event)
+    (compact_particles, compact_truth), _ = compact_event(
+        ['particles', 'truth'], [particles, truth])
+    _check(truth, particles, compact_truth, compact_particles)
+
+def test_separately_compacted(make_event):
+    truth, particles = _event(make_event)
+    (compact_truth,), _ = compact_event(['truth'], [truth])
+    (compact_particles,), _ = compact_event(['particles'], [particles])
+    _check(truth, particles, compact_truth, compact_particles)
+
+@pytest.mark.parametrize('workers, max_pending', [(1, None), (2, 1), (2, None)])
+def test_weight_events(make_event, workers, max_pending):
+    events = [_event(make_event, seed) for seed in range(3)]
+    weighted = list(DEFAULT_MODEL.weight_events(iter(events), workers, max_pending))
+    assert len(weighted) == len(events)
+    for (truth, particles), result in zip(events, weighted):
+        pandas.testing.assert_frame_equal(result, weight_hits_phase1(truth, particles),
+                                          check_exact=True)
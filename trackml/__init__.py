@@ -0,0 +1,19 @@
+"""TrackML utility library
+
+The submodules are imported on first access, e.g. `trackml.score` is only
+imported when it is used after `import trackml`. Heavy dependencies such as
+pandas are only imported once they are needed.
+"""
+
+import importlib
+
+__all__ = ['cells', 'dataset', 'evaluate', 'profiling', 'randomize', 'results',
+           'score', 'spatial', 'store', 'utils', 'weights']
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,23 @@
+"""TrackML deferred imports of heavy dependencies"""
+
+import importlib
+import types
+
+class _LazyModule(types.ModuleType):
+    """Module placeholder that imports the actual module on first use.
+    """
+
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+
+    def __getattr__(self, name):
+        module = importlib.import_module(self.__name__)
+        # later lookups find the attributes directly
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
+
+def lazy_import(name):
+    """Return a placeholder for the named module that is imported on first
+    attribute access.
+    """
+    return _LazyModule(name)
@@ -0,0 +1,183 @@
+"""TrackML per-hit cluster features from the hit cells"""
+
+from collections import OrderedDict
+
+import numpy
+
+from ._lazy import lazy_import
+from .dataset import (CELLS_DTYPES, FILTER_CHUNK_SIZE, _iter_event_data_chunks,
+                      load_event_cells)
+
+pandas = lazy_import('pandas')
+
+# per-hit partial sums and extrema; partial results from different chunks
+# are combined with the same reduction
+_REDUCTIONS = [
+    ('ncells', numpy.add),
+    ('charge', numpy.add),
+    ('ch0_min', numpy.minimum),
+    ('ch0_max', numpy.maximum),
+    ('ch1_min', numpy.minimum),
+    ('ch1_max', numpy.maximum),
+    ('ch0_wsum', numpy.add),
+    ('ch1_wsum', numpy.add),
+]
+CELLS_COLUMNS = ['hit_id', 'ch0', 'ch1', 'value']
+
+def _segment_reduce(hit_id, partials):
+    """Reduce partial per-hit values over all entries with the same hit id.
+
+    Parameters
+    ----------
+    hit_id : numpy.ndarray
+        Hit id for each entry.
+    partials : Dict[str, numpy.ndarray]
+        Partial values for each entry keyed by the names in `_REDUCTIONS`.
+
+    Returns
+    -------
+    hit_id : numpy.ndarray
+        Sorted unique hit ids.
+    reduced : collections.OrderedDict
+        Reduced values for each unique hit id.
+    """
+    # cells are usually grouped by hit already and need no reordering
+    if 1 < len(hit_id) and numpy.any(hit_id[1:] < hit_id[:-1]):
+        order = numpy.argsort(hit_id, kind='stable')
+        hit_id = hit_id[order]
+        partials = dict((k, v[order]) for k, v in partials.items())
+    is_start = numpy.ones(len(hit_id), dtype=bool)
+    is_start[1:] = (hit_id[1:] != hit_id[:-1])
+    starts = numpy.flatnonzero(is_start)
+    reduced = OrderedDict()
+    for name, ufunc in _REDUCTIONS:
+        values = partials[name]
+        if len(starts):
+            reduced[name] = ufunc.reduceat(values, starts)
+        else:
+            reduced[name] = values[:0]
+    return hit_id[starts], reduced
+
+def _reduce_cells(cells):
+    """Compute the partial per-hit values for a table of cells.
+    """
+    ch0 = cells['ch0'].values
+    ch1 = cells['ch1'].values
+    # sums are computed in double precision to avoid accumulating rounding
+    value = cells['value'].values.astype('f8')
+    return _segment_reduce(cells['hit_id'].values, {
+        'ncells': numpy.ones(len(cells), dtype='i4'),
+        'charge': value,
+        'ch0_min': ch0,
+        'ch0_max': ch0,
+        'ch1_min': ch1,
+        'ch1_max': ch1,
+        'ch0_wsum': value * ch0,
+        'ch1_wsum': value * ch1,
+    })
+
+def _finalize(hit_id, reduced):
+    """Convert the reduced per-hit values into the feature table.
+    """
+    charge = reduced['charge']
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ch0_centroid = reduced['ch0_wsum'] / charge
+        ch1_centroid = reduced['ch1_wsum'] / charge
+    return pandas.DataFrame(OrderedDict([
+        ('hit_id', hit_id),
+        ('ncells', reduced['ncells'].astype('i4')),
+        ('charge', charge.astype('f4')),
+        ('ch0_min', reduced['ch0_min']),
+        ('ch0_max', reduced['ch0_max']),
+        ('ch1_min', reduced['ch1_min']),
+        ('ch1_max', reduced['ch1_max']),
+        ('ch0_extent', reduced['ch0_max'] - reduced['ch0_min'] + 1),
+        ('ch1_extent', reduced['ch1_max'] - reduced['ch1_min'] + 1),
+        ('ch0_centroid', ch0_centroid.astype('f4')),
+        ('ch1_centroid', ch1_centroid.astype('f4')),
+    ]))
+
+def _join_hits(hits, features):
+    """Add the cluster features to the hits.
+
+    Hits without cells have zero cells and charge and missing other features.
+    """
+    combined = pandas.merge(hits, features, how='left', on=['hit_id'],
+                            validate='one_to_one')
+    combined['ncells'] = combined['ncells'].fillna(0).astype('i4')
+    combined['charge'] = combined['charge'].fillna(0.0).astype('f4')
+    return combined
+
+def cell_features(cells, hits=None):
+    """Compute per-hit cluster features from the hit cells.
+
+    All features are computed in a single pass over the cells sorted by hit.
+
+    Parameters
+    ----------
+    cells : pandas.DataFrame
+        Cells information. Must have hit_id, ch0, ch1, and value columns.
+    hits : pandas.DataFrame, optional
+        Join the features onto these hits instead of returning them
+        separately.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Contains hit_id, ncells, charge, ch0_min, ch0_max, ch1_min, ch1_max,
+        ch0_extent, ch1_extent, ch0_centroid, and ch1_centroid columns for
+        each hit with cells. The centroids are weighted by the cell values.
+        If `hits` is given, the hits augmented with the feature columns.
+    """
+    features = _finalize(*_reduce_cells(cells))
+    if hits is not None:
+        return _join_hits(hits, features)
+    return features
+
+def load_event_cell_features(prefix, hits=None, cache=None,
+                             chunksize=FILTER_CHUNK_SIZE):
+    """Load per-hit cluster features for a single event with the given prefix.
+
+    Without a cache, the cells are parsed and reduced in chunks so that the
+    full cells table is never kept in memory.
+
+    Parameters
+    ----------
+    prefix : str or pathlib.Path
+        The common prefix name for the event files as in `load_event`.
+    hits : pandas.DataFrame, optional
+        Join the features onto these hits instead of returning them
+        separately.
+    cache : bool or str, optional
+        Read the cells from the binary cache as in `load_event`.
+    chunksize : int, optional
+        Number of cells that are parsed at once.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The cluster features as in `cell_features`.
+    """
+    if cache:
+        return cell_features(load_event_cells(prefix, cache, CELLS_COLUMNS), hits)
+    hit_ids = []
+    partials = []
+    for chunk in _iter_event_data_chunks(prefix, 'cells', CELLS_COLUMNS, chunksize):
+        hit_id, reduced = _reduce_cells(chunk)
+        hit_ids.append(hit_id)
+        partials.append(reduced)
+    if not partials:
+        empty = pandas.DataFrame(OrderedDict(
+            (_, numpy.empty(0, dtype=CELLS_DTYPES[_])) for _ in CELLS_COLUMNS))
+        hit_id, reduced = _reduce_cells(empty)
+    elif len(partials) == 1:
+        hit_id, reduced = hit_ids[0], partials[0]
+    else:
+        # hits can be split across chunk boundaries
+        hit_id, reduced = _segment_reduce(
+            numpy.concatenate(hit_ids),
+            dict((k, numpy.concatenate([_[k] for _ in partials])) for k, _ in _REDUCTIONS))
+    features = _finalize(hit_id, reduced)
+    if hits is not None:
+        return _join_hits(hits, features)
+    return features
@@ -2,13 +2,23 @@
 
 __authors__ = ['Moritz Kiehn', 'Sabrina Amrouche', 'Nimar Arora']
 
+from collections import OrderedDict, deque
 import glob
+import gzip
+import hashlib
+import multiprocessing
 import os
 import os.path as op
 import re
+import threading
 import zipfile
 
-import pandas
+import numpy
+
+from . import profiling
+from ._lazy import lazy_import
+
+pandas = lazy_import('pandas')
 
 CELLS_DTYPES = dict([
     ('hit_id', 'i4'),
@@ -55,50 +65,388 @@ DTYPES = {
     'truth': TRUTH_DTYPES,
 }
 DEFAULT_PARTS = ['hits', 'cells', 'particles', 'truth']
+# narrower types for small-range columns in the compact representation
+COMPACT_DTYPES = {
+    'cells': dict([('ch0', 'i2'), ('ch1', 'i2')]),
+    'hits': dict([('volume_id', 'i1'), ('layer_id', 'i1'), ('module_id', 'i2')]),
+    'particles': dict([('q', 'i1'), ('nhits', 'i2')]),
+    'truth': dict(),
+}
+
+# supported operators for row filters
+FILTER_OPERATORS = {
+    '==': numpy.equal,
+    '!=': numpy.not_equal,
+    '<': numpy.less,
+    '<=': numpy.less_equal,
+    '>': numpy.greater,
+    '>=': numpy.greater_equal,
+    'in': lambda a, b: numpy.isin(a, b),
+    'not in': lambda a, b: numpy.isin(a, b, invert=True),
+}
+# number of csv rows parsed at once when rows are filtered
+FILTER_CHUNK_SIZE = 1 << 18
+# supported csv parsers; auto uses pyarrow if it is available
+CSV_ENGINES = ['auto', 'pandas', 'pyarrow']
+
+def _check_selection(name, columns=None, filters=None):
+    """Check that the column selection and filters are valid for a part.
+    """
+    names = list(columns or []) + [_[0] for _ in (filters or [])]
+    unknown = [_ for _ in names if _ not in DTYPES[name]]
+    if unknown:
+        raise Exception('Unknown {} columns {}'.format(name, unknown))
+    unknown = [_[1] for _ in (filters or []) if _[1] not in FILTER_OPERATORS]
+    if unknown:
+        raise Exception('Unknown filter operators {}'.format(unknown))
+
+def _required_columns(columns=None, filters=None):
+    """Return the columns that must be read to apply the selection.
+
+    Returns None if all columns are required.
+    """
+    if columns is None:
+        return None
+    required = list(columns)
+    required.extend(_[0] for _ in (filters or []) if _[0] not in required)
+    return required
+
+def _filter_mask(data, filters):
+    """Compute the row mask for a list of (column, operator, value) filters.
+
+    `data` can be any mapping from column names to arrays.
+    """
+    mask = None
+    for column, operator_name, value in filters:
+        m = FILTER_OPERATORS[operator_name](numpy.asarray(data[column]), value)
+        mask = m if mask is None else (mask & m)
+    return mask
+
+def _select(data, columns=None, filters=None):
+    """Apply row filters and the column selection to a loaded DataFrame.
+    """
+    if filters:
+        data = data[_filter_mask(data, filters)].reset_index(drop=True)
+    if columns is not None:
+        data = data[list(columns)]
+    return data
+
+def _downcast(values, dtype):
+    """Convert integer values to a narrower type if all values fit.
+    """
+    info = numpy.iinfo(dtype)
+    if len(values) and ((values.min() < info.min) or (info.max < values.max())):
+        return values
+    return values.astype(dtype)
+
+def compact_event(parts, data):
+    """Convert loaded event data into the compact representation.
+
+    Small-range integer columns are converted to narrower types and a dense
+    `particle_code` column is added to all parts with a `particle_id`
+    column. The codes are shared between the parts of the event.
+
+    Parameters
+    ----------
+    parts : List[{'hits', 'cells', 'particles', 'truth'}]
+        The event parts in the same order as `data`.
+    data : List[pandas.DataFrame]
+        The loaded event data.
 
-def _load_event_data(prefix, name):
+    Returns
+    -------
+    data : tuple
+        The compact `pandas.DataFrame` for each element of `parts`.
+    particle_ids : numpy.ndarray
+        Sorted unique particle ids of the event such that
+        `particle_ids[particle_code] == particle_id`.
+    """
+    ids = [df['particle_id'].values for df in data if 'particle_id' in df]
+    particle_ids = numpy.unique(numpy.concatenate(ids)) if ids else numpy.empty(0, dtype='i8')
+    compact = []
+    for name, df in zip(parts, data):
+        df = df.copy(deep=False)
+        for column, dtype in COMPACT_DTYPES[name].items():
+            if column in df:
+                df[column] = _downcast(df[column].values, dtype)
+        if 'particle_id' in df:
+            codes = numpy.searchsorted(particle_ids, df['particle_id'].values)
+            df['particle_code'] = codes.astype('i4')
+        compact.append(df)
+    return tuple(compact), particle_ids
+
+def _pyarrow_csv():
+    """Return the pyarrow csv module or None if it is not available.
+    """
+    try:
+        import pyarrow.csv
+    except ImportError:
+        return None
+    return pyarrow.csv
+
+def _csv_engine(engine=None):
+    """Resolve the csv engine name, i.e. select the parser for auto.
+    """
+    if engine is None:
+        engine = 'auto'
+    if engine not in CSV_ENGINES:
+        raise Exception('Unknown csv engine \'{}\''.format(engine))
+    if engine == 'auto':
+        return 'pyarrow' if (_pyarrow_csv() is not None) else 'pandas'
+    if (engine == 'pyarrow') and (_pyarrow_csv() is None):
+        raise Exception('The pyarrow csv engine requires the pyarrow package')
+    return engine
+
+def _read_csv_pandas(f, dtype, usecols, columns=None, filters=None):
+    """Parse a csv file with the pandas parser.
+    """
+    if not filters:
+        return pandas.read_csv(f, header=0, index_col=False, dtype=dtype,
+                               usecols=usecols)
+    chunks = pandas.read_csv(f, header=0, index_col=False, dtype=dtype,
+                             usecols=usecols, chunksize=FILTER_CHUNK_SIZE)
+    chunks = [_select(_, columns, filters) for _ in chunks]
+    return pandas.concat(chunks, ignore_index=True)
+
+def _read_csv_pyarrow(f, dtype, usecols, columns=None, filters=None):
+    """Parse a csv file with the multi-threaded pyarrow parser.
+    """
+    import pyarrow
+    csv = _pyarrow_csv()
+    # floats are parsed in double precision and converted afterwards to get
+    # the same rounding as the pandas parser
+    types = dict((k, pyarrow.float64() if (numpy.dtype(v).kind == 'f')
+                  else pyarrow.from_numpy_dtype(numpy.dtype(v)))
+                 for k, v in dtype.items())
+    options = csv.ConvertOptions(column_types=types, include_columns=usecols)
+    def convert(table):
+        data = table.to_pandas()
+        for k, v in dtype.items():
+            if (k in data) and (data[k].dtype != v):
+                data[k] = data[k].values.astype(v)
+        return data
+    if not filters:
+        return convert(csv.read_csv(f, convert_options=options))
+    # record batches are filtered while the file is parsed
+    reader = csv.open_csv(f, convert_options=options)
+    chunks = [_select(convert(pyarrow.Table.from_batches([_])), columns, filters)
+              for _ in reader]
+    if not chunks:
+        return convert(reader.schema.empty_table())
+    return pandas.concat(chunks, ignore_index=True)
+
+_CSV_READERS = {
+    'pandas': _read_csv_pandas,
+    'pyarrow': _read_csv_pyarrow,
+}
+
+def _read_event_data(f, name, columns=None, filters=None, nbytes=0, engine=None):
+    """Parse per-event data for one single type from a csv file object or path.
+
+    Only the selected columns are parsed. Rows are filtered in chunks so that
+    rejected rows are never kept in memory together. `nbytes` is the size of
+    the source file that is reported to the profiling.
+    """
+    read = _CSV_READERS[_csv_engine(engine)]
+    usecols = _required_columns(columns, filters)
+    with profiling.stage('dataset.parse_csv') as stage:
+        data = read(f, DTYPES[name], usecols, columns, filters)
+        stage.rows = len(data)
+        stage.bytes = nbytes
+    return _select(data, columns)
+
+def _cache_file(cache, source, location):
+    """Return the binary cache file path for a source csv file.
+
+    Parameters
+    ----------
+    cache : True or str
+        True to store the cache file next to `location` or a path to a cache
+        directory.
+    source : str
+        Identifier of the source file, e.g. its path or an archive member.
+    location : str
+        Default directory for cache files.
+    """
+    name = op.basename(source).split('.csv', 1)[0]
+    if cache is True:
+        directory = location
+    else:
+        # the source digest separates events with identical names
+        directory = str(cache)
+        digest = hashlib.sha1(op.dirname(source).encode('utf-8')).hexdigest()
+        name = '{}-{}'.format(name, digest[:12])
+    return op.join(directory, name + '.npz')
+
+def _read_cache(cache_file, signature, columns=None, filters=None):
+    """Read a cached DataFrame or return None if missing or outdated.
+
+    Only the columns required for the selection are read from the cache.
+    """
+    with profiling.stage('dataset.read_cache') as stage:
+        try:
+            with numpy.load(cache_file, allow_pickle=False) as data:
+                if str(data['_signature']) != signature:
+                    return None
+                required = _required_columns(columns, filters)
+                if required is None:
+                    required = [str(_) for _ in data['_columns']]
+                arrays = OrderedDict((_, data[_]) for _ in required)
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+        if filters:
+            mask = _filter_mask(arrays, filters)
+            arrays = OrderedDict((k, v[mask]) for k, v in arrays.items())
+        stage.rows = len(next(iter(arrays.values()), ()))
+        stage.bytes = sum(_.nbytes for _ in arrays.values())
+    return _select(pandas.DataFrame(arrays), columns)
+
+def _write_cache(cache_file, signature, data):
+    """Atomically write a DataFrame to a binary cache file.
+    """
+    directory = op.dirname(cache_file)
+    if directory and not op.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # could have been created concurrently
+            if not op.isdir(directory):
+                raise
+    tmp = '{}.{}.tmp'.format(cache_file, os.getpid())
+    arrays = OrderedDict((_, data[_].values) for _ in data.columns)
+    with profiling.stage('dataset.write_cache') as stage:
+        with open(tmp, 'wb') as f:
+            numpy.savez(f,
+                        _signature=numpy.array(signature),
+                        _columns=numpy.array(list(data.columns)),
+                        **arrays)
+        os.replace(tmp, cache_file)
+        stage.rows = len(data)
+        stage.bytes = sum(_.nbytes for _ in arrays.values())
+
+def _read_cached(cache, source, signature, location, read, columns=None,
+                 filters=None):
+    """Read data through the binary cache, updating it if necessary.
+
+    `read` is a function without arguments that parses the full source file.
+    """
+    cache_file = _cache_file(cache, source, location)
+    data = _read_cache(cache_file, signature, columns, filters)
+    if data is None:
+        data = read()
+        _write_cache(cache_file, signature, data)
+        data = _select(data, columns, filters)
+    return data
+
+def _load_event_data(prefix, name, cache=None, columns=None, filters=None,
+                     engine=None):
     """Load per-event data for one single type, e.g. hits, or particles.
     """
+    _check_selection(name, columns, filters)
     # csv files can be individually zipped with extension .csv.gz
     expr = '{!s}-{}.csv*'.format(prefix, name)
     files = glob.glob(expr)
-    dtype = DTYPES[name]
+    if len(files) == 0:
+        inside = _split_archive_prefix(prefix)
+        if inside is not None:
+            with _ZipArchive(inside[0]) as archive:
+                return archive.read(archive.find(inside[1]), name, cache, columns,
+                                    filters, engine)
     if len(files) == 1:
-        return pandas.read_csv(files[0], header=0, index_col=False, dtype=dtype)
+        path = files[0]
+        stat = os.stat(path)
+        if not cache:
+            return _read_event_data(path, name, columns, filters, stat.st_size, engine)
+        # cache is invalidated by any change of the source file
+        signature = '{}:{}:{!r}'.format(op.abspath(path), stat.st_size, stat.st_mtime)
+        read = lambda: _read_event_data(path, name, nbytes=stat.st_size, engine=engine)
+        return _read_cached(cache, op.abspath(path), signature, op.dirname(path),
+                            read, columns, filters)
     elif len(files) == 0:
         raise Exception('No file matches \'{}\''.format(expr))
     else:
         raise Exception('More than one file matches \'{}\''.format(expr))
 
-def load_event_hits(prefix):
+def _iter_event_data_chunks(prefix, name, columns=None, chunksize=FILTER_CHUNK_SIZE):
+    """Parse per-event data for one single type in chunks of rows.
+
+    Only a single chunk is kept in memory at any time.
+    """
+    _check_selection(name, columns)
+    expr = '{!s}-{}.csv*'.format(prefix, name)
+    files = glob.glob(expr)
+    if len(files) == 0:
+        inside = _split_archive_prefix(prefix)
+        if inside is not None:
+            with _ZipArchive(inside[0]) as archive:
+                for chunk in archive.iter_chunks(archive.find(inside[1]), name,
+                                                 columns, chunksize):
+                    yield chunk
+            return
+    if len(files) == 1:
+        for chunk in pandas.read_csv(files[0], header=0, index_col=False,
+                                     dtype=DTYPES[name], usecols=columns,
+                                     chunksize=chunksize):
+            yield chunk
+    elif len(files) == 0:
+        raise Exception('No file matches \'{}\''.format(expr))
+    else:
+        raise Exception('More than one file matches \'{}\''.format(expr))
+
+def load_event_hits(prefix, cache=None, columns=None, filters=None,
+                    engine=None):
     """Load the hits information for a single event with the given prefix.
     """
-    return _load_event_data(prefix, 'hits')
+    return _load_event_data(prefix, 'hits', cache, columns, filters, engine)
 
-def load_event_cells(prefix):
+def load_event_cells(prefix, cache=None, columns=None, filters=None,
+                     engine=None):
     """Load the hit cells information for a single event with the given prefix.
     """
-    return _load_event_data(prefix, 'cells')
+    return _load_event_data(prefix, 'cells', cache, columns, filters, engine)
 
-def load_event_particles(prefix):
+def load_event_particles(prefix, cache=None, columns=None, filters=None,
+                         engine=None):
     """Load the particles information for a single event with the given prefix.
     """
-    return _load_event_data(prefix, 'particles')
+    return _load_event_data(prefix, 'particles', cache, columns, filters, engine)
 
-def load_event_truth(prefix):
+def load_event_truth(prefix, cache=None, columns=None, filters=None,
+                     engine=None):
     """Load only the truth information for a single event with the given prefix.
     """
-    return _load_event_data(prefix, 'truth')
+    return _load_event_data(prefix, 'truth', cache, columns, filters, engine)
 
-def load_event(prefix, parts=DEFAULT_PARTS):
+def load_event(prefix, parts=DEFAULT_PARTS, cache=None, columns=None,
+               filters=None, compact=False, engine=None):
     """Load data for a single event with the given prefix.
 
     Parameters
     ----------
     prefix : str or pathlib.Path
         The common prefix name for the event files, i.e. without `-hits.csv`).
+        Events inside a zip file are selected by appending the event prefix
+        to the path of the zip file, e.g. `train_1.zip/event000001000`.
     parts : List[{'hits', 'cells', 'particles', 'truth'}], optional
         Which parts of the event files to load.
+    cache : bool or str, optional
+        Read the data from a binary cache instead of parsing the csv files.
+        If true, the cache files are stored next to the csv files, otherwise
+        in the given cache directory. Cache files are created on first use
+        and are recreated whenever the source file changes.
+    columns : Dict[str, List[str]], optional
+        Only load the given columns for the selected parts, e.g.
+        `{'hits': ['hit_id', 'x', 'y', 'z']}`. Other parts are fully loaded.
+    filters : Dict[str, List[Tuple[str, str, object]]], optional
+        Only load rows that pass all (column, operator, value) filters for
+        the selected parts, e.g. `{'hits': [('volume_id', 'in', [7, 8, 9])]}`.
+        Supported operators are ==, !=, <, <=, >, >=, in, and not in.
+    compact : bool, optional
+        Return the compact representation with narrower integer types and
+        an additional dense `particle_code` column; see `compact_event`.
+    engine : {'auto', 'pandas', 'pyarrow'}, optional
+        The csv parser. Auto uses the faster pyarrow parser if it is
+        installed and pandas otherwise. All parsers return identical data.
 
     Returns
     -------
@@ -107,9 +455,26 @@ def load_event(prefix, parts=DEFAULT_PARTS):
         element has field names identical to the CSV column names with
         appropriate types.
     """
-    return tuple(_load_event_data(prefix, name) for name in parts)
+    columns = columns or {}
+    filters = filters or {}
+    inside = _split_archive_prefix(prefix)
+    if inside is not None:
+        with _ZipArchive(inside[0]) as archive:
+            prefix = archive.find(inside[1])
+            data = tuple(archive.read(prefix, name, cache, columns.get(name),
+                                      filters.get(name), engine)
+                         for name in parts)
+    else:
+        data = tuple(_load_event_data(prefix, name, cache, columns.get(name),
+                                      filters.get(name), engine)
+                     for name in parts)
+    if compact:
+        data = compact_event(parts, data)[0]
+    return data
 
-def load_dataset(path, skip=None, nevents=None, parts=DEFAULT_PARTS):
+def load_dataset(path, skip=None, nevents=None, parts=DEFAULT_PARTS,
+                 cache=None, prefetch=None, workers=None, columns=None,
+                 filters=None, compact=False, engine=None):
     """Provide an iterator over (all) events in a dataset.
 
     Parameters
@@ -122,6 +487,32 @@ def load_dataset(path, skip=None, nevents=None, parts=DEFAULT_PARTS):
         Only load a maximum of `nevents` events.
     parts : List[{'hits', 'cells', 'particles', 'truth'}], optional
         Which parts of each event files to load.
+    cache : bool or str, optional
+        Read the data from a binary cache instead of parsing the csv files.
+        If true, the cache files are stored next to the csv files or, for a
+        zip file, in a directory with the name of the zip file and a `-cache`
+        suffix. Otherwise the cache files are stored in the given directory.
+        Cache files are created on first use and are recreated whenever the
+        source file changes.
+    prefetch : int, optional
+        Load up to `prefetch` upcoming events in background threads while
+        the current event is processed. Events are still provided in order.
+    workers : int, optional
+        Number of background threads used with `prefetch`. The parts of one
+        event are loaded concurrently as well.
+    columns : Dict[str, List[str]], optional
+        Only load the given columns for the selected parts, e.g.
+        `{'hits': ['hit_id', 'x', 'y', 'z']}`. Other parts are fully loaded.
+    filters : Dict[str, List[Tuple[str, str, object]]], optional
+        Only load rows that pass all (column, operator, value) filters for
+        the selected parts, e.g. `{'hits': [('volume_id', 'in', [7, 8, 9])]}`.
+        Supported operators are ==, !=, <, <=, >, >=, in, and not in.
+    compact : bool, optional
+        Provide the compact representation with narrower integer types and
+        an additional dense `particle_code` column; see `compact_event`.
+    engine : {'auto', 'pandas', 'pyarrow'}, optional
+        The csv parser. Auto uses the faster pyarrow parser if it is
+        installed and pandas otherwise. All parsers return identical data.
 
     Yields
     ------
@@ -130,29 +521,153 @@ def load_dataset(path, skip=None, nevents=None, parts=DEFAULT_PARTS):
     *data
         Event data element as specified in `parts`.
     """
-    # extract a sorted list of event file prefixes.
-    def list_prefixes(files):
-        # Note: the file names may optionally have a directory prefix if they
-        # are derived from a zipfile, for example. Hence the regular expression
-        # can't be anchored at the beginning of the file name.
-        regex = re.compile('.*event\d{9}-[a-zA-Z]+.csv(.gz)?$')
-        files = filter(regex.match, files)
-        prefixes = set(_.split('-', 1)[0] for _ in files)
-        prefixes = sorted(prefixes)
-        if skip is not None:
-            prefixes = prefixes[skip:]
-        if nevents is not None:
-            prefixes = prefixes[:nevents]
-        return prefixes
-
     # TODO use `yield from` once we increase the python requirement
     if op.isdir(path):
-        for x in _iter_dataset_dir(path, list_prefixes(os.listdir(path)), parts):
-            yield x
-    else:
-        with zipfile.ZipFile(path, mode='r') as z:
-            for x in _iter_dataset_zip(z, list_prefixes(z.namelist()), parts):
+        prefixes = _list_prefixes(os.listdir(path), skip, nevents)
+        events = _iter_dataset_dir(path, prefixes, parts, cache, prefetch,
+                                   workers, columns, filters, compact, engine)
+        try:
+            for x in events:
                 yield x
+        finally:
+            events.close()
+    else:
+        with _ZipArchive(path) as archive:
+            prefixes = _slice_prefixes(archive.prefixes, skip, nevents)
+            events = _iter_dataset_zip(archive, prefixes, parts, cache, prefetch,
+                                       workers, columns, filters, compact, engine)
+            # background loading must be stopped before the archive is closed
+            try:
+                for x in events:
+                    yield x
+            finally:
+                events.close()
+
+def _list_prefixes(files, skip=None, nevents=None):
+    """Extract a sorted list of event file prefixes from a list of file names.
+    """
+    # Note: the file names may optionally have a directory prefix if they
+    # are derived from a zipfile, for example. Hence the regular expression
+    # can't be anchored at the beginning of the file name.
+    regex = re.compile(r'.*event\d{9}-[a-zA-Z]+.csv(.gz)?$')
+    files = filter(regex.match, files)
+    prefixes = set(_.split('-', 1)[0] for _ in files)
+    return _slice_prefixes(sorted(prefixes), skip, nevents)
+
+def _slice_prefixes(prefixes, skip=None, nevents=None):
+    """Select the prefixes after skipping and limiting the number of events.
+    """
+    if skip is not None:
+        prefixes = prefixes[skip:]
+    if nevents is not None:
+        prefixes = prefixes[:nevents]
+    return prefixes
+
+def _list_dataset_prefixes(path, skip=None, nevents=None):
+    """List the sorted event prefixes in a dataset directory or zip file.
+    """
+    if op.isdir(path):
+        return _list_prefixes(os.listdir(path), skip, nevents)
+    return _slice_prefixes(sorted(_zip_index(path)), skip, nevents)
+
+def _map_processes(function, arguments, workers=None, max_pending=None,
+                   ordered=False):
+    """Call a function for each argument tuple in a pool of worker processes.
+
+    The arguments are consumed lazily and at most `max_pending` calls are in
+    flight at the same time, i.e. the memory usage is bounded independent
+    of the number of calls.
+
+    Parameters
+    ----------
+    function : callable
+        Picklable, e.g. module-level, function.
+    arguments : iterable of tuple
+        Positional arguments for each call.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of cpus. With a
+        single worker all calls are made in the current process.
+    max_pending : int, optional
+        Maximum number of calls in flight at the same time. Defaults to
+        twice the number of workers.
+    ordered : bool, optional
+        Yield the results in the order of the arguments instead of in
+        completion order.
+
+    Yields
+    ------
+    The result of each call.
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1:
+        for args in arguments:
+            yield function(*args)
+        return
+    if max_pending is None:
+        max_pending = 2 * workers
+    max_pending = max(max_pending, 1)
+
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # bounded queue of in-flight calls in the order they are submitted
+        pending = deque()
+        arguments = iter(arguments)
+        try:
+            while True:
+                while len(pending) < max_pending:
+                    args = next(arguments, None)
+                    if args is None:
+                        break
+                    pending.append(executor.submit(function, *args))
+                if not pending:
+                    break
+                if ordered:
+                    yield pending.popleft().result()
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield future.result()
+        finally:
+            # stop calls whose results will not be used, e.g. on early exit
+            for future in pending:
+                future.cancel()
+
+def _load_dataset_event(path, prefix, parts=DEFAULT_PARTS, cache=None,
+                        columns=None, filters=None, compact=False, engine=None):
+    """Load a single event from a dataset directory or zip file.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to a directory or a zip file containing event files.
+    prefix : str
+        Event prefix as returned by `_list_dataset_prefixes`.
+    parts : List[{'hits', 'cells', 'particles', 'truth'}], optional
+        Which parts of the event files to load.
+    cache : bool or str, optional
+        Binary cache location as in `load_dataset`.
+    columns, filters : dict, optional
+        Column selection and row filters as in `load_dataset`.
+    compact : bool, optional
+        Return the compact representation as in `load_dataset`.
+    engine : {'auto', 'pandas', 'pyarrow'}, optional
+        The csv parser as in `load_dataset`.
+
+    Returns
+    -------
+    tuple
+        The event identifier followed by the event data as in `load_dataset`.
+    """
+    if op.isdir(path):
+        return next(_iter_dataset_dir(path, [prefix], parts, cache,
+                                      columns=columns, filters=filters,
+                                      compact=compact, engine=engine))
+    with _ZipArchive(path) as archive:
+        return next(_iter_dataset_zip(archive, [prefix], parts, cache,
+                                      columns=columns, filters=filters,
+                                      compact=compact, engine=engine))
 
 def _extract_event_id(prefix):
     """Extract event_id from prefix.
@@ -163,18 +678,444 @@ def _extract_event_id(prefix):
     groups = re.findall(regex, prefix)
     return int(groups[0])
 
-def _iter_dataset_dir(directory, prefixes, parts):
+def _iter_events(load, prefixes, parts, prefetch=None, workers=None,
+                 compact=False):
+    """Iterate over selected events using a per-part loader function.
+
+    Parameters
+    ----------
+    load : callable
+        Function with arguments (prefix, name) that loads one event part.
+    prefixes : List[str]
+        Sorted event prefixes.
+    parts : List[{'hits', 'cells', 'particles', 'truth'}]
+        Which parts of each event files to load.
+    prefetch : int, optional
+        Number of events that are loaded ahead in background threads.
+    workers : int, optional
+        Number of background threads.
+    compact : bool, optional
+        Convert each event into the compact representation.
+    """
+    def event(p, data):
+        if compact:
+            data = compact_event(parts, data)[0]
+        return (_extract_event_id(p),) + tuple(data)
+
+    if not prefetch:
+        for p in prefixes:
+            yield event(p, [load(p, _) for _ in parts])
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    executor = ThreadPoolExecutor(max_workers=workers)
+    # bounded queue of in-flight events in the order they are provided
+    pending = deque()
+    prefixes = iter(prefixes)
+    try:
+        while True:
+            # the current event plus the prefetched ones
+            while len(pending) < (prefetch + 1):
+                p = next(prefixes, None)
+                if p is None:
+                    break
+                pending.append((p, [executor.submit(load, p, _) for _ in parts]))
+            if not pending:
+                break
+            p, futures = pending.popleft()
+            yield event(p, [_.result() for _ in futures])
+    finally:
+        # stop loading events that will not be used, e.g. on early exit
+        for _, futures in pending:
+            for f in futures:
+                f.cancel()
+        executor.shutdown(wait=True)
+
+def _iter_dataset_dir(directory, prefixes, parts, cache=None, prefetch=None,
+                      workers=None, columns=None, filters=None, compact=False,
+                      engine=None):
     """Iterate over selected events files inside a directory.
     """
-    for p in prefixes:
-        yield (_extract_event_id(p),) + load_event(op.join(directory, p), parts)
+    columns = columns or {}
+    filters = filters or {}
+    def load(prefix, name):
+        return _load_event_data(op.join(directory, prefix), name, cache,
+                                columns.get(name), filters.get(name), engine)
+    return _iter_events(load, prefixes, parts, prefetch, workers, compact)
 
-def _iter_dataset_zip(zipfile, prefixes, parts):
+# event files inside an archive, optionally inside a directory
+_ZIP_MEMBER_REGEX = re.compile(r'(.*event\d{9})-([a-zA-Z]+)\.csv(\.gz)?$')
+# event member index for each archive; keyed by path, size, and mtime
+_ZIP_INDICES = {}
+_ZIP_INDICES_MAX = 16
+
+def _zip_index(path):
+    """Return the cached event prefix to part member mapping for an archive.
+    """
+    path = op.abspath(str(path))
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+    index = _ZIP_INDICES.get(key)
+    if index is None:
+        index = {}
+        with zipfile.ZipFile(path, mode='r') as z:
+            for member in z.namelist():
+                match = _ZIP_MEMBER_REGEX.match(member)
+                if match:
+                    index.setdefault(match.group(1), {})[match.group(2)] = member
+        if _ZIP_INDICES_MAX <= len(_ZIP_INDICES):
+            _ZIP_INDICES.clear()
+        _ZIP_INDICES[key] = index
+    return index
+
+class _ZipArchive(object):
+    """Event access inside a zip archive.
+
+    Members are looked up through the cached event index. Each thread uses
+    its own file handle so that members can be decompressed and parsed
+    concurrently.
+    """
+
+    def __init__(self, path):
+        self.path = op.abspath(str(path))
+        self.index = _zip_index(self.path)
+        self.prefixes = sorted(self.index)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._handles = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            for z in self._handles:
+                z.close()
+            self._handles = []
+        self._local = threading.local()
+
+    def _handle(self):
+        z = getattr(self._local, 'handle', None)
+        if z is None:
+            z = zipfile.ZipFile(self.path, mode='r')
+            with self._lock:
+                self._handles.append(z)
+            self._local.handle = z
+        return z
+
+    def find(self, prefix):
+        """Find the archive event prefix, e.g. with a missing directory.
+        """
+        if prefix in self.index:
+            return prefix
+        matches = [_ for _ in self.prefixes if op.basename(_) == op.basename(prefix)]
+        if len(matches) == 1:
+            return matches[0]
+        elif len(matches) == 0:
+            raise Exception('No event matches \'{}\' in \'{}\''.format(prefix, self.path))
+        else:
+            raise Exception('More than one event matches \'{}\' in \'{}\''.format(prefix, self.path))
+
+    def _member(self, prefix, name):
+        member = self.index.get(prefix, {}).get(name)
+        if member is None:
+            raise Exception('No member matches \'{}-{}.csv*\' in \'{}\''.format(prefix, name, self.path))
+        return member
+
+    def iter_chunks(self, prefix, name, columns=None, chunksize=FILTER_CHUNK_SIZE):
+        """Parse per-event data for one single type in chunks of rows.
+        """
+        _check_selection(name, columns)
+        member = self._member(prefix, name)
+        with self._handle().open(member, mode='r') as f:
+            # csv files can be individually compressed inside the archive
+            compression = 'gzip' if member.endswith('.gz') else None
+            for chunk in pandas.read_csv(f, header=0, index_col=False,
+                                         dtype=DTYPES[name], usecols=columns,
+                                         compression=compression,
+                                         chunksize=chunksize):
+                yield chunk
+
+    def read(self, prefix, name, cache=None, columns=None, filters=None,
+             engine=None):
+        """Load per-event data for one single type from the archive.
+        """
+        _check_selection(name, columns, filters)
+        member = self._member(prefix, name)
+        z = self._handle()
+        info = z.getinfo(member)
+        def read(columns=None, filters=None):
+            with z.open(member, mode='r') as f:
+                # csv files can be individually compressed inside the archive
+                if member.endswith('.gz'):
+                    with gzip.GzipFile(fileobj=f, mode='rb') as g:
+                        return _read_event_data(g, name, columns, filters,
+                                                info.compress_size, engine)
+                return _read_event_data(f, name, columns, filters,
+                                        info.compress_size, engine)
+        if not cache:
+            return read(columns, filters)
+        # cache is invalidated by any change of the archive member
+        source = '{}/{}'.format(self.path, member)
+        signature = '{}:{}:{}:{}'.format(source, info.file_size, info.CRC, info.date_time)
+        location = '{}-cache'.format(op.splitext(self.path)[0])
+        return _read_cached(cache, source, signature, location, read, columns, filters)
+
+def _split_archive_prefix(prefix):
+    """Split an event prefix inside a zip archive into archive and prefix.
+
+    E.g. `train_1.zip/train_1/event000001000` is split into `train_1.zip` and
+    `train_1/event000001000`. Returns None if the prefix is not inside an
+    archive.
+    """
+    head = str(prefix)
+    if op.isdir(op.dirname(head) or '.'):
+        return None
+    tail = []
+    while head and not op.exists(head):
+        head, t = op.split(head)
+        if not t:
+            return None
+        tail.insert(0, t)
+    if head and op.isfile(head) and zipfile.is_zipfile(head):
+        return head, '/'.join(tail)
+    return None
+
+def _iter_dataset_zip(archive, prefixes, parts, cache=None, prefetch=None,
+                      workers=None, columns=None, filters=None, compact=False,
+                      engine=None):
     """Iterate over selected event files inside a zip archive.
     """
-    for p in prefixes:
-        files = [zipfile.open('{}-{}.csv'.format(p, _), mode='r') for _ in parts]
-        dtypes = [DTYPES[_] for _ in parts]
-        data = tuple(pandas.read_csv(f, header=0, index_col=False, dtype=d)
-                                     for f, d in zip(files, dtypes))
-        yield (_extract_event_id(p),) + data
+    columns = columns or {}
+    filters = filters or {}
+    def load(prefix, name):
+        return archive.read(prefix, name, cache, columns.get(name),
+                            filters.get(name), engine)
+    return _iter_events(load, prefixes, parts, prefetch, workers, compact)
+
+def cache_dataset(path, cache=True, skip=None, nevents=None, parts=DEFAULT_PARTS,
+                  engine=None):
+    """Create or update the binary cache for (all) events in a dataset.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to a directory or a zip file containing event files.
+    cache : bool or str, optional
+        Cache location as in `load_dataset`. By default, the cache files are
+        stored next to the dataset.
+    skip : int, optional
+        Skip the first `skip` events.
+    nevents : int, optional
+        Only convert a maximum of `nevents` events.
+    parts : List[{'hits', 'cells', 'particles', 'truth'}], optional
+        Which parts of each event files to convert.
+    engine : {'auto', 'pandas', 'pyarrow'}, optional
+        The csv parser as in `load_dataset`.
+
+    Returns
+    -------
+    List[int]
+        The identifiers of all converted events.
+    """
+    event_ids = []
+    for data in load_dataset(path, skip, nevents, parts, cache=cache, engine=engine):
+        event_ids.append(data[0])
+    return event_ids
+
+class _HitIndex(object):
+    """Map hit ids to their row in the truth information.
+    """
+
+    def __init__(self, hit_id):
+        hit_id = numpy.asarray(hit_id, dtype='i8')
+        self.size = len(hit_id)
+        # use a dense lookup table unless the hit ids are very sparse
+        if len(hit_id) and (0 <= hit_id.min()) and (hit_id.max() < 4 * len(hit_id) + 1024):
+            self._table = numpy.full(hit_id.max() + 1, -1, dtype='i8')
+            self._table[hit_id] = numpy.arange(len(hit_id))
+            self._sorted = None
+        else:
+            self._table = None
+            self._order = numpy.argsort(hit_id, kind='mergesort')
+            self._sorted = hit_id[self._order]
+
+    def rows(self, hit_id):
+        """Return the truth row for each hit id or -1 for unknown ids."""
+        hit_id = numpy.asarray(hit_id, dtype='i8')
+        if self._table is not None:
+            rows = numpy.full(len(hit_id), -1, dtype='i8')
+            known = (0 <= hit_id) & (hit_id < len(self._table))
+            rows[known] = self._table[hit_id[known]]
+            return rows
+        pos = numpy.searchsorted(self._sorted, hit_id)
+        pos = numpy.minimum(pos, len(self._sorted) - 1)
+        if len(self._sorted) == 0:
+            return numpy.full(len(hit_id), -1, dtype='i8')
+        return numpy.where(self._sorted[pos] == hit_id, self._order[pos], -1)
+
+SUBMISSION_DTYPES = dict([
+    ('event_id', 'i4'),
+    ('hit_id', 'i4'),
+    ('track_id', 'i8'),
+])
+
+class _SubmissionCheck(object):
+    """Incremental coverage and uniqueness checks of submitted hits.
+
+    Submitted hits are marked in a bitmap over the truth hits so that each
+    chunk is checked without merging. Errors refer to the file line, or to
+    the row for in-memory submissions, of the offending hit.
+    """
+
+    def __init__(self, hit_id, where, unit='line'):
+        self.hit_id = numpy.asarray(hit_id)
+        self.index = _HitIndex(self.hit_id)
+        self.seen = numpy.zeros(self.index.size, dtype=bool)
+        self.where = where
+        self.unit = unit
+
+    def update(self, hit_id, line):
+        """Check and mark submitted hits; `line` is the line or row for each.
+        """
+        rows = self.index.rows(hit_id)
+        invalid = (rows < 0)
+        if numpy.any(invalid):
+            i = numpy.argmax(invalid)
+            raise Exception('Unknown hit_id {} {} on {} {}'.format(
+                            hit_id[i], self.where, self.unit, line[i]))
+        # hits submitted in a previous chunk or more than once in this one
+        invalid = self.seen[rows]
+        order = numpy.argsort(rows, kind='stable')
+        repeated = (rows[order][1:] == rows[order][:-1])
+        invalid[order[1:][repeated]] = True
+        if numpy.any(invalid):
+            i = numpy.argmax(invalid)
+            raise Exception('Duplicated hit_id {} {} on {} {}'.format(
+                            hit_id[i], self.where, self.unit, line[i]))
+        self.seen[rows] = True
+
+    def finish(self):
+        """Check that all truth hits have been submitted.
+        """
+        missing = numpy.flatnonzero(~self.seen)
+        if len(missing):
+            raise Exception('Missing {} hits {}, e.g. hit_id {}'.format(
+                            len(missing), self.where, self.hit_id[missing[0]]))
+
+def _truth_hit_ids(truth):
+    """Return the hit ids from truth information or an array of hit ids.
+    """
+    if isinstance(truth, pandas.DataFrame):
+        return truth['hit_id'].values
+    return numpy.asarray(truth)
+
+def _check_submission(submission, truth, where):
+    """Validate an in-memory submission for a single event.
+
+    Applies the same checks as `load_submission` for files. Errors refer to
+    the offending rows by their index label.
+    """
+    missing = [_ for _ in ['hit_id', 'track_id'] if _ not in submission]
+    if missing:
+        raise Exception('Missing submission columns {} {}'.format(missing, where))
+    row = submission.index.values
+    track_id = submission['track_id'].values
+    if numpy.any(track_id < 0):
+        i = numpy.argmax(track_id < 0)
+        raise Exception('Negative track_id {} {} on row {}'.format(
+                        track_id[i], where, row[i]))
+    check = _SubmissionCheck(_truth_hit_ids(truth), where, unit='row')
+    check.update(submission['hit_id'].values, row)
+    check.finish()
+
+def load_submission(path, truth=None, chunksize=FILTER_CHUNK_SIZE):
+    """Load and validate a submission file.
+
+    The file is parsed in chunks with compact types. If the truth is given,
+    each chunk is checked against the truth hits as it is parsed so that
+    invalid submissions fail early with the offending hit and line.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to a csv file, optionally gzipped, with hit_id and track_id
+        columns and an optional event_id column.
+    truth : pandas.DataFrame or Dict[int, pandas.DataFrame], optional
+        Truth information, or just the hit ids, for a single event or for
+        each event_id. Each truth hit must be submitted exactly once and no
+        other hits can be submitted.
+    chunksize : int, optional
+        Number of lines that are parsed at once.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The submission with hit_id and track_id columns and the event_id
+        column if it is present in the file.
+    """
+    header = pandas.read_csv(path, nrows=0).columns
+    columns = [_ for _ in ['event_id', 'hit_id', 'track_id'] if _ in header]
+    missing = [_ for _ in ['hit_id', 'track_id'] if _ not in header]
+    if missing:
+        raise Exception('Missing submission columns {} in \'{}\''.format(missing, path))
+    by_event = ('event_id' in columns)
+    if (truth is not None) and by_event and isinstance(truth, pandas.DataFrame):
+        raise Exception('Submission with event_id requires truth for each event')
+    if (truth is not None) and not by_event and isinstance(truth, dict):
+        raise Exception('Submission without event_id requires truth for a single event')
+
+    checks = {}
+    if truth is not None and not by_event:
+        checks[None] = _SubmissionCheck(_truth_hit_ids(truth), 'in \'{}\''.format(path))
+    def check(event_id):
+        c = checks.get(event_id)
+        if c is None:
+            if event_id not in truth:
+                raise Exception('Unknown event_id {} in \'{}\''.format(event_id, path))
+            c = checks[event_id] = _SubmissionCheck(
+                _truth_hit_ids(truth[event_id]),
+                'in event {} in \'{}\''.format(event_id, path))
+        return c
+
+    chunks = []
+    # first data line after the header
+    start = 2
+    reader = pandas.read_csv(path, header=0, index_col=False, usecols=columns,
+                             dtype=SUBMISSION_DTYPES, chunksize=chunksize)
+    try:
+        for chunk in reader:
+            line = numpy.arange(start, start + len(chunk))
+            start += len(chunk)
+            track_id = chunk['track_id'].values
+            if numpy.any(track_id < 0):
+                i = numpy.argmax(track_id < 0)
+                raise Exception('Negative track_id {} in \'{}\' on line {}'.format(
+                                track_id[i], path, line[i]))
+            if truth is not None:
+                hit_id = chunk['hit_id'].values
+                if not by_event:
+                    checks[None].update(hit_id, line)
+                else:
+                    event_id = chunk['event_id'].values
+                    for e in numpy.unique(event_id):
+                        selected = (event_id == e)
+                        check(int(e)).update(hit_id[selected], line[selected])
+            chunks.append(chunk)
+    except ValueError as e:
+        # e.g. missing values or non-integer entries
+        raise Exception('Invalid submission \'{}\': {}'.format(path, e))
+    if truth is not None:
+        if by_event:
+            missing = sorted(set(truth) - set(checks))
+            if missing:
+                raise Exception('Missing event_id {} in \'{}\''.format(missing[0], path))
+        for c in checks.values():
+            c.finish()
+    if not chunks:
+        return pandas.DataFrame(OrderedDict(
+            (_, numpy.empty(0, dtype=SUBMISSION_DTYPES[_])) for _ in columns))
+    return pandas.concat(chunks, ignore_index=True)
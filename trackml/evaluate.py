@@ -0,0 +1,217 @@
+"""TrackML command line evaluation
+
+Scores submissions against a dataset in a pool of worker processes and
+writes one JSON object per line, i.e. one line per event as soon as it is
+scored and a final summary line with the mean score and the throughput.
+
+    trackml-eval path/to/dataset path/to/submissions --workers 8
+
+The submissions are either a directory with one file per event, e.g.
+`event000001000-submission.csv.gz`, or a single file for all events with an
+additional event_id column.
+"""
+
+from __future__ import print_function
+
+import argparse
+from collections import OrderedDict
+import json
+import math
+import os
+import os.path as op
+import sys
+import time
+
+from .dataset import (_check_submission, _extract_event_id,
+                      _list_dataset_prefixes, _load_dataset_event,
+                      _map_processes, load_submission)
+from .score import score_event, score_event_detailed
+from .weights import DEFAULT_MODEL, PHASE2_MODEL
+
+WEIGHT_MODELS = {
+    'phase1': DEFAULT_MODEL,
+    'phase2': PHASE2_MODEL,
+}
+
+def _list_submission_files(directory):
+    """Map the event_id to the submission file for all files in a directory.
+    """
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        if ('event' not in name) or ('.csv' not in name):
+            continue
+        event_id = _extract_event_id(name)
+        if event_id in files:
+            raise Exception('More than one submission file for event_id {} in \'{}\''.format(
+                            event_id, directory))
+        files[event_id] = op.join(directory, name)
+    return files
+
+def _evaluate_event(path, prefix, submission, weights=None, detailed=False):
+    """Load, optionally reweight, and score a single event.
+
+    The submission is either a path to the event submission file or a
+    `pandas.DataFrame`; both are validated against the truth. Errors are
+    reported in the result instead of being raised.
+
+    Returns
+    -------
+    collections.OrderedDict
+        The per-event result record.
+    """
+    result = OrderedDict([('type', 'event'), ('event_id', _extract_event_id(prefix))])
+    try:
+        start = time.time()
+        if weights is None:
+            columns = {'truth': ['hit_id', 'particle_id', 'weight']}
+            _, truth = _load_dataset_event(path, prefix, ['truth'], columns=columns)
+            particles = None
+        else:
+            parts = ['particles', 'truth']
+            _, particles, truth = _load_dataset_event(path, prefix, parts)
+            truth = WEIGHT_MODELS[weights].weight_hits(truth, particles)
+        if submission is None:
+            raise Exception('Missing submission')
+        if hasattr(submission, 'columns'):
+            _check_submission(submission, truth, 'in event {}'.format(result['event_id']))
+        else:
+            submission = load_submission(submission, truth)
+        loaded = time.time()
+        if detailed:
+            report = score_event_detailed(truth, submission, particles)
+            metrics = report.metrics
+        else:
+            metrics = OrderedDict([('score', score_event(truth, submission))])
+        result['nhits'] = len(truth)
+        for name, value in metrics.items():
+            result[name] = value
+        result['load_time'] = loaded - start
+        result['score_time'] = time.time() - loaded
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+def evaluate_dataset(path, submission, weights=None, detailed=False, skip=None,
+                     nevents=None, workers=None, max_pending=None):
+    """Score a submission for all events in a dataset.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to a directory or a zip file containing event files.
+    submission : str or pandas.DataFrame
+        Directory with one submission file per event, a single submission
+        file, or a dataset submission with event_id, hit_id, and track_id
+        columns. Each event submission is validated against the truth.
+    weights : {'phase1', 'phase2'}, optional
+        Recompute the truth hit weights with the given metric instead of
+        using the stored weights.
+    detailed : bool, optional
+        Add the efficiency, fake, and duplicate metrics as computed by
+        `score_event_detailed` to each result.
+    skip : int, optional
+        Skip the first `skip` events.
+    nevents : int, optional
+        Only score a maximum of `nevents` events.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of cpus. With a
+        single worker all events are scored in the current process.
+    max_pending : int, optional
+        Maximum number of events in flight at the same time. Defaults to
+        twice the number of workers.
+
+    Returns
+    -------
+    iterator of collections.OrderedDict
+        The result for each event in completion order. It contains type,
+        event_id, nhits, score, load_time, and score_time entries, or an
+        error entry if the event could not be scored.
+    """
+    if (weights is not None) and (weights not in WEIGHT_MODELS):
+        raise Exception('Unknown weights \'{}\''.format(weights))
+    prefixes = _list_dataset_prefixes(path, skip, nevents)
+    if hasattr(submission, 'columns'):
+        if 'event_id' not in submission:
+            raise Exception('Dataset submission requires an event_id column')
+        groups = submission.groupby('event_id')
+        def event_submission(event_id):
+            if event_id not in groups.groups:
+                return None
+            return groups.get_group(event_id)
+    elif op.isdir(submission):
+        files = _list_submission_files(submission)
+        event_submission = files.get
+    else:
+        # a single file is validated per event once it is split into events
+        return evaluate_dataset(path, load_submission(submission), weights, detailed,
+                                skip, nevents, workers, max_pending)
+    arguments = ((path, _, event_submission(_extract_event_id(_)), weights, detailed)
+                 for _ in prefixes)
+    return _map_processes(_evaluate_event, arguments, workers, max_pending)
+
+def _summary(results, walltime):
+    """Compute the summary record from all per-event results.
+    """
+    scored = [_ for _ in results if 'error' not in _]
+    nhits = sum(_['nhits'] for _ in scored)
+    return OrderedDict([
+        ('type', 'summary'),
+        ('events', len(scored)),
+        ('errors', len(results) - len(scored)),
+        ('score', sum(_['score'] for _ in scored) / len(scored) if scored else None),
+        ('walltime', walltime),
+        ('events_per_second', len(scored) / walltime if walltime else None),
+        ('hits_per_second', nhits / walltime if walltime else None),
+    ])
+
+def _to_json(record):
+    """Convert a result record into strict JSON, i.e. w/o NaN.
+    """
+    values = OrderedDict()
+    for name, value in record.items():
+        if hasattr(value, 'item'):
+            value = value.item()
+        if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+            value = None
+        values[name] = value
+    return json.dumps(values)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='trackml-eval',
+        description='Score TrackML submissions and write JSON lines results')
+    parser.add_argument('dataset', help='dataset directory or zip file')
+    parser.add_argument('submission',
+                        help='directory with per-event submission files or a single submission file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes; defaults to the number of cpus')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='maximum number of events in flight')
+    parser.add_argument('--weights', choices=sorted(WEIGHT_MODELS),
+                        help='recompute the hit weights for the given metric')
+    parser.add_argument('--detailed', action='store_true',
+                        help='add efficiency, fake, and duplicate metrics')
+    parser.add_argument('--skip', type=int, default=None, help='skip the first events')
+    parser.add_argument('--events', type=int, default=None, help='number of events')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        start = time.time()
+        results = []
+        for result in evaluate_dataset(args.dataset, args.submission, args.weights,
+                                       args.detailed, args.skip, args.events,
+                                       args.workers, args.max_pending):
+            results.append(OrderedDict((k, result.get(k)) for k in
+                                       ['score', 'nhits', 'error'] if k in result))
+            print(_to_json(result), file=output)
+            output.flush()
+        print(_to_json(_summary(results, time.time() - start)), file=output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if any('error' in _ for _ in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
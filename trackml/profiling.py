@@ -0,0 +1,155 @@
+"""TrackML per-stage profiling
+
+Selected stages in the dataset, weights, and score modules are instrumented
+to record their wall-clock time, the number of processed rows, and the number
+of bytes read. The instrumentation is disabled by default and only costs a
+single check per stage in that case. It is enabled either by recording into
+aggregated counters
+
+    with record() as counters:
+        ...
+    print(counters.summary())
+
+or by registering a callback that receives every single measurement.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+# active counters and callbacks; the instrumentation is disabled if empty
+_sinks = []
+_sinks_lock = threading.Lock()
+
+class Counters(object):
+    """Aggregated per-stage counters.
+
+    Attributes
+    ----------
+    counters : collections.OrderedDict
+        Maps each stage name to a dictionary with calls, time, rows, and
+        bytes entries. Time is in seconds.
+    """
+
+    def __init__(self):
+        self.counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, name, elapsed, rows, nbytes):
+        with self._lock:
+            c = self.counters.get(name)
+            if c is None:
+                c = self.counters[name] = OrderedDict([
+                    ('calls', 0), ('time', 0.), ('rows', 0), ('bytes', 0)])
+            c['calls'] += 1
+            c['time'] += elapsed
+            c['rows'] += rows
+            c['bytes'] += nbytes
+
+    def __getitem__(self, name):
+        return self.counters[name]
+
+    def __contains__(self, name):
+        return name in self.counters
+
+    def reset(self):
+        """Remove all recorded measurements."""
+        with self._lock:
+            self.counters.clear()
+
+    def summary(self):
+        """Return the aggregated counters as a table.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Contains stage, calls, time, rows, and bytes columns.
+        """
+        import pandas
+        with self._lock:
+            records = [(name,) + tuple(c.values()) for name, c in self.counters.items()]
+        return pandas.DataFrame.from_records(
+            records, columns=['stage', 'calls', 'time', 'rows', 'bytes'])
+
+def add_callback(callback):
+    """Register a callback that is called for each measured stage.
+
+    The callback is called with the stage name, the elapsed time in seconds,
+    the number of rows, and the number of bytes. It can be called from
+    multiple threads.
+    """
+    with _sinks_lock:
+        _sinks.append(callback)
+
+def remove_callback(callback):
+    """Remove a previously registered callback."""
+    with _sinks_lock:
+        _sinks.remove(callback)
+
+class record(object):
+    """Record all measured stages into counters while active.
+
+    Parameters
+    ----------
+    counters : Counters, optional
+        Add the measurements to existing counters.
+    """
+
+    def __init__(self, counters=None):
+        self.counters = counters if counters is not None else Counters()
+
+    def __enter__(self):
+        add_callback(self.counters)
+        return self.counters
+
+    def __exit__(self, *args):
+        remove_callback(self.counters)
+
+def enabled():
+    """Check if the instrumentation is currently enabled."""
+    return bool(_sinks)
+
+class _Stage(object):
+    """Measure a single stage and report it to all sinks."""
+
+    __slots__ = ('name', 'rows', 'bytes', '_start')
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self._start
+        for sink in list(_sinks):
+            sink(self.name, elapsed, self.rows, self.bytes)
+
+class _NullStage(object):
+    """Stage that measures nothing while the instrumentation is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __setattr__(self, name, value):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def stage(name):
+    """Measure the enclosed code as the stage with the given name.
+
+    The returned object is used as a context manager. The number of processed
+    rows and read bytes can be set via its `rows` and `bytes` attributes.
+    """
+    if not _sinks:
+        return _NULL_STAGE
+    return _Stage(name)
@@ -2,10 +2,14 @@
 
 __authors__ = ['Moritz Kiehn']
 
-import pandas
 import numpy
 import numpy.random
 
+from ._lazy import lazy_import
+from .dataset import _list_dataset_prefixes, _load_dataset_event, _map_processes
+
+pandas = lazy_import('pandas')
+
 def _make_submission(hit_ids, track_ids, renumber=True):
     """Create a submission DataFrame with hit_id and track_id columns.
 
@@ -73,3 +77,182 @@ def shuffle_hits(truth, probability):
     # replace masked particle ids with random valid ids
     numpy.place(out, shuffled_mask, wrongparticles)
     return _make_submission(truth['hit_id'], out)
+
+def event_generator(seed, event_id, stream=0):
+    """Create an independent random generator for a single event.
+
+    The generator only depends on the root seed, the event id, and the
+    stream number, but not on the order in which events are processed.
+
+    Parameters
+    ----------
+    seed : int
+        Root seed.
+    event_id : int
+        The event identifier.
+    stream : int, optional
+        Additional stream number, e.g. to separate different probabilities.
+
+    Returns
+    -------
+    numpy.random.Generator
+    """
+    sequence = numpy.random.SeedSequence(seed, spawn_key=(int(event_id), int(stream)))
+    return numpy.random.default_rng(sequence)
+
+class TruthRandomizer(object):
+    """Randomized submissions from truth with a precomputed particle mapping.
+
+    The unique particle ids and the dense particle code for each hit are
+    computed once and reused for all generated submissions. All randomness
+    comes from an explicit `numpy.random.Generator`.
+
+    Parameters
+    ----------
+    truth : pandas.DataFrame
+        Truth mapping must contain hit_id and particle_id columns.
+    """
+
+    def __init__(self, truth):
+        self.hit_ids = truth['hit_id'].values
+        self.unique_particle_ids, particle_code = numpy.unique(
+            truth['particle_id'].values, return_inverse=True)
+        self.particle_code = particle_code.ravel()
+
+    def renumber(self, codes, ncodes, rng):
+        """Random small track ids for dense track codes.
+
+        Returns
+        -------
+        numpy.ndarray
+            Track id for each hit in truth order as in the generated
+            submissions.
+        """
+        # renumber only the codes that are in use to get contiguous ids
+        used = (0 < numpy.bincount(codes, minlength=ncodes))
+        rank = numpy.cumsum(used) - 1
+        numbers = rng.permutation(numpy.arange(1, numpy.count_nonzero(used) + 1, dtype='i8'))
+        return numbers[rank[codes]]
+
+    def _make_submission(self, codes, ncodes, rng):
+        """Create a submission with random small track ids for dense codes.
+        """
+        track_ids = self.renumber(codes, ncodes, rng)
+        return pandas.DataFrame({'hit_id': self.hit_ids, 'track_id': track_ids})
+
+    def drop_codes(self, probability, rng):
+        """Dense track codes for each hit after dropping hits from tracks.
+
+        Returns
+        -------
+        codes : numpy.ndarray
+            Track code for each hit in truth order.
+        ncodes : int
+            Upper bound for the track codes.
+        """
+        codes = numpy.array(self.particle_code, copy=True)
+        dropped_mask = (rng.random(len(codes)) < probability)
+        dropped_count = numpy.count_nonzero(dropped_mask)
+        ncodes = len(self.unique_particle_ids)
+        codes[dropped_mask] = numpy.arange(ncodes, ncodes + dropped_count)
+        return codes, ncodes + dropped_count
+
+    def shuffle_codes(self, probability, rng):
+        """Dense track codes for each hit after shuffling hits between tracks.
+
+        Returns
+        -------
+        codes : numpy.ndarray
+            Track code for each hit in truth order.
+        ncodes : int
+            Upper bound for the track codes.
+        """
+        codes = numpy.array(self.particle_code, copy=True)
+        shuffled_mask = (rng.random(len(codes)) < probability)
+        shuffled_count = numpy.count_nonzero(shuffled_mask)
+        ncodes = len(self.unique_particle_ids)
+        codes[shuffled_mask] = rng.integers(0, ncodes, size=shuffled_count)
+        return codes, ncodes
+
+    def drop_hits(self, probability, rng):
+        """Drop hits from each track with a certain probability.
+
+        Each dropped hit is assigned to a new track that only contains this
+        hit. See `drop_hits`.
+        """
+        codes, ncodes = self.drop_codes(probability, rng)
+        return self._make_submission(codes, ncodes, rng)
+
+    def shuffle_hits(self, probability, rng):
+        """Randomly assign hits to a wrong particle with a certain probability.
+
+        See `shuffle_hits`.
+        """
+        codes, ncodes = self.shuffle_codes(probability, rng)
+        return self._make_submission(codes, ncodes, rng)
+
+RANDOMIZE_METHODS = ['drop', 'shuffle']
+
+def _randomize_truth(event_id, truth, probabilities, method, seed):
+    """Generate one randomized submission per probability for an event.
+    """
+    randomizer = TruthRandomizer(truth)
+    generate = getattr(randomizer, '{}_hits'.format(method))
+    return [generate(p, event_generator(seed, event_id, i))
+            for i, p in enumerate(probabilities)]
+
+def _randomize_dataset_event(path, prefix, probabilities, method, seed):
+    """Load the truth for one dataset event and randomize it.
+    """
+    columns = {'truth': ['hit_id', 'particle_id']}
+    event_id, truth = _load_dataset_event(path, prefix, ['truth'], columns=columns)
+    return event_id, _randomize_truth(event_id, truth, probabilities, method, seed)
+
+def randomize_dataset(path, probabilities, method='shuffle', seed=0, skip=None,
+                      nevents=None, workers=None, max_pending=None):
+    """Provide an iterator over randomized submissions for (all) dataset events.
+
+    Each event uses independent random generators derived from the root seed
+    and the event id. The output is deterministic and does not depend on the
+    number of workers or on the selected events.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to a directory or a zip file containing event files.
+    probabilities : List[float]
+        Generate one submission for each probability.
+    method : {'drop', 'shuffle'}, optional
+        Randomize the truth with `drop_hits` or with `shuffle_hits`.
+    seed : int, optional
+        Root seed.
+    skip : int, optional
+        Skip the first `skip` events.
+    nevents : int, optional
+        Only randomize a maximum of `nevents` events.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of cpus. With a
+        single worker all events are processed in the current process.
+    max_pending : int, optional
+        Maximum number of events in flight at the same time. Defaults to
+        twice the number of workers.
+
+    Yields
+    ------
+    event_id : int
+        The event identifier.
+    submissions : List[pandas.DataFrame]
+        Submission with hit_id and track_id columns for each probability.
+    """
+    if method not in RANDOMIZE_METHODS:
+        raise Exception('Unknown randomize method \'{}\''.format(method))
+    probabilities = list(probabilities)
+    prefixes = _list_dataset_prefixes(path, skip, nevents)
+    arguments = ((path, _, probabilities, method, seed) for _ in prefixes)
+    results = _map_processes(_randomize_dataset_event, arguments, workers,
+                             max_pending, ordered=True)
+    try:
+        for result in results:
+            yield result
+    finally:
+        results.close()
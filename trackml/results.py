@@ -0,0 +1,227 @@
+"""TrackML persistent cache for per-event results
+
+Per-hit weights and per-event track tables are stored on local disk keyed by
+a hash of the input contents and the computation parameters. Repeated
+evaluations of a dataset then only recompute the events whose inputs
+changed. The cache is a flat directory with one file per result
+
+    <kind>-<key>.npz        result table, e.g. kind is weights or tracks
+
+and is bounded in size by removing the least recently used results.
+"""
+
+import hashlib
+import os
+import os.path as op
+
+import numpy
+
+from ._lazy import lazy_import
+from .dataset import _read_cache, _write_cache
+from .score import _analyze_tracks, _score_tracks
+from .weights import DEFAULT_MODEL
+
+pandas = lazy_import('pandas')
+
+# changes whenever the stored results change for identical inputs
+RESULTS_VERSION = 1
+
+def _update_hash(h, data, columns=None):
+    """Add the selected columns of a DataFrame to a hash.
+
+    Column names, types, and the raw column data all contribute.
+    """
+    if columns is None:
+        columns = list(data.columns)
+    h.update('{!r}:{}'.format(columns, len(data)).encode('utf-8'))
+    for column in columns:
+        values = data[column].values
+        if values.dtype.kind == 'O':
+            values = pandas.util.hash_array(values)
+        h.update(values.dtype.str.encode('utf-8'))
+        h.update(numpy.ascontiguousarray(values).view('u1'))
+
+def _model_parameters(model):
+    return (model.proposal, model.min_hits, model.max_hits, model.pt_inf,
+            model.pt_sup, model.w_min, model.w_max, model.primary_only)
+
+class ResultCache(object):
+    """Size-bounded on-disk cache for per-event weights and scores.
+
+    Results are keyed by the content of the inputs and not by event ids or
+    file names, i.e. changed inputs are recomputed automatically and
+    identical inputs are reused even across datasets. The cache directory
+    can be shared between processes.
+
+    Parameters
+    ----------
+    directory : str or pathlib.Path
+        Cache directory; created if necessary.
+    max_bytes : int, optional
+        Approximate maximum size of all cached results. The least recently
+        used results are removed once it is exceeded.
+
+    Examples
+    --------
+    >>> cache = ResultCache('path/to/results')
+    >>> weighted = cache.weight_hits(truth, particles)
+    >>> score = cache.score_event(weighted, submission)
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = str(directory)
+        self.max_bytes = int(max_bytes)
+        # estimated total size; only rescanned when the limit is reached
+        self._nbytes = None
+
+    def __getstate__(self):
+        # each process keeps its own size estimate
+        return (self.directory, self.max_bytes)
+
+    def __setstate__(self, state):
+        self.directory, self.max_bytes = state
+        self._nbytes = None
+
+    def _path(self, kind, key):
+        return op.join(self.directory, '{}-{}.npz'.format(kind, key))
+
+    def _files(self):
+        """Return (access time, size, path) for all cached results."""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        files = []
+        for name in names:
+            if not name.endswith('.npz'):
+                continue
+            path = op.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # removed concurrently
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def nbytes(self):
+        """Return the total size of all cached results in bytes."""
+        return sum(_[1] for _ in self._files())
+
+    def clear(self):
+        """Remove all cached results."""
+        for _, _, path in self._files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._nbytes = 0
+
+    def _evict(self):
+        """Remove the least recently used results above the size limit."""
+        files = sorted(self._files())
+        nbytes = sum(_[1] for _ in files)
+        for _, size, path in files:
+            if nbytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            nbytes -= size
+        self._nbytes = nbytes
+
+    def get(self, kind, key):
+        """Return a cached result table or None if it is not available.
+        """
+        path = self._path(kind, key)
+        data = _read_cache(path, key)
+        if data is not None:
+            # modification time is the last access time for the eviction
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return data
+
+    def put(self, kind, key, data):
+        """Store a result table.
+        """
+        path = self._path(kind, key)
+        _write_cache(path, key, data)
+        if self._nbytes is None:
+            self._evict()
+            return
+        try:
+            self._nbytes += os.stat(path).st_size
+        except OSError:
+            pass
+        if self.max_bytes < self._nbytes:
+            self._evict()
+
+    def key(self, frames, parameters=()):
+        """Compute the content hash for the given inputs.
+
+        Parameters
+        ----------
+        frames : List[Tuple[pandas.DataFrame, List[str]]]
+            Input DataFrames and the columns that are used; None for all
+            columns.
+        parameters : tuple, optional
+            Additional parameters with a stable `repr`.
+        """
+        h = hashlib.blake2b()
+        h.update('{}:{!r}'.format(RESULTS_VERSION, parameters).encode('utf-8'))
+        for data, columns in frames:
+            _update_hash(h, data, columns)
+        return h.hexdigest()
+
+    def weight_hits(self, truth, particles, model=DEFAULT_MODEL):
+        """Compute or reuse per-hit weights; see `WeightModel.weight_hits`.
+
+        Parameters
+        ----------
+        truth : pandas.DataFrame
+            Truth information as for `WeightModel.weight_hits`.
+        particles : pandas.DataFrame
+            Particle information as for `WeightModel.weight_hits`.
+        model : WeightModel, optional
+            Weight model; defaults to the phase 1 metric.
+        """
+        key = self.key([(truth, None), (particles, None)], _model_parameters(model))
+        data = self.get('weights', key)
+        if data is None:
+            data = model.weight_hits(truth, particles)
+            self.put('weights', key, data)
+        return data
+
+    def tracks(self, truth, submission):
+        """Compute or reuse the track table of a submission.
+
+        Parameters
+        ----------
+        truth : pandas.DataFrame
+            Truth information. Must have hit_id, particle_id, and weight
+            columns.
+        submission : pandas.DataFrame
+            Proposed hit/track association. Must have hit_id and track_id
+            columns.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Contains track_id, nhits, major_particle_id, major_particle_nhits,
+            major_nhits, and major_weight columns.
+        """
+        key = self.key([(truth, ['hit_id', 'particle_id', 'weight']),
+                        (submission, ['hit_id', 'track_id'])])
+        data = self.get('tracks', key)
+        if data is None:
+            data = _analyze_tracks(truth, submission)
+            self.put('tracks', key, data)
+        return data
+
+    def score_event(self, truth, submission):
+        """Compute or reuse the event score; see `score_event`.
+        """
+        return _score_tracks(self.tracks(truth, submission))
@@ -3,8 +3,129 @@
 __authors__ = ['Sabrina Amrouche', 'David Rousseau', 'Moritz Kiehn',
                'Ilija Vukotic']
 
+from collections import OrderedDict, namedtuple
+import time
+
 import numpy
-import pandas
+
+from . import profiling
+from ._lazy import lazy_import
+from .dataset import (_HitIndex, _extract_event_id, _list_dataset_prefixes,
+                      _load_dataset_event, _map_processes)
+from .randomize import RANDOMIZE_METHODS, TruthRandomizer, event_generator
+from .utils import momentum_quantities
+
+pandas = lazy_import('pandas')
+
+def _analyze_hits(track_id, particle_code, weight, total_weight,
+                  unique_particle_ids, unique_particle_nhits, return_codes=False):
+    """Compute the track table from per-hit arrays in truth order.
+
+    Parameters
+    ----------
+    track_id : numpy.ndarray
+        Assigned track for each truth hit; NaN for unassigned hits.
+    particle_code : numpy.ndarray
+        Generating particle for each truth hit as an index into the sorted
+        unique particle ids.
+    weight : numpy.ndarray
+        Weight for each truth hit.
+    total_weight : float
+        Sum of all truth hit weights.
+    unique_particle_ids, unique_particle_nhits : numpy.ndarray
+        Sorted unique particle ids and their true number of hits.
+    return_codes : bool, optional
+        Also return the code of the majority particle for each track.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Same as `_analyze_tracks`.
+    """
+    # stable ordering by track_id and particle_id; unassigned hits are last.
+    # particle codes have the same order as the particle ids.
+    order = numpy.lexsort((particle_code, track_id))
+    track_id = track_id[order]
+    particle_code = particle_code[order]
+    weight = weight[order]
+
+    # ASSUMPTIONs: 0 <= track_id, 0 <= particle_id
+
+    # find the boundaries of each track and of each (track, particle) group.
+    # unassigned hits have a NaN track_id and each of them forms its own
+    # track, since NaN never compares equal.
+    is_track_start = numpy.ones(len(track_id), dtype=bool)
+    is_track_start[1:] = (track_id[1:] != track_id[:-1])
+    is_group_start = is_track_start.copy()
+    is_group_start[1:] |= (particle_code[1:] != particle_code[:-1])
+    track_start = numpy.flatnonzero(is_track_start)
+    group_start = numpy.flatnonzero(is_group_start)
+    group_index = numpy.cumsum(is_group_start) - 1
+    # per-track and per-group hit counts and summed weights. bincount sums
+    # sequentially in float64 i.e. in the same order as the sorted hits.
+    track_nhits = numpy.diff(numpy.append(track_start, len(track_id)))
+    group_nhits = numpy.diff(numpy.append(group_start, len(track_id)))
+    group_weight = numpy.bincount(group_index, weights=weight,
+                                  minlength=len(group_start))
+    group_track = numpy.cumsum(is_track_start)[group_start] - 1
+    # majority particle is the first group, i.e. the one with the smallest
+    # particle_id, that has the maximum number of hits within the track
+    track_first_group = numpy.flatnonzero(is_track_start[group_start])
+    track_max_nhits = numpy.maximum.reduceat(group_nhits, track_first_group)
+    candidates = numpy.flatnonzero(group_nhits == track_max_nhits[group_track])
+    is_first_candidate = numpy.ones(len(candidates), dtype=bool)
+    is_first_candidate[1:] = (group_track[candidates[1:]] != group_track[candidates[:-1]])
+    major_group = candidates[is_first_candidate]
+    major_particle_code = particle_code[group_start[major_group]]
+    major_particle_id = unique_particle_ids[major_particle_code]
+    major_weight = group_weight[major_group]
+
+    # true number of hits for each major particle
+    major_particle_nhits = unique_particle_nhits[major_particle_code]
+    # divide with the same precision as a python float divided by the total
+    # weight scalar, e.g. float32 for float32 weights with numpy >= 2
+    major_weight = major_weight.astype(numpy.result_type(0.0, total_weight))
+    major_weight /= total_weight
+
+    # integer and float columns in the same types as for a list of records
+    track_id = track_id[track_start]
+    track_id = track_id.astype('i8' if track_id.dtype.kind in 'iu' else 'f8')
+    tracks = pandas.DataFrame.from_dict(OrderedDict([
+        ('track_id', track_id),
+        ('nhits', track_nhits.astype('i8')),
+        ('major_particle_id', major_particle_id.astype('i8')),
+        ('major_particle_nhits', major_particle_nhits.astype('i8')),
+        ('major_nhits', group_nhits[major_group].astype('i8')),
+        ('major_weight', major_weight),
+    ]))
+    if return_codes:
+        return tracks, major_particle_code
+    return tracks
+
+def _encode_particles(particle_id, particle_code=None):
+    """Compute dense particle codes and the true number of hits per particle.
+
+    Existing dense codes, e.g. from the compact load mode, are used directly
+    and avoid sorting the particle ids.
+
+    Returns
+    -------
+    unique_particle_ids : numpy.ndarray
+        Sorted particle id for each code.
+    particle_code : numpy.ndarray
+        Code for each hit.
+    unique_particle_nhits : numpy.ndarray
+        True number of hits for each code.
+    """
+    if particle_code is None:
+        unique_particle_ids, particle_code, unique_particle_nhits = numpy.unique(
+            particle_id, return_inverse=True, return_counts=True)
+        return unique_particle_ids, particle_code.ravel(), unique_particle_nhits
+    unique_particle_nhits = numpy.bincount(particle_code)
+    # codes w/o hits are never referenced and keep a zero particle id
+    unique_particle_ids = numpy.zeros(len(unique_particle_nhits), dtype=particle_id.dtype)
+    unique_particle_ids[particle_code] = particle_id
+    return unique_particle_ids, particle_code, unique_particle_nhits
 
 def _analyze_tracks(truth, submission):
     """Compute the majority particle, hit counts, and weight for each track.
@@ -13,6 +134,8 @@ def _analyze_tracks(truth, submission):
     ----------
     truth : pandas.DataFrame
         Truth information. Must have hit_id, particle_id, and weight columns.
+        An optional particle_code column with dense particle codes is used
+        instead of the particle ids.
     submission : pandas.DataFrame
         Proposed hit/track association. Must have hit_id and track_id columns.
 
@@ -22,102 +145,738 @@ def _analyze_tracks(truth, submission):
         Contains track_id, nhits, major_particle_id, major_particle_nhits,
         major_nhits, and major_weight columns.
     """
-    # true number of hits for each particle_id
-    particles_nhits = truth['particle_id'].value_counts(sort=False)
     total_weight = truth['weight'].sum()
+    columns = ['hit_id', 'particle_id', 'weight']
+    if 'particle_code' in truth:
+        columns.append('particle_code')
     # combined event with minimal reconstructed and truth information
-    event = pandas.merge(truth[['hit_id', 'particle_id', 'weight']],
-                         submission[['hit_id', 'track_id']],
-                         on=['hit_id'], how='left', validate='one_to_one')
-    event.drop('hit_id', axis=1, inplace=True)
-    event.sort_values(by=['track_id', 'particle_id'], inplace=True)
-
-    # ASSUMPTIONs: 0 <= track_id, 0 <= particle_id
+    with profiling.stage('score.merge') as stage:
+        event = pandas.merge(truth[columns],
+                             submission[['hit_id', 'track_id']],
+                             on=['hit_id'], how='left', validate='one_to_one')
+        stage.rows = len(event)
+    # dense particle codes and the true number of hits for each particle
+    unique_particle_ids, particle_code, unique_particle_nhits = _encode_particles(
+        event['particle_id'].values,
+        event['particle_code'].values if 'particle_code' in event else None)
+    with profiling.stage('score.analyze') as stage:
+        stage.rows = len(event)
+        return _analyze_hits(event['track_id'].values, particle_code,
+                             event['weight'].values, total_weight,
+                             unique_particle_ids, unique_particle_nhits)
 
-    tracks = []
-    # running sum for the reconstructed track we are currently in
-    rec_track_id = -1
-    rec_nhits = 0
-    # running sum for the particle we are currently in (in this track_id)
-    cur_particle_id = -1
-    cur_nhits = 0
-    cur_weight = 0
-    # majority particle with most hits up to now (in this track_id)
-    maj_particle_id = -1
-    maj_nhits = 0
-    maj_weight = 0
-
-    for hit in event.itertuples(index=False):
-        # we reached the next track so we need to finish the current one
-        if (rec_track_id != -1) and (rec_track_id != hit.track_id):
-            # could be that the current particle is the majority one
-            if maj_nhits < cur_nhits:
-                maj_particle_id = cur_particle_id
-                maj_nhits = cur_nhits
-                maj_weight = cur_weight
-            # store values for this track
-            tracks.append((rec_track_id, rec_nhits, maj_particle_id,
-                particles_nhits[maj_particle_id], maj_nhits,
-                maj_weight / total_weight))
-
-        # setup running values for next track (or first)
-        if rec_track_id != hit.track_id:
-            rec_track_id = hit.track_id
-            rec_nhits = 1
-            cur_particle_id = hit.particle_id
-            cur_nhits = 1
-            cur_weight = hit.weight
-            maj_particle_id = -1
-            maj_nhits = 0
-            maj_weights = 0
-            continue
-
-        # hit is part of the current reconstructed track
-        rec_nhits += 1
-
-        # reached new particle within the same reconstructed track
-        if cur_particle_id != hit.particle_id:
-            # check if last particle has more hits than the majority one
-            # if yes, set the last particle as the new majority particle
-            if maj_nhits < cur_nhits:
-                maj_particle_id = cur_particle_id
-                maj_nhits = cur_nhits
-                maj_weight = cur_weight
-            # reset runnig values for current particle
-            cur_particle_id = hit.particle_id
-            cur_nhits = 1
-            cur_weight = hit.weight
-        # hit belongs to the same particle within the same reconstructed track
-        else:
-            cur_nhits += 1
-            cur_weight += hit.weight
-
-    # last track is not handled inside the loop
-    if maj_nhits < cur_nhits:
-        maj_particle_id = cur_particle_id
-        maj_nhits = cur_nhits
-        maj_weight = cur_weight
-    # store values for the last track
-    tracks.append((rec_track_id, rec_nhits, maj_particle_id,
-        particles_nhits[maj_particle_id], maj_nhits, maj_weight / total_weight))
-
-    cols = ['track_id', 'nhits',
-            'major_particle_id', 'major_particle_nhits',
-            'major_nhits', 'major_weight']
-    return pandas.DataFrame.from_records(tracks, columns=cols)
+def _score_tracks(tracks):
+    """Compute the event score from the track table.
+    """
+    purity_rec = numpy.true_divide(tracks['major_nhits'], tracks['nhits'])
+    purity_maj = numpy.true_divide(tracks['major_nhits'], tracks['major_particle_nhits'])
+    good_track = (0.5 < purity_rec) & (0.5 < purity_maj)
+    return tracks['major_weight'][good_track].sum()
 
 def score_event(truth, submission):
     """Compute the TrackML event score for a single event.
 
+    Parameters
+    ----------
+    truth : pandas.DataFrame or PreparedTruth
+        Truth information. Must have hit_id, particle_id, and weight columns.
+    submission : pandas.DataFrame
+        Proposed hit/track association. Must have hit_id and track_id columns.
+    """
+    if isinstance(truth, PreparedTruth):
+        return truth.score(submission)
+    return _score_tracks(_analyze_tracks(truth, submission))
+
+def score_many(truth, submissions):
+    """Compute the TrackML event score for multiple submissions of one event.
+
+    The truth information is prepared only once and reused for all
+    submissions.
+
+    Parameters
+    ----------
+    truth : pandas.DataFrame or PreparedTruth
+        Truth information. Must have hit_id, particle_id, and weight columns.
+    submissions : iterable of pandas.DataFrame
+        Proposed hit/track associations. Must have hit_id and track_id
+        columns.
+
+    Returns
+    -------
+    list
+        The event score for each submission.
+    """
+    if not isinstance(truth, PreparedTruth):
+        truth = PreparedTruth(truth)
+    return [truth.score(_) for _ in submissions]
+
+class PreparedTruth(object):
+    """Truth information prepared for scoring many submissions.
+
+    All truth-side computations are done once. Scoring a submission is then
+    a direct array lookup of its hits without a merge. Scores are identical
+    to `score_event` with the original truth.
+
     Parameters
     ----------
     truth : pandas.DataFrame
         Truth information. Must have hit_id, particle_id, and weight columns.
+        An optional particle_code column with dense particle codes is used
+        instead of the particle ids.
+
+    Attributes
+    ----------
+    particle_code : numpy.ndarray
+        Dense code for the particle of each hit, i.e. the index into
+        `unique_particle_ids`.
+    unique_particle_ids : numpy.ndarray
+        Sorted particle id for each code.
+    unique_particle_nhits : numpy.ndarray
+        True number of hits for each unique particle.
+    weight : numpy.ndarray
+        Weight of each hit.
+    total_weight : float
+        Sum of all hit weights.
+    """
+
+    def __init__(self, truth):
+        self.index = _HitIndex(truth['hit_id'].values)
+        codes = truth['particle_code'].values if 'particle_code' in truth else None
+        self.unique_particle_ids, self.particle_code, self.unique_particle_nhits = \
+            _encode_particles(truth['particle_id'].values, codes)
+        self.weight = truth['weight'].values
+        self.total_weight = truth['weight'].sum()
+
+    def __len__(self):
+        return self.index.size
+
+    def rows(self, hit_ids):
+        """Return the truth row for each hit id or -1 for unknown ids."""
+        return self.index.rows(hit_ids)
+
+    def tracks(self, track_id, assigned=None):
+        """Compute the track table from the track of each truth hit.
+
+        Parameters
+        ----------
+        track_id : numpy.ndarray
+            Assigned track for each truth hit in truth order.
+        assigned : numpy.ndarray, optional
+            Boolean mask of hits with an assigned track. All hits are
+            assigned by default.
+        """
+        if (assigned is not None) and not numpy.all(assigned):
+            # same representation as the merge with missing hits
+            track_id = track_id.astype('f8')
+            track_id[~assigned] = numpy.nan
+        with profiling.stage('score.analyze') as stage:
+            stage.rows = len(track_id)
+            return _analyze_hits(track_id, self.particle_code, self.weight,
+                                 self.total_weight, self.unique_particle_ids,
+                                 self.unique_particle_nhits)
+
+    def assign(self, hit_ids, track_ids, track_id=None, assigned=None):
+        """Insert hit/track associations into per-hit truth order arrays.
+
+        Hits that are not part of the truth information are ignored. Each
+        hit id, including the ignored ones, can only be submitted once as
+        with the one-to-one merge in `score_event`. Track ids keep their
+        type, e.g. float ids are not truncated and NaN ids are single-hit
+        tracks as with the merge.
+
+        Returns
+        -------
+        track_id, assigned : numpy.ndarray
+            Track for each truth hit and the mask of assigned hits. The given
+            `track_id` array is promoted to a common type with `track_ids` if
+            necessary.
+        """
+        track_id, assigned, _ = self._assign(hit_ids, track_ids, track_id, assigned)
+        return track_id, assigned
+
+    def _assign(self, hit_ids, track_ids, track_id=None, assigned=None,
+                unknown=None):
+        """Same as `assign` and also track the ignored hit ids.
+
+        `unknown` are the sorted hit ids outside the truth from previous
+        calls. The updated ids are returned as the third value.
+        """
+        hit_ids = numpy.asarray(hit_ids)
+        track_ids = numpy.asarray(track_ids)
+        if hit_ids.shape != track_ids.shape:
+            raise Exception('hit_ids and track_ids must have the same length')
+        if track_id is None:
+            track_id = numpy.zeros(len(self), dtype=track_ids.dtype)
+            assigned = numpy.zeros(len(self), dtype=bool)
+        elif numpy.result_type(track_id, track_ids) != track_id.dtype:
+            track_id = track_id.astype(numpy.result_type(track_id, track_ids))
+        with profiling.stage('score.assign') as stage:
+            rows = self.index.rows(hit_ids)
+            known = (0 <= rows)
+            rows = rows[known]
+            counts = numpy.bincount(rows, minlength=len(self)) + assigned
+            if numpy.any(1 < counts):
+                duplicated = numpy.flatnonzero(1 < counts)
+                raise Exception('Hits assigned more than once, e.g. hit_id {}'.format(
+                                hit_ids[known][numpy.isin(rows, duplicated)][0]))
+            # ignored hits must still be unique as in the merge
+            ignored = hit_ids[~known]
+            if unknown is not None:
+                ignored = numpy.concatenate([unknown, ignored])
+            ignored = numpy.sort(ignored)
+            repeated = (ignored[1:] == ignored[:-1])
+            if numpy.any(repeated):
+                raise Exception('Hits assigned more than once, e.g. hit_id {}'.format(
+                                ignored[1:][repeated][0]))
+            track_id[rows] = track_ids[known]
+            assigned[rows] = True
+            stage.rows = len(hit_ids)
+        return track_id, assigned, ignored
+
+    def score(self, submission):
+        """Compute the event score for a submission.
+
+        Parameters
+        ----------
+        submission : pandas.DataFrame
+            Proposed hit/track association. Must have hit_id and track_id
+            columns.
+        """
+        track_id, assigned = self.assign(submission['hit_id'].values,
+                                         submission['track_id'].values)
+        return _score_tracks(self.tracks(track_id, assigned))
+
+class IncrementalScorer(object):
+    """Score a submission that is provided in multiple chunks.
+
+    The truth-side information, i.e. the particle hit counts, the total
+    weight, and a hit id index, is computed only once. Each chunk is then
+    inserted directly into the per-hit track assignment without a merge.
+
+    Parameters
+    ----------
+    truth : pandas.DataFrame or PreparedTruth
+        Truth information. Must have hit_id, particle_id, and weight columns.
+
+    Examples
+    --------
+    >>> scorer = IncrementalScorer(truth)
+    >>> for chunk in chunks:
+    ...     scorer.update(chunk['hit_id'], chunk['track_id'])
+    >>> scorer.score()
+    """
+
+    def __init__(self, truth):
+        if not isinstance(truth, PreparedTruth):
+            truth = PreparedTruth(truth)
+        self._truth = truth
+        self.reset()
+
+    def reset(self):
+        """Remove all track assignments."""
+        self._track_id = numpy.zeros(len(self._truth), dtype='i8')
+        self._assigned = numpy.zeros(len(self._truth), dtype=bool)
+        # submitted hit ids outside the truth
+        self._unknown = numpy.empty(0, dtype='i8')
+
+    @property
+    def nassigned(self):
+        """Number of truth hits with an assigned track."""
+        return numpy.count_nonzero(self._assigned)
+
+    def update(self, hit_ids, track_ids):
+        """Assign hits to tracks.
+
+        Hits that are not part of the truth information are ignored. Each
+        hit id can only be submitted once over all updates.
+
+        Parameters
+        ----------
+        hit_ids : array_like
+            Hit identifiers.
+        track_ids : array_like
+            Track identifier for each hit.
+        """
+        self._track_id, self._assigned, self._unknown = self._truth._assign(
+            hit_ids, track_ids, self._track_id, self._assigned, self._unknown)
+
+    def tracks(self):
+        """Compute the track table for the current assignments.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Same as for `score_event` with unassigned hits as single-hit
+            tracks.
+        """
+        return self._truth.tracks(self._track_id, self._assigned)
+
+    def score(self):
+        """Compute the event score for the current assignments.
+
+        Once all chunks are added, this is identical to `score_event` for the
+        combined submission.
+        """
+        return _score_tracks(self.tracks())
+
+REPORT_BINS = OrderedDict([
+    ('pt', [0., 0.5, 1., 2., 3., 5., 10., numpy.inf]),
+    ('peta', [-4., -3., -2., -1., 0., 1., 2., 3., 4.]),
+])
+REPORT_METRICS = ['score', 'ntracks', 'nfake', 'nduplicate', 'nparticles',
+                  'nreconstructed']
+
+class EventReport(namedtuple('EventReport', ['score', 'tracks', 'particles', 'metrics', 'binned'])):
+    """Detailed score results for a single event.
+
+    Attributes
+    ----------
+    score : float
+        The event score; identical to `score_event`.
+    tracks : pandas.DataFrame
+        Track table as for `score_event` for all submitted tracks with
+        additional purity_rec, purity_maj, good, fake, and duplicate columns.
+    particles : pandas.DataFrame
+        Contains particle_id, nhits, weight, ntracks, and reconstructed
+        columns for all particles except noise, and pt and peta columns if the
+        particles information is available.
+    metrics : collections.OrderedDict
+        The counts in `REPORT_METRICS` and the derived efficiency, fake_rate,
+        and duplicate_rate.
+    binned : pandas.DataFrame
+        Contains quantity, low, high, nparticles, nreconstructed, and
+        efficiency columns with one row per bin.
+    """
+    __slots__ = ()
+
+def _rates(metrics):
+    """Add the efficiency and the fake and duplicate rates to the counts.
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        metrics['efficiency'] = numpy.true_divide(metrics['nreconstructed'], metrics['nparticles'])
+        metrics['fake_rate'] = numpy.true_divide(metrics['nfake'], metrics['ntracks'])
+        metrics['duplicate_rate'] = numpy.true_divide(metrics['nduplicate'], metrics['ntracks'])
+    return metrics
+
+def _binned(bins, counts):
+    """Convert the per-bin particle counts into the binned table.
+    """
+    records = []
+    for quantity, edges in bins.items():
+        nparticles, nreconstructed = counts[quantity]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            efficiency = numpy.true_divide(nreconstructed, nparticles)
+        for i in range(len(edges) - 1):
+            records.append((quantity, edges[i], edges[i + 1], nparticles[i],
+                            nreconstructed[i], efficiency[i]))
+    return pandas.DataFrame.from_records(records, columns=[
+        'quantity', 'low', 'high', 'nparticles', 'nreconstructed', 'efficiency'])
+
+def _bin_counts(values, reconstructed, edges):
+    """Count all and reconstructed particles in each bin.
+
+    Values outside of the bins or NaN are ignored.
+    """
+    nbins = len(edges) - 1
+    index = numpy.searchsorted(edges, values, side='right') - 1
+    # the last edge is included in the last bin
+    index[values == edges[-1]] = nbins - 1
+    inside = (0 <= index) & (index < nbins)
+    return (numpy.bincount(index[inside], minlength=nbins),
+            numpy.bincount(index[inside & reconstructed], minlength=nbins))
+
+def score_event_detailed(truth, submission, particles=None, bins=REPORT_BINS):
+    """Compute the event score together with detailed per-track and
+    per-particle results.
+
+    Everything is computed from the same track table that is used for the
+    score, i.e. without additional merges.
+
+    A submitted track is good if more than half of its hits and more than
+    half of the hits of its majority particle are shared; only good tracks
+    contribute to the score. A track is fake if the majority particle has
+    at most half of its hits or if its majority hits are noise. Additional
+    non-fake tracks of a particle, except the one with the most shared hits,
+    are duplicates. A particle is reconstructed if it has a good track.
+
+    Parameters
+    ----------
+    truth : pandas.DataFrame or PreparedTruth
+        Truth information. Must have hit_id, particle_id, and weight columns.
     submission : pandas.DataFrame
         Proposed hit/track association. Must have hit_id and track_id columns.
+    particles : pandas.DataFrame, optional
+        Particle information with particle_id, px, py, and pz columns. Adds
+        pt and peta to the particle table and enables the binned efficiency.
+    bins : Dict[str, List[float]], optional
+        Bin edges for the particle table columns used for the binned
+        efficiency, e.g. pt and peta.
+
+    Returns
+    -------
+    EventReport
+        Score, track and particle tables, summary metrics, and the binned
+        efficiency.
     """
-    tracks = _analyze_tracks(truth, submission)
-    purity_rec = numpy.true_divide(tracks['major_nhits'], tracks['nhits'])
-    purity_maj = numpy.true_divide(tracks['major_nhits'], tracks['major_particle_nhits'])
-    good_track = (0.5 < purity_rec) & (0.5 < purity_maj)
-    return tracks['major_weight'][good_track].sum()
+    if not isinstance(truth, PreparedTruth):
+        truth = PreparedTruth(truth)
+    track_id, assigned = truth.assign(submission['hit_id'].values,
+                                      submission['track_id'].values)
+    if not numpy.all(assigned):
+        track_id = track_id.astype('f8')
+        track_id[~assigned] = numpy.nan
+    with profiling.stage('score.analyze') as stage:
+        stage.rows = len(track_id)
+        tracks, code = _analyze_hits(track_id, truth.particle_code, truth.weight,
+                                     truth.total_weight, truth.unique_particle_ids,
+                                     truth.unique_particle_nhits, return_codes=True)
+    score = _score_tracks(tracks)
+
+    with profiling.stage('score.report') as stage:
+        # unassigned hits and hits with NaN track ids are not part of any
+        # submitted track
+        submitted = numpy.isfinite(tracks['track_id'].values)
+        tracks = tracks[submitted].reset_index(drop=True)
+        if submission['track_id'].values.dtype.kind in 'iu':
+            tracks['track_id'] = tracks['track_id'].astype('i8')
+        code = code[submitted]
+        major_nhits = tracks['major_nhits'].values
+        purity_rec = numpy.true_divide(major_nhits, tracks['nhits'].values)
+        purity_maj = numpy.true_divide(major_nhits, tracks['major_particle_nhits'].values)
+        # tracks made of mostly noise hits do not match any particle
+        fake = ~(0.5 < purity_rec) | (truth.unique_particle_ids[code] == 0)
+        good = ~fake & (0.5 < purity_maj)
+        # all non-fake tracks of a particle ordered by decreasing shared hits
+        matched = numpy.flatnonzero(~fake)
+        order = matched[numpy.lexsort((-major_nhits[matched], code[matched]))]
+        duplicate = numpy.zeros(len(tracks), dtype=bool)
+        duplicate[order[1:]] = (code[order[1:]] == code[order[:-1]])
+        tracks['purity_rec'] = purity_rec
+        tracks['purity_maj'] = purity_maj
+        tracks['good'] = good
+        tracks['fake'] = fake
+        tracks['duplicate'] = duplicate
+
+        ncodes = len(truth.unique_particle_ids)
+        ntracks = numpy.bincount(code[~fake], minlength=ncodes)
+        reconstructed = (0 < numpy.bincount(code[good], minlength=ncodes))
+        weight = numpy.bincount(truth.particle_code, weights=truth.weight, minlength=ncodes)
+        # noise hits and codes without hits are not particles
+        selected = (truth.unique_particle_ids != 0) & (0 < truth.unique_particle_nhits)
+        report = pandas.DataFrame.from_dict(OrderedDict([
+            ('particle_id', truth.unique_particle_ids[selected]),
+            ('nhits', truth.unique_particle_nhits[selected].astype('i8')),
+            ('weight', weight[selected]),
+            ('ntracks', ntracks[selected]),
+            ('reconstructed', reconstructed[selected]),
+        ]))
+        counts = OrderedDict()
+        if particles is not None:
+            momentum = momentum_quantities(particles['px'].values, particles['py'].values,
+                                           particles['pz'].values, quantities=['pt', 'peta'])
+            rows = _HitIndex(particles['particle_id'].values).rows(report['particle_id'].values)
+            known = (0 <= rows)
+            for name, values in momentum.items():
+                column = numpy.full(len(report), numpy.nan, dtype=values.dtype)
+                column[known] = values[rows[known]]
+                report[name] = column
+            for name, edges in bins.items():
+                counts[name] = _bin_counts(report[name].values,
+                                           report['reconstructed'].values,
+                                           numpy.asarray(edges, dtype='f8'))
+        stage.rows = len(tracks)
+
+    metrics = _rates(OrderedDict([
+        ('score', score),
+        ('ntracks', len(tracks)),
+        ('nfake', int(numpy.count_nonzero(fake))),
+        ('nduplicate', int(numpy.count_nonzero(duplicate))),
+        ('nparticles', len(report)),
+        ('nreconstructed', int(numpy.count_nonzero(report['reconstructed'].values))),
+    ]))
+    binned = _binned(OrderedDict((k, bins[k]) for k in counts), counts)
+    return EventReport(score, tracks, report, metrics, binned)
+
+class ReportAggregator(object):
+    """Aggregate detailed score results over many events.
+
+    Only the summed counts are kept, i.e. memory usage does not grow with
+    the number of events.
+
+    Examples
+    --------
+    >>> aggregator = ReportAggregator()
+    >>> for truth, submission, particles in events:
+    ...     aggregator.update(score_event_detailed(truth, submission, particles))
+    >>> aggregator.metrics()
+    >>> aggregator.binned()
+    """
+
+    def __init__(self):
+        self.nevents = 0
+        self._counts = OrderedDict((_, 0) for _ in REPORT_METRICS)
+        self._bins = None
+        self._binned = None
+
+    def update(self, report):
+        """Add the results of one event.
+
+        Parameters
+        ----------
+        report : EventReport
+            Results as returned by `score_event_detailed`.
+        """
+        if self._bins is None:
+            self._bins = report.binned[['quantity', 'low', 'high']].copy()
+            self._binned = report.binned[['nparticles', 'nreconstructed']].values.copy()
+        elif not self._bins.equals(report.binned[['quantity', 'low', 'high']]):
+            raise Exception('Reports with different bins can not be aggregated')
+        else:
+            self._binned += report.binned[['nparticles', 'nreconstructed']].values
+        for name in REPORT_METRICS:
+            self._counts[name] += report.metrics[name]
+        self.nevents += 1
+
+    def metrics(self):
+        """Return the aggregated metrics.
+
+        Returns
+        -------
+        collections.OrderedDict
+            The mean score over all events, the summed counts, and the rates
+            computed from the summed counts.
+        """
+        metrics = OrderedDict(self._counts)
+        metrics['score'] = (metrics['score'] / self.nevents) if self.nevents else float('nan')
+        return _rates(metrics)
+
+    def binned(self):
+        """Return the aggregated binned efficiency.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Same as `EventReport.binned` with counts summed over all events.
+        """
+        if self._bins is None:
+            return _binned(OrderedDict(), {})
+        binned = self._bins.copy()
+        binned['nparticles'] = self._binned[:, 0]
+        binned['nreconstructed'] = self._binned[:, 1]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            binned['efficiency'] = numpy.true_divide(self._binned[:, 1], self._binned[:, 0])
+        return binned
+
+class DatasetScore(namedtuple('DatasetScore', ['score', 'events', 'walltime'])):
+    """Scores for a full dataset.
+
+    Attributes
+    ----------
+    score : float
+        Mean event score over all scored events.
+    events : pandas.DataFrame
+        Per-event results sorted by event_id with event_id, score, load_time,
+        and score_time columns. Times are in seconds.
+    walltime : float
+        Total wall-clock time in seconds.
+    """
+    __slots__ = ()
+
+def _score_dataset_event(path, prefix, submission, result_cache=None):
+    """Load the truth for one dataset event and score the given submission.
+
+    The submission can be a `pandas.DataFrame` or a callable that returns
+    one for a given event_id. Scores are reused from the result cache if
+    available.
+    """
+    start = time.time()
+    columns = {'truth': ['hit_id', 'particle_id', 'weight']}
+    event_id, truth = _load_dataset_event(path, prefix, ['truth'], columns=columns)
+    if callable(submission):
+        submission = submission(event_id)
+    loaded = time.time()
+    if result_cache is not None:
+        score = result_cache.score_event(truth, submission)
+    else:
+        score = score_event(truth, submission)
+    return event_id, score, loaded - start, time.time() - loaded
+
+def score_dataset(path, submission, skip=None, nevents=None, workers=None,
+                  max_pending=None, result_cache=None):
+    """Compute the TrackML score for all events in a dataset.
+
+    Events are loaded and scored in a pool of worker processes. The results
+    are independent of the number of workers.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to a directory or a zip file containing event files.
+    submission : pandas.DataFrame or callable
+        Either a dataset submission with event_id, hit_id, and track_id
+        columns or a callable that returns the event submission for a given
+        event_id. A callable is evaluated in the worker processes and must
+        be picklable, e.g. a module-level function.
+    skip : int, optional
+        Skip the first `skip` events.
+    nevents : int, optional
+        Only score a maximum of `nevents` events.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of cpus. With a
+        single worker all events are scored in the current process.
+    max_pending : int, optional
+        Maximum number of events in flight at the same time. Defaults to
+        twice the number of workers.
+    result_cache : trackml.results.ResultCache, optional
+        Reuse the scores of events with unchanged truth and submission from
+        this cache and store new ones.
+
+    Returns
+    -------
+    DatasetScore
+        Mean score, per-event results, and total wall-clock time.
+    """
+    start = time.time()
+    prefixes = _list_dataset_prefixes(path, skip, nevents)
+    if isinstance(submission, pandas.DataFrame):
+        groups = submission.groupby('event_id')
+        event_ids = set(groups.groups)
+        def event_submission(prefix):
+            event_id = _extract_event_id(prefix)
+            if event_id not in event_ids:
+                return submission.iloc[:0]
+            return groups.get_group(event_id)
+    else:
+        event_submission = lambda prefix: submission
+    arguments = ((path, _, event_submission(_), result_cache) for _ in prefixes)
+    results = list(_map_processes(_score_dataset_event, arguments, workers,
+                                  max_pending))
+
+    # sort by event_id so the results do not depend on the completion order
+    results.sort(key=lambda _: _[0])
+    cols = ['event_id', 'score', 'load_time', 'score_time']
+    events = pandas.DataFrame.from_records(results, columns=cols)
+    score = events['score'].mean() if len(events) else float('nan')
+    return DatasetScore(score, events, time.time() - start)
+
+SWEEP_COLUMNS = ['event_id', 'method', 'probability', 'seed', 'score']
+
+def _sweep_records(event_id, truth, probabilities, seeds, methods):
+    """Score all randomized points for one event.
+
+    Returns
+    -------
+    list
+        One (event_id, method, probability, seed, score) record per point.
+    """
+    prepared = PreparedTruth(truth)
+    randomizer = TruthRandomizer(truth)
+    records = []
+    for method in methods:
+        generate = getattr(randomizer, '{}_codes'.format(method))
+        for seed in seeds:
+            for i, p in enumerate(probabilities):
+                # track codes are already in truth order and need no merge.
+                # the same track ids as in the submissions give the same
+                # summation order and thus bit-identical scores.
+                rng = event_generator(seed, event_id, i)
+                codes, ncodes = generate(p, rng)
+                track_id = randomizer.renumber(codes, ncodes, rng)
+                score = _score_tracks(prepared.tracks(track_id))
+                records.append((event_id, method, p, seed, score))
+    return records
+
+def _sweep_table(records):
+    """Convert the sweep records into the result table.
+    """
+    table = pandas.DataFrame.from_records(records, columns=SWEEP_COLUMNS)
+    # keep the score type, e.g. float32 for float32 weights, as `score_event`
+    if records:
+        table['score'] = numpy.array([_[-1] for _ in records])
+    return table
+
+def _check_sweep(probabilities, seeds, methods):
+    unknown = [_ for _ in methods if _ not in RANDOMIZE_METHODS]
+    if unknown:
+        raise Exception('Unknown randomize methods {}'.format(unknown))
+    return list(probabilities), list(seeds), list(methods)
+
+def score_sweep(truth, probabilities, seeds=[0], methods=RANDOMIZE_METHODS,
+                event_id=0):
+    """Compute the score for randomized truth over a grid of probabilities.
+
+    The truth-side analysis is done once and shared by all points. Each
+    point uses the same random generator as `randomize_dataset`, i.e. the
+    scores are identical to `score_event` for the submissions it generates
+    for the same probabilities and seed.
+
+    Parameters
+    ----------
+    truth : pandas.DataFrame
+        Truth information. Must have hit_id, particle_id, and weight columns.
+    probabilities : List[float]
+        Randomization probabilities.
+    seeds : List[int], optional
+        Root seeds; each probability is evaluated for each seed.
+    methods : List[{'drop', 'shuffle'}], optional
+        Randomization methods as in `randomize_dataset`.
+    event_id : int, optional
+        Event identifier used to derive the random generators.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Contains event_id, method, probability, seed, and score columns with
+        one row per point.
+    """
+    probabilities, seeds, methods = _check_sweep(probabilities, seeds, methods)
+    records = _sweep_records(event_id, truth, probabilities, seeds, methods)
+    return _sweep_table(records)
+
+def _sweep_dataset_event(path, prefix, probabilities, seeds, methods):
+    """Load the truth for one dataset event and score all points.
+    """
+    columns = {'truth': ['hit_id', 'particle_id', 'weight']}
+    event_id, truth = _load_dataset_event(path, prefix, ['truth'], columns=columns)
+    return _sweep_records(event_id, truth, probabilities, seeds, methods)
+
+def score_sweep_dataset(path, probabilities, seeds=[0], methods=RANDOMIZE_METHODS,
+                        skip=None, nevents=None, workers=None, max_pending=None):
+    """Compute the randomized truth score grid for all events in a dataset.
+
+    Events are processed in a pool of worker processes. The results are
+    independent of the number of workers.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to a directory or a zip file containing event files.
+    probabilities, seeds, methods
+        The grid of randomized points; see `score_sweep`.
+    skip : int, optional
+        Skip the first `skip` events.
+    nevents : int, optional
+        Only use a maximum of `nevents` events.
+    workers : int, optional
+        Number of worker processes. Defaults to the number of cpus. With a
+        single worker all events are processed in the current process.
+    max_pending : int, optional
+        Maximum number of events in flight at the same time. Defaults to
+        twice the number of workers.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Contains event_id, method, probability, seed, and score columns with
+        one row per event and point.
+    """
+    probabilities, seeds, methods = _check_sweep(probabilities, seeds, methods)
+    prefixes = _list_dataset_prefixes(path, skip, nevents)
+    arguments = ((path, _, probabilities, seeds, methods) for _ in prefixes)
+    results = list(_map_processes(_sweep_dataset_event, arguments, workers,
+                                  max_pending))
+
+    # same order as the events independent of the completion order
+    results.sort(key=lambda _: _[0][0] if _ else -1)
+    records = [r for _ in results for r in _]
+    return _sweep_table(records)
@@ -0,0 +1,247 @@
+"""TrackML spatial hit index for window and neighbor queries"""
+
+import numpy
+
+def _wrap_phi(dphi):
+    """Wrap azimuthal angle differences into [-pi, pi).
+    """
+    return numpy.remainder(dphi + numpy.pi, 2 * numpy.pi) - numpy.pi
+
+def _expand_ranges(starts, stops):
+    """Concatenate the index ranges [start, stop) into one array.
+
+    Returns
+    -------
+    owner : numpy.ndarray
+        Index of the range for each entry.
+    index : numpy.ndarray
+        The index values.
+    """
+    lengths = numpy.maximum(stops - starts, 0)
+    owner = numpy.repeat(numpy.arange(len(starts)), lengths)
+    # position inside each range
+    first = numpy.cumsum(lengths) - lengths
+    index = numpy.arange(lengths.sum()) - numpy.repeat(first, lengths)
+    return owner, starts[owner] + index
+
+class SpatialIndex(object):
+    """Per-event spatial index over hits grouped by detector layer.
+
+    The hits of each (volume_id, layer_id) layer are sorted into bins in
+    the azimuthal angle phi and by z within each bin. All queries are
+    vectorized over many query points, e.g. seeds, at once.
+
+    Parameters
+    ----------
+    hits : pandas.DataFrame
+        Hits information. Must have x, y, z, volume_id, and layer_id columns
+        as returned by `load_event_hits`.
+    phi_bins : int, optional
+        Number of phi bins per layer.
+
+    Attributes
+    ----------
+    layers : List[Tuple[int, int]]
+        The sorted (volume_id, layer_id) pairs of all layers with hits.
+    phi : numpy.ndarray
+        Azimuthal angle of each hit in hits order.
+    """
+
+    def __init__(self, hits, phi_bins=64):
+        self.phi_bins = int(phi_bins)
+        self.x = hits['x'].values.astype('f8')
+        self.y = hits['y'].values.astype('f8')
+        self.z = hits['z'].values.astype('f8')
+        self.phi = numpy.arctan2(self.y, self.x)
+        volume_id = hits['volume_id'].values
+        layer_id = hits['layer_id'].values
+        self._layer_keys, layer_index = numpy.unique(
+            numpy.stack([volume_id, layer_id], axis=1), axis=0, return_inverse=True)
+        layer_index = layer_index.ravel()
+        self.layers = [tuple(int(_) for _ in key) for key in self._layer_keys]
+        self._layer_lookup = dict((key, i) for i, key in enumerate(self.layers))
+
+        # global segment id for each (layer, phi bin) pair
+        phi_bin = self._phi_bin(self.phi)
+        segment = layer_index * self.phi_bins + phi_bin
+        # z offset so that the z ranges of different segments never overlap
+        self._zmin = self.z.min() if len(self.z) else 0.
+        self._span = (self.z.max() - self._zmin + 1.) if len(self.z) else 1.
+        key = segment * self._span + (self.z - self._zmin)
+        self._order = numpy.argsort(key, kind='stable')
+        self._key = key[self._order]
+
+        # per-layer hits sorted along the axis with the largest extent
+        self._layer_axis = []
+        self._layer_rows = []
+        self._layer_values = []
+        order = numpy.argsort(layer_index, kind='stable')
+        bounds = numpy.searchsorted(layer_index[order], numpy.arange(len(self.layers) + 1))
+        for i in range(len(self.layers)):
+            rows = order[bounds[i]:bounds[i + 1]]
+            self._add_layer(rows)
+        # all hits for queries without a layer selection
+        self._all = len(self._layer_rows)
+        self._add_layer(numpy.arange(len(self.z)))
+
+    def __len__(self):
+        return len(self.z)
+
+    def _phi_bin(self, phi):
+        b = numpy.floor((phi + numpy.pi) * (self.phi_bins / (2 * numpy.pi))).astype('i8')
+        return numpy.remainder(b, self.phi_bins)
+
+    def _add_layer(self, rows):
+        points = (self.x[rows], self.y[rows], self.z[rows])
+        extents = [(v.max() - v.min()) if len(v) else 0. for v in points]
+        axis = int(numpy.argmax(extents))
+        order = numpy.argsort(points[axis], kind='stable')
+        self._layer_axis.append(axis)
+        self._layer_rows.append(rows[order])
+        self._layer_values.append(points[axis][order])
+
+    def _layer_index(self, volume_id, layer_id, size):
+        """Return the layer index for each query or -1 for unknown layers.
+        """
+        volume_id = numpy.broadcast_to(volume_id, (size,))
+        layer_id = numpy.broadcast_to(layer_id, (size,))
+        pairs = numpy.stack([volume_id, layer_id], axis=1).astype('i8')
+        unique_pairs, inverse = numpy.unique(pairs, axis=0, return_inverse=True)
+        lookup = numpy.array([self._layer_lookup.get(tuple(int(_) for _ in p), -1)
+                              for p in unique_pairs], dtype='i8')
+        return lookup[inverse.ravel()]
+
+    def window(self, volume_id, layer_id, phi, z, dphi, dz):
+        """Find the hits on a layer inside a phi/z window around each query.
+
+        The phi window correctly wraps around at +-pi.
+
+        Parameters
+        ----------
+        volume_id, layer_id : int or array_like
+            Layer to search for each query.
+        phi, z : array_like
+            Window center for each query.
+        dphi, dz : float or array_like
+            Half-width of the window in phi and z for each query.
+
+        Returns
+        -------
+        offsets : numpy.ndarray
+            The hits for query i are `rows[offsets[i]:offsets[i + 1]]`.
+        rows : numpy.ndarray
+            Row index into the hits for all found hits.
+        """
+        phi = numpy.atleast_1d(numpy.asarray(phi, dtype='f8'))
+        size = len(phi)
+        z = numpy.broadcast_to(numpy.asarray(z, dtype='f8'), (size,))
+        dphi = numpy.broadcast_to(numpy.asarray(dphi, dtype='f8'), (size,))
+        dz = numpy.broadcast_to(numpy.asarray(dz, dtype='f8'), (size,))
+        layer = self._layer_index(volume_id, layer_id, size)
+
+        # phi bins covered by each window, wrapping around if necessary
+        width = 2 * numpy.pi / self.phi_bins
+        first = numpy.floor((phi - dphi + numpy.pi) / width).astype('i8')
+        last = numpy.floor((phi + dphi + numpy.pi) / width).astype('i8')
+        nbins = numpy.clip(last - first + 1, 0, self.phi_bins)
+        nbins[layer < 0] = 0
+        query, ibin = _expand_ranges(first, first + nbins)
+        segment = layer[query] * self.phi_bins + numpy.remainder(ibin, self.phi_bins)
+
+        # z range inside each segment; widened slightly against rounding
+        eps = 1e-6 * self._span
+        lo = numpy.clip(z[query] - dz[query] - self._zmin - eps, 0., self._span)
+        hi = numpy.clip(z[query] + dz[query] - self._zmin + eps, 0., self._span)
+        start = numpy.searchsorted(self._key, segment * self._span + lo, side='left')
+        stop = numpy.searchsorted(self._key, segment * self._span + hi, side='right')
+        candidate, position = _expand_ranges(start, stop)
+        query = query[candidate]
+        rows = self._order[position]
+
+        # exact selection
+        keep = (numpy.absolute(self.z[rows] - z[query]) <= dz[query])
+        keep &= (numpy.absolute(_wrap_phi(self.phi[rows] - phi[query])) <= dphi[query])
+        query = query[keep]
+        rows = rows[keep]
+        offsets = numpy.zeros(size + 1, dtype='i8')
+        numpy.cumsum(numpy.bincount(query, minlength=size), out=offsets[1:])
+        return offsets, rows
+
+    def nearest(self, x, y, z, k=1, volume_id=None, layer_id=None):
+        """Find the k nearest hits in 3d for each query point.
+
+        The search is exact. It uses an expanding window along the sorted
+        coordinate with the largest extent on each layer.
+
+        Parameters
+        ----------
+        x, y, z : array_like
+            Query points.
+        k : int, optional
+            Number of neighbors.
+        volume_id, layer_id : int or array_like, optional
+            Only search the given layer for each query. All hits are searched
+            by default.
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            Row index into the hits with shape (n, k) sorted by distance.
+            Missing neighbors, e.g. on layers with less than k hits, are -1.
+        distances : numpy.ndarray
+            Distance for each neighbor; infinite for missing neighbors.
+        """
+        x = numpy.atleast_1d(numpy.asarray(x, dtype='f8'))
+        size = len(x)
+        y = numpy.broadcast_to(numpy.asarray(y, dtype='f8'), (size,))
+        z = numpy.broadcast_to(numpy.asarray(z, dtype='f8'), (size,))
+        if volume_id is None:
+            layer = numpy.full(size, self._all, dtype='i8')
+        else:
+            layer = self._layer_index(volume_id, layer_id, size)
+        rows = numpy.full((size, k), -1, dtype='i8')
+        distances = numpy.full((size, k), numpy.inf)
+        for i in numpy.unique(layer[0 <= layer]):
+            queries = numpy.flatnonzero(layer == i)
+            r, d = self._nearest_layer(i, x[queries], y[queries], z[queries], k)
+            rows[queries] = r
+            distances[queries] = d
+        return rows, distances
+
+    def _nearest_layer(self, i, x, y, z, k):
+        """Exact k nearest neighbors on a single layer.
+        """
+        layer_rows = self._layer_rows[i]
+        values = self._layer_values[i]
+        n = len(layer_rows)
+        rows = numpy.full((len(x), k), -1, dtype='i8')
+        distances = numpy.full((len(x), k), numpy.inf)
+        if n == 0:
+            return rows, distances
+        q = (x, y, z)[self._layer_axis[i]]
+        center = numpy.searchsorted(values, q)
+        pending = numpy.arange(len(x))
+        half = k
+        while len(pending):
+            lo = center[pending] - half
+            hi = center[pending] + half
+            position = lo[:, None] + numpy.arange(2 * half)
+            valid = (0 <= position) & (position < n)
+            candidates = layer_rows[numpy.clip(position, 0, n - 1)]
+            d = numpy.sqrt((self.x[candidates] - x[pending, None])**2 +
+                           (self.y[candidates] - y[pending, None])**2 +
+                           (self.z[candidates] - z[pending, None])**2)
+            d[~valid] = numpy.inf
+            best = numpy.argsort(d, axis=1, kind='stable')[:, :k]
+            best_d = numpy.take_along_axis(d, best, axis=1)
+            best_rows = numpy.take_along_axis(candidates, best, axis=1)
+            best_rows[numpy.isinf(best_d)] = -1
+            # hits outside the window are at least as far as the window edges
+            kth = best_d[:, -1]
+            done = (lo <= 0) | ((q[pending] - values[numpy.clip(lo - 1, 0, n - 1)]) >= kth)
+            done &= (n <= hi) | ((values[numpy.clip(hi, 0, n - 1)] - q[pending]) >= kth)
+            rows[pending[done]] = best_rows[done]
+            distances[pending[done]] = best_d[done]
+            pending = pending[~done]
+            half *= 2
+        return rows, distances
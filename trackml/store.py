@@ -0,0 +1,192 @@
+"""TrackML memory-mapped event store
+
+A store packs a full dataset into one contiguous binary file per column and
+part, together with per-part offsets that locate each event. The column files
+are memory-mapped so the data for a single event is returned without copying.
+
+The store is a directory with the following content:
+
+    index.json              parts, columns, and dtypes
+    event_ids.npy           sorted event identifiers
+    <part>-offsets.npy      per-event start offsets with an additional end entry
+    <part>-<column>.bin     raw column data for all events
+"""
+
+from collections import OrderedDict
+import json
+import os
+import os.path as op
+
+import numpy
+
+from ._lazy import lazy_import
+from .dataset import DEFAULT_PARTS, DTYPES, load_dataset
+
+pandas = lazy_import('pandas')
+
+STORE_VERSION = 1
+
+def build_store(path, store, skip=None, nevents=None, parts=DEFAULT_PARTS):
+    """Pack (all) events of a dataset into a memory-mapped event store.
+
+    The events are converted one after the other and only a single event is
+    kept in memory.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to a directory or a zip file containing event files.
+    store : str or pathlib.Path
+        Output directory for the event store. Existing store files are
+        overwritten.
+    skip : int, optional
+        Skip the first `skip` events.
+    nevents : int, optional
+        Only store a maximum of `nevents` events.
+    parts : List[{'hits', 'cells', 'particles', 'truth'}], optional
+        Which parts of the event files to store.
+
+    Returns
+    -------
+    EventStore
+        The newly created event store.
+    """
+    store = str(store)
+    if not op.isdir(store):
+        os.makedirs(store)
+    event_ids = []
+    offsets = dict((name, [0]) for name in parts)
+    files = dict(((name, column), open(_column_file(store, name, column), 'wb'))
+                 for name in parts for column in DTYPES[name])
+    try:
+        for data in load_dataset(path, skip, nevents, parts):
+            event_ids.append(data[0])
+            for name, df in zip(parts, data[1:]):
+                for column, dtype in DTYPES[name].items():
+                    values = numpy.ascontiguousarray(df[column].values, dtype=dtype)
+                    files[name, column].write(values.tobytes())
+                offsets[name].append(offsets[name][-1] + len(df))
+    finally:
+        for f in files.values():
+            f.close()
+    numpy.save(op.join(store, 'event_ids.npy'), numpy.array(event_ids, dtype='i8'))
+    for name in parts:
+        numpy.save(_offsets_file(store, name), numpy.array(offsets[name], dtype='i8'))
+    index = {
+        'version': STORE_VERSION,
+        'parts': [[name, [[c, numpy.dtype(d).str] for c, d in DTYPES[name].items()]]
+                  for name in parts],
+    }
+    with open(op.join(store, 'index.json'), 'w') as f:
+        json.dump(index, f)
+    return EventStore(store)
+
+def _column_file(store, name, column):
+    return op.join(store, '{}-{}.bin'.format(name, column))
+
+def _offsets_file(store, name):
+    return op.join(store, '{}-offsets.npy'.format(name))
+
+class EventStore(object):
+    """Read-only, memory-mapped access to the events in an event store.
+
+    Parameters
+    ----------
+    store : str or pathlib.Path
+        Event store directory created with `build_store`.
+
+    Notes
+    -----
+    All returned arrays and DataFrames are views into read-only memory maps.
+    Modifications require an explicit copy.
+    """
+
+    def __init__(self, store):
+        self.path = str(store)
+        with open(op.join(self.path, 'index.json'), 'r') as f:
+            index = json.load(f)
+        if index['version'] != STORE_VERSION:
+            raise Exception('Unsupported event store version {}'.format(index['version']))
+        self.event_ids = numpy.load(op.join(self.path, 'event_ids.npy'))
+        self._event_index = dict((int(_), i) for i, _ in enumerate(self.event_ids))
+        self._offsets = {}
+        self._columns = {}
+        self.parts = []
+        for name, columns in index['parts']:
+            self.parts.append(name)
+            offsets = numpy.load(_offsets_file(self.path, name))
+            self._offsets[name] = offsets
+            self._columns[name] = [
+                (column, self._map(_column_file(self.path, name, column), dtype, offsets[-1]))
+                for column, dtype in columns]
+
+    @staticmethod
+    def _map(path, dtype, size):
+        # empty files can not be memory-mapped
+        if size == 0:
+            return numpy.empty(0, dtype=dtype)
+        # plain array view, the mapping is kept alive as its base
+        return numpy.memmap(path, dtype=dtype, mode='r', shape=(int(size),)).view(numpy.ndarray)
+
+    def __len__(self):
+        return len(self.event_ids)
+
+    def __contains__(self, event_id):
+        return event_id in self._event_index
+
+    def __iter__(self):
+        """Iterate over all events in the same way as `load_dataset`."""
+        for event_id in self.event_ids:
+            yield (int(event_id),) + self.load_event(event_id)
+
+    def column(self, name, column):
+        """Return the memory-mapped column for all events of one part."""
+        return dict(self._columns[name])[column]
+
+    def offsets(self, name):
+        """Return the per-event start offsets with an additional end entry."""
+        return self._offsets[name]
+
+    def load_event_arrays(self, event_id, name):
+        """Return the column arrays of one event part as views.
+
+        Parameters
+        ----------
+        event_id : int
+            The event identifier.
+        name : {'hits', 'cells', 'particles', 'truth'}
+            Which part of the event to return.
+
+        Returns
+        -------
+        collections.OrderedDict
+            Maps the column names to the array slices for the event.
+        """
+        try:
+            i = self._event_index[int(event_id)]
+        except KeyError:
+            raise KeyError('Event {} is not in the store'.format(event_id))
+        start, end = self._offsets[name][i:i + 2]
+        return OrderedDict((column, values[start:end])
+                           for column, values in self._columns[name])
+
+    def load_event(self, event_id, parts=None):
+        """Load data for a single event without copying.
+
+        Parameters
+        ----------
+        event_id : int
+            The event identifier.
+        parts : List[{'hits', 'cells', 'particles', 'truth'}], optional
+            Which parts of the event to load. Defaults to all stored parts.
+
+        Returns
+        -------
+        tuple
+            Contains a `pandas.DataFrame` for each element of `parts` with
+            the same columns and types as returned by `load_event`.
+        """
+        if parts is None:
+            parts = self.parts
+        return tuple(pandas.DataFrame(self.load_event_arrays(event_id, name), copy=False)
+                     for name in parts)
@@ -2,32 +2,170 @@
 
 __authors__ = ['Moritz Kiehn']
 
+from collections import OrderedDict
+
 import numpy as np
 
+POSITION_QUANTITIES = ['rho', 'phi', 'r', 'eta', 'theta']
+MOMENTUM_QUANTITIES = ['pt', 'pphi', 'peta', 'p']
+
+def _float_dtype(*arrays):
+    """Floating point type for the results, i.e. the input type if possible.
+    """
+    return np.result_type(np.float32, *arrays)
+
+def _outputs(out, names, size, dtype):
+    """Use or allocate the output arrays for the selected quantities.
+    """
+    out = dict(out or {})
+    for name in names:
+        if name not in out:
+            out[name] = np.empty(size, dtype=dtype)
+    return out
+
+def position_quantities(x, y, z, out=None, quantities=POSITION_QUANTITIES):
+    """Compute derived position quantities rho, phi, r, eta, and theta.
+
+    The quantities are computed in the floating point type of the inputs,
+    e.g. float32 for the hits, without intermediate temporaries. Inputs can
+    be any arrays, e.g. DataFrame columns or memory-mapped store columns.
+
+    Parameters
+    ----------
+    x, y, z : array_like
+        Cartesian coordinates.
+    out : Dict[str, numpy.ndarray], optional
+        Preallocated output arrays for some or all quantities.
+    quantities : List[str], optional
+        The quantities to compute.
+
+    Returns
+    -------
+    collections.OrderedDict
+        Maps each selected quantity to its array.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    z = np.asarray(z)
+    dtype = _float_dtype(x, y, z)
+    # rho is needed for the other quantities even if not requested
+    needed = set(quantities)
+    if needed & set(['r', 'eta', 'theta']):
+        needed.add('rho')
+    out = _outputs(out, [_ for _ in POSITION_QUANTITIES if _ in needed], len(x), dtype)
+    if 'rho' in needed:
+        np.hypot(x, y, out=out['rho'])
+    if 'phi' in needed:
+        np.arctan2(y, x, out=out['phi'])
+    if 'r' in needed:
+        np.hypot(out['rho'], z, out=out['r'])
+    if 'eta' in needed:
+        # equivalent to arctanh(z / r) but without loss of precision for
+        # small angles in single precision
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(z, out['rho'], out=out['eta'])
+            np.arcsinh(out['eta'], out=out['eta'])
+    if 'theta' in needed:
+        np.arctan2(out['rho'], z, out=out['theta'])
+    return OrderedDict((_, out[_]) for _ in quantities)
+
+def momentum_quantities(px, py, pz, out=None, quantities=MOMENTUM_QUANTITIES):
+    """Compute derived momentum quantities pt, pphi, peta, and p.
+
+    The quantities are computed in the floating point type of the inputs
+    without intermediate temporaries; see `position_quantities`.
+
+    Parameters
+    ----------
+    px, py, pz : array_like
+        Cartesian momentum components.
+    out : Dict[str, numpy.ndarray], optional
+        Preallocated output arrays for some or all quantities.
+    quantities : List[str], optional
+        The quantities to compute.
+
+    Returns
+    -------
+    collections.OrderedDict
+        Maps each selected quantity to its array.
+    """
+    px = np.asarray(px)
+    py = np.asarray(py)
+    pz = np.asarray(pz)
+    dtype = _float_dtype(px, py, pz)
+    needed = set(quantities)
+    if needed & set(['peta', 'p']):
+        needed.add('pt')
+    if 'peta' in needed:
+        needed.add('p')
+    out = _outputs(out, [_ for _ in MOMENTUM_QUANTITIES if _ in needed], len(px), dtype)
+    if 'pt' in needed:
+        np.hypot(px, py, out=out['pt'])
+    if 'pphi' in needed:
+        np.arctan2(py, px, out=out['pphi'])
+    if 'p' in needed:
+        np.hypot(out['pt'], pz, out=out['p'])
+    if 'peta' in needed:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(pz, out['p'], out=out['peta'])
+            np.arctanh(out['peta'], out=out['peta'])
+    return OrderedDict((_, out[_]) for _ in quantities)
+
+def _compute_batch(kernel, a, b, c, quantities):
+    """Evaluate a kernel once for the concatenated arrays of many events.
+    """
+    sizes = [len(_) for _ in a]
+    offsets = np.concatenate([[0], np.cumsum(sizes, dtype='i8')])
+    results = kernel(np.concatenate(a), np.concatenate(b), np.concatenate(c),
+                     quantities=quantities)
+    # per-event views into the shared output buffers
+    return [OrderedDict((k, v[offsets[i]:offsets[i + 1]]) for k, v in results.items())
+            for i in range(len(sizes))]
+
+def position_quantities_batch(xs, ys, zs, quantities=POSITION_QUANTITIES):
+    """Compute derived position quantities for many events in one call.
+
+    Parameters
+    ----------
+    xs, ys, zs : List[array_like]
+        Cartesian coordinates for each event.
+    quantities : List[str], optional
+        The quantities to compute.
+
+    Returns
+    -------
+    List[collections.OrderedDict]
+        The quantities for each event as in `position_quantities`. The
+        arrays are views into buffers shared by all events.
+    """
+    return _compute_batch(position_quantities, xs, ys, zs, quantities)
+
+def momentum_quantities_batch(pxs, pys, pzs, quantities=MOMENTUM_QUANTITIES):
+    """Compute derived momentum quantities for many events in one call.
+
+    See `position_quantities_batch`.
+    """
+    return _compute_batch(momentum_quantities, pxs, pys, pzs, quantities)
+
 def add_position_quantities(data, prefix=''):
     """Add derived position quantities rho, phi, and r.
     """
-    x = data['{}x'.format(prefix)]
-    y = data['{}y'.format(prefix)]
-    z = data['{}z'.format(prefix)]
-    t = np.hypot(x, y)
-    data['{}rho'.format(prefix)] = t
-    data['{}phi'.format(prefix)] = np.arctan2(y, x)
-    data['{}r'.format(prefix)] = np.hypot(t, z)
+    quantities = position_quantities(data['{}x'.format(prefix)],
+                                     data['{}y'.format(prefix)],
+                                     data['{}z'.format(prefix)],
+                                     quantities=['rho', 'phi', 'r'])
+    for name, values in quantities.items():
+        data['{}{}'.format(prefix, name)] = values
     return data
 
 def add_momentum_quantities(data, prefix=''):
     """Add derived momentum quantities pt, pphi, peta, p.
     """
-    px = data['{}px'.format(prefix)]
-    py = data['{}py'.format(prefix)]
-    pz = data['{}pz'.format(prefix)]
-    pt = np.hypot(px, py)
-    p = np.hypot(pt, pz)
-    data['{}pt'.format(prefix)] = pt
-    data['{}pphi'.format(prefix)] = np.arctan2(py, px)
-    data['{}peta'.format(prefix)] = np.arctanh(pz / p)
-    data['{}p'.format(prefix)] = p
+    quantities = momentum_quantities(data['{}px'.format(prefix)],
+                                     data['{}py'.format(prefix)],
+                                     data['{}pz'.format(prefix)])
+    for name, values in quantities.items():
+        data['{}{}'.format(prefix, name)] = values
     return data
 
 def decode_particle_id(data):
@@ -4,13 +4,15 @@ from __future__ import print_function
 
 __authors__ = ['Moritz Kiehn']
 
-import math
-
 import numpy
-import pandas
 
+from . import profiling
+from ._lazy import lazy_import
+from .dataset import _map_processes
 from .utils import decode_particle_id
 
+pandas = lazy_import('pandas')
+
 def _compute_order_weight_matrix(proposal, min_hits, max_hits):
     """Compute the hit order weight matrix.
 
@@ -30,12 +32,32 @@ def _compute_order_weight_matrix(proposal, min_hits, max_hits):
         w[nhits, :nhits] = weights
     return w
 
+# order weight matrices keyed by proposal, min_hits, and max_hits
+_ORDER_MATRICES = {}
+
+def _order_weight_matrix(proposal, min_hits, max_hits):
+    """Return the memoized, read-only hit order weight matrix.
+    """
+    key = (tuple(float(_) for _ in proposal), int(min_hits), int(max_hits))
+    w = _ORDER_MATRICES.get(key)
+    if w is None:
+        w = _compute_order_weight_matrix(proposal, min_hits, max_hits)
+        w.flags.writeable = False
+        _ORDER_MATRICES[key] = w
+    return w
+
 ORDER_PROPOSAL = [10., 8., 6., 5., 3., 3., 3., 5., 6.]
 ORDER_MIN_HITS = 4
 ORDER_MAX_HITS = 20
-ORDER_MATRIX = _compute_order_weight_matrix(ORDER_PROPOSAL, ORDER_MIN_HITS, ORDER_MAX_HITS)
+
+def __getattr__(name):
+    # the default order weight matrix is only computed on first use
+    if name == 'ORDER_MATRIX':
+        return _order_weight_matrix(ORDER_PROPOSAL, ORDER_MIN_HITS, ORDER_MAX_HITS)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 def print_order_weight_matrix(prefix=''):
+    ORDER_MATRIX = DEFAULT_MODEL.order_matrix
     print(prefix, 'order weight matrix (weights in percent):', sep='')
     print(prefix, 'nhits | ihit', sep='')
     print(prefix, '      |', sep='', end='')
@@ -66,7 +88,52 @@ def weight_order(args):
         raise Exception("total number of hits ", nhits, " is below zero")
     if ihit < 0:
         raise Exception("hit index ", ihit, " is below zero")
-    return ORDER_MATRIX[nhits, ihit]
+    return DEFAULT_MODEL.order_matrix[nhits, ihit]
+
+def weight_order_array(ihit, nhits):
+    """Return the weights due to the hit order for arrays of hits.
+
+    This is the vectorized equivalent of `weight_order` with identical
+    warnings and errors.
+
+    Parameters
+    ----------
+    ihit : array_like
+        Hit index along the track.
+    nhits : array_like
+        Total number of hits on the track.
+
+    Returns
+    -------
+    numpy.ndarray
+        The weight for each hit.
+    """
+    return _weight_order_array(ihit, nhits, DEFAULT_MODEL.order_matrix,
+                               ORDER_MIN_HITS, ORDER_MAX_HITS)
+
+def _weight_order_array(ihit, nhits, matrix, min_hits, max_hits):
+    """Look up the hit order weights in the given weight matrix.
+    """
+    ihit = numpy.asarray(ihit)
+    nhits = numpy.asarray(nhits)
+    valid = (min_hits <= nhits)
+    nhits = numpy.minimum(nhits, max_hits)
+    too_long = valid & (max_hits <= ihit)
+    for i in ihit[too_long]:
+        print("warning long true track ihit ", i, " proceeding with weight zero.")
+    valid &= ~too_long
+    invalid = valid & (nhits <= ihit)
+    if numpy.any(invalid):
+        i = numpy.argmax(invalid)
+        raise Exception("hit index ", int(ihit[i]), " is larger than total number of hits ", int(nhits[i]))
+    invalid = valid & (ihit < 0)
+    if numpy.any(invalid):
+        i = numpy.argmax(invalid)
+        raise Exception("hit index ", int(ihit[i]), " is below zero")
+    # clip indices so that invalid entries can be looked up as well
+    weights = matrix[numpy.clip(nhits, 0, max_hits),
+                     numpy.clip(ihit, 0, max_hits - 1)]
+    return numpy.where(valid, weights, 0.)
 
 def weight_pt(pt, pt_inf=0.5, pt_sup=3, w_min=0.2, w_max=1.):
     """Return the transverse momentum dependent hit weight.
@@ -79,6 +146,216 @@ def weight_pt(pt, pt_inf=0.5, pt_sup=3, w_min=0.2, w_max=1.):
 # particle id for noise hits
 INVALID_PARTICLED_ID = 0
 
+def _shared_codes(truth, particles):
+    """Check that truth and particles use the same dense particle codes.
+
+    This is only guaranteed if both were compacted together, e.g. in one
+    `load_event` call. The codes must map to the particle ids consistently
+    in both inputs and in the same order as the particle ids.
+    """
+    if ('particle_code' not in truth) or ('particle_code' not in particles):
+        return False
+    codes = [truth['particle_code'].values, particles['particle_code'].values]
+    ids = [truth['particle_id'].values, particles['particle_id'].values]
+    size = max(_.max(initial=-1) for _ in codes) + 1
+    code_ids = numpy.zeros(size, dtype='i8')
+    used = numpy.zeros(size, dtype=bool)
+    for code, pid in zip(codes, ids):
+        code_ids[code] = pid
+        used[code] = True
+    # same particle id for each code everywhere ...
+    if not all(numpy.array_equal(code_ids[code], pid) for code, pid in zip(codes, ids)):
+        return False
+    # ... and a different one for each code
+    used_ids = code_ids[used]
+    return bool(numpy.all(used_ids[1:] > used_ids[:-1]))
+
+def _lookup_particles(truth, selected, particle_code):
+    """Add the selected per-particle columns to truth via dense particle codes.
+
+    This is equivalent to a left merge on particle_id, but uses a direct
+    array lookup of the particle row for each hit.
+    """
+    truth_code = truth['particle_code'].values
+    size = max(truth_code.max(initial=-1), particle_code.max(initial=-1)) + 1
+    row = numpy.full(size, -1, dtype='i8')
+    row[particle_code] = numpy.arange(len(particle_code))
+    # hits w/o associated particle get missing values as in the merge
+    found = selected.reset_index(drop=True).reindex(row[truth_code])
+    found = found.drop(columns=['particle_id']).reset_index(drop=True)
+    return pandas.concat([truth.reset_index(drop=True), found], axis=1)
+
+def _combine_truth_particles(truth, particles, decode=False, model=None):
+    """Combine truth and particles information and compute the hit order.
+
+    Dense particle codes are used for the lookup if both inputs have the
+    same particle_code mapping. The weights are computed with the given
+    `WeightModel` or with the default one.
+
+    Returns
+    -------
+    pandas.DataFrame
+        `truth` augmented with additional columns: particle_vz,
+        particle_nhits, weight_pt, the decoded particle id if requested,
+        abs_dvz, ihit, and weight_order.
+    """
+    if model is None:
+        model = DEFAULT_MODEL
+    # fill selected per-particle information for each hit
+    selected = pandas.DataFrame({
+        'particle_id': particles['particle_id'],
+        'particle_vz': particles['vz'],
+        'particle_nhits': particles['nhits'],
+        'weight_pt': model.weight_pt(numpy.hypot(particles['px'], particles['py'])),
+    })
+    if decode:
+        selected = decode_particle_id(selected)
+    with profiling.stage('weights.merge') as stage:
+        if _shared_codes(truth, particles):
+            combined = _lookup_particles(truth, selected, particles['particle_code'].values)
+        else:
+            combined = pandas.merge(truth, selected,
+                                    how='left', on=['particle_id'],
+                                    validate='many_to_one')
+        stage.rows = len(combined)
+
+    with profiling.stage('weights.order') as stage:
+        # fix pt weight for hits w/o associated particle
+        combined['weight_pt'] = combined['weight_pt'].fillna(0.0)
+        # fix nhits for hits w/o associated particle
+        combined['particle_nhits'] = combined['particle_nhits'].fillna(0.0).astype('i4')
+        # compute hit count and order using absolute distance from particle vertex
+        combined['abs_dvz'] = numpy.absolute(combined['tz'] - combined['particle_vz'])
+        key = 'particle_code' if ('particle_code' in combined) else 'particle_id'
+        ihit = combined.groupby(key)['abs_dvz'].rank() - 1
+        combined['ihit'] = ihit.fillna(0.0).astype('i4')
+        # compute order-dependent weight
+        combined['weight_order'] = model.weight_order(combined['ihit'].values,
+                                                      combined['particle_nhits'].values)
+        stage.rows = len(combined)
+    return combined
+
+def _weight_event(model, truth, particles):
+    return model.weight_hits(truth, particles)
+
+class WeightModel(object):
+    """Configurable per-hit weights for the scoring metric.
+
+    The lookup tables are computed once on first use and are shared between
+    all models with the same parameters.
+
+    Parameters
+    ----------
+    proposal : List[float], optional
+        Hit order weight proposal that is interpolated to the number of hits
+        on each track.
+    min_hits, max_hits : int, optional
+        Tracks with less than `min_hits` hits have zero weight; tracks with
+        more than `max_hits` hits use the weights for `max_hits`.
+    pt_inf, pt_sup, w_min, w_max : float, optional
+        Transverse momentum thresholds and weights; see `weight_pt`.
+    primary_only : bool, optional
+        Only hits from primary particles, i.e. with generation zero, have a
+        non-zero weight as in the phase 2 metric.
+    """
+
+    def __init__(self, proposal=ORDER_PROPOSAL, min_hits=ORDER_MIN_HITS,
+                 max_hits=ORDER_MAX_HITS, pt_inf=0.5, pt_sup=3, w_min=0.2,
+                 w_max=1., primary_only=False):
+        self.proposal = list(proposal)
+        self.min_hits = int(min_hits)
+        self.max_hits = int(max_hits)
+        self.pt_inf = pt_inf
+        self.pt_sup = pt_sup
+        self.w_min = w_min
+        self.w_max = w_max
+        self.primary_only = primary_only
+        self._order_matrix = None
+        # lower cut just to be sure, should not happen except maybe for noise hits
+        self._pt_xp = numpy.array([min(0.05, pt_inf), pt_inf, pt_sup], dtype='f8')
+        self._pt_fp = numpy.array([w_min, w_min, w_max], dtype='f8')
+
+    @property
+    def order_matrix(self):
+        """The hit order weight matrix indexed by (nhits, ihit)."""
+        if self._order_matrix is None:
+            self._order_matrix = _order_weight_matrix(self.proposal, self.min_hits,
+                                                      self.max_hits)
+        return self._order_matrix
+
+    def weight_order(self, ihit, nhits):
+        """Return the weights due to the hit order; see `weight_order_array`.
+        """
+        return _weight_order_array(ihit, nhits, self.order_matrix,
+                                   self.min_hits, self.max_hits)
+
+    def weight_pt(self, pt):
+        """Return the transverse momentum dependent hit weights.
+        """
+        return numpy.interp(pt, self._pt_xp, self._pt_fp, left=0.0, right=self.w_max)
+
+    def weight_hits(self, truth, particles):
+        """Compute per-hit weights.
+
+        Hits w/ invalid particle ids, e.g. noise hits, have zero weight.
+
+        Parameters
+        ----------
+        truth : pandas.DataFrame
+            Truth information. Must have hit_id, particle_id, and tz columns.
+        particles : pandas.DataFrame
+            Particle information. Must have particle_id, vz, px, py, and nhits
+            columns.
+
+        Returns
+        -------
+        pandas.DataFrame
+            `truth` augmented with additional columns: particle_nhits, ihit,
+            weight_order, weight_pt, and weight. With `primary_only` also the
+            decoded particle id columns.
+        """
+        combined = _combine_truth_particles(truth, particles,
+                                            decode=self.primary_only, model=self)
+
+        # compute combined weight normalized to 1
+        w = combined['weight_pt'] * combined['weight_order']
+        if self.primary_only:
+            w[combined['generation'] != 0] = 0
+        w /= w.sum()
+        combined['weight'] = w
+
+        # return w/o intermediate columns
+        return combined.drop(columns=['particle_vz', 'abs_dvz'])
+
+    def weight_events(self, events, workers=None, max_pending=None):
+        """Compute per-hit weights for many events.
+
+        The events are consumed lazily, e.g. from `load_dataset`, and only a
+        bounded number of them is in flight at the same time.
+
+        Parameters
+        ----------
+        events : iterable of (pandas.DataFrame, pandas.DataFrame)
+            Truth and particles information for each event.
+        workers : int, optional
+            Number of worker processes. Defaults to the number of cpus. With
+            a single worker all events are weighted in the current process.
+        max_pending : int, optional
+            Maximum number of events in flight at the same time. Defaults to
+            twice the number of workers.
+
+        Returns
+        -------
+        iterator of pandas.DataFrame
+            The weighted truth for each event in the input order.
+        """
+        arguments = ((self, truth, particles) for truth, particles in events)
+        return _map_processes(_weight_event, arguments, workers, max_pending,
+                              ordered=True)
+
+DEFAULT_MODEL = WeightModel()
+PHASE2_MODEL = WeightModel(primary_only=True)
+
 def weight_hits_phase1(truth, particles):
     """Compute per-hit weights for the phase 1 scoring metric.
 
@@ -98,35 +375,7 @@ def weight_hits_phase1(truth, particles):
         `truth` augmented with additional columns: particle_nhits, ihit,
         weight_order, weight_pt, and weight.
     """
-    # fill selected per-particle information for each hit
-    selected = pandas.DataFrame({
-        'particle_id': particles['particle_id'],
-        'particle_vz': particles['vz'],
-        'particle_nhits': particles['nhits'],
-        'weight_pt': weight_pt(numpy.hypot(particles['px'], particles['py'])),
-    })
-    combined = pandas.merge(truth, selected,
-                            how='left', on=['particle_id'],
-                            validate='many_to_one')
-
-    # fix pt weight for hits w/o associated particle
-    combined['weight_pt'].fillna(0.0, inplace=True)
-    # fix nhits for hits w/o associated particle
-    combined['particle_nhits'].fillna(0.0, inplace=True)
-    combined['particle_nhits'] = combined['particle_nhits'].astype('i4')
-    # compute hit count and order using absolute distance from particle vertex
-    combined['abs_dvz'] = numpy.absolute(combined['tz'] - combined['particle_vz'])
-    combined['ihit'] = combined.groupby('particle_id')['abs_dvz'].rank().transform(lambda x: x - 1).fillna(0.0).astype('i4')
-    # compute order-dependent weight
-    combined['weight_order'] = combined[['ihit', 'particle_nhits']].apply(weight_order, axis=1)
-
-    # compute combined weight normalized to 1
-    w = combined['weight_pt'] * combined['weight_order']
-    w /= w.sum()
-    combined['weight'] = w
-
-    # return w/o intermediate columns
-    return combined.drop(columns=['particle_vz', 'abs_dvz'])
+    return DEFAULT_MODEL.weight_hits(truth, particles)
 
 def weight_hits_phase2(truth, particles):
     """Compute per-hit weights for the phase 2 scoring metric.
@@ -148,36 +397,4 @@ def weight_hits_phase2(truth, particles):
         `truth` augmented with additional columns: particle_nhits, ihit,
         weight_order, weight_pt, and weight.
     """
-    # fill selected per-particle information for each hit
-    selected = pandas.DataFrame({
-        'particle_id': particles['particle_id'],
-        'particle_vz': particles['vz'],
-        'particle_nhits': particles['nhits'],
-        'weight_pt': weight_pt(numpy.hypot(particles['px'], particles['py'])),
-    })
-    selected = decode_particle_id(selected)
-    combined = pandas.merge(truth, selected,
-                            how='left', on=['particle_id'],
-                            validate='many_to_one')
-
-    # fix pt weight for hits w/o associated particle
-    combined['weight_pt'].fillna(0.0, inplace=True)
-    # fix nhits for hits w/o associated particle
-    combined['particle_nhits'].fillna(0.0, inplace=True)
-    combined['particle_nhits'] = combined['particle_nhits'].astype('i4')
-
-    # compute hit count and order using absolute distance from particle vertex
-    combined['abs_dvz'] = numpy.absolute(combined['tz'] - combined['particle_vz'])
-    combined['ihit'] = combined.groupby('particle_id')['abs_dvz'].rank().transform(lambda x: x - 1).fillna(0.0).astype('i4')
-    # compute order-dependent weight
-    combined['weight_order'] = combined[['ihit', 'particle_nhits']].apply(weight_order, axis=1)
-
-    # compute normalized combined weight w/ extra particle selection
-    weight = combined['weight_pt'] * combined['weight_order']
-    weight[combined['generation'] != 0] = 0
-    weight /= weight.sum()
-    # normalize total event weight
-    combined['weight'] = weight
-
-    # return w/o intermediate columns
-    return combined.drop(columns=['particle_vz', 'abs_dvz'])
+    return PHASE2_MODEL.weight_hits(truth, particles)